@@ -3,16 +3,46 @@ app.py
 
 Основной файл приложения Flask.
 """
-import os
+import io
+import datetime
+import sys
+import json
+import click
 from flask import (
-    Flask, render_template, request, redirect, url_for, session, flash, abort
+    Flask, Response, make_response, render_template, request, redirect, url_for, session, flash, abort, g
 )
+from werkzeug.datastructures import MultiDict
 from werkzeug.security import generate_password_hash, check_password_hash # <-- Для паролей
 from config import DevelopmentConfig # или ProductionConfig
-from forms import LoginForm, TrainForm, CargoForm, ContactForm
-from models import SessionLocal, Train, Cargo, User, Contact # Убедитесь, что User импортирован
-import logging
-from logging.handlers import RotatingFileHandler
+from forms import (
+    LoginForm, TrainForm, CargoForm, ContactForm, ImportForm, SegmentForm, BulkCargoForm, BulkTrainForm
+)
+import models
+from models import SessionLocal, ReadSessionLocal, Train, Cargo, User # Убедитесь, что User импортирован
+from queries import (
+    CARGO_FILTERS, TRAIN_FILTERS, parse_filters, parse_int_arg, parse_per_page,
+    apply_cargo_filters, apply_train_filters, keyset_page
+)
+import tracking
+import bulk_import
+import bulk_ops
+import export
+import search
+import live
+import telemetry
+import history
+import eta
+import routing
+import summary
+from http_cache import http_cache, precompress_static
+from page_cache import page_cache
+from contact_queue import contact_writer
+from log_pipeline import log_pipeline
+from train_choices import train_choices
+from cache import TTLCache
+import metrics
+import hmac
+from sqlalchemy import select, tuple_
 from sqlalchemy.orm import joinedload, Session as SQLAlchemySession # <-- Для type hint
 from functools import wraps
 
@@ -25,25 +55,41 @@ app.config.from_object(DevelopmentConfig) # или ProductionConfig
 app.config["SECRET_KEY"] = app.config.get("SECRET_KEY", "dev-secret-key-replace-in-prod")
 
 # ---------------------------------------
-# Настройка логгера
+# Настройка логгера: JSON lines через очередь и фоновый поток (log_pipeline.py)
 # ---------------------------------------
-def configure_logging():
-    if not app.debug: # Не настраиваем файловый логгер в debug режиме
-        file_handler = RotatingFileHandler(
-            "error.log", maxBytes=1_000_000, backupCount=3
-        )
-        file_handler.setLevel(logging.WARNING)
-        formatter = logging.Formatter(
-            "%(asctime)s [%(levelname)s] in %(module)s: %(message)s"
-        )
-        file_handler.setFormatter(formatter)
-        app.logger.addHandler(file_handler)
+log_pipeline.init_app(app)
+app.logger.info("Логирование настроено.")
 
-    # Устанавливаем общий уровень логирования для Flask
-    app.logger.setLevel(logging.INFO)
-    app.logger.info("Логирование настроено.")
+# ---------------------------------------
+# Метрики (латентность по роутам, SQL на запрос, медленные запросы)
+# ---------------------------------------
+metrics.init_app(app, {"primary": models.engine, "read": models.read_engine})
+metrics.registry.register(metrics.CallbackMetric(
+    "tracking_cache_hits_total", "Попадания в кэш /track", "counter", lambda: tracking.tracking_cache.hits))
+metrics.registry.register(metrics.CallbackMetric(
+    "tracking_cache_misses_total", "Промахи кэша /track", "counter", lambda: tracking.tracking_cache.misses))
+metrics.registry.register(metrics.CallbackMetric(
+    "tracking_cache_entries", "Записей в кэше /track", "gauge", lambda: len(tracking.tracking_cache)))
+metrics.registry.register(metrics.CallbackMetric(
+    "page_cache_hits_total", "Страницы, отданные из кэша", "counter", lambda: page_cache.store.hits))
+metrics.registry.register(metrics.CallbackMetric(
+    "page_cache_misses_total", "Промахи кэша страниц", "counter", lambda: page_cache.store.misses))
+metrics.registry.register(metrics.CallbackMetric(
+    "contact_queue_depth", "Сообщений контактов в очереди на запись", "gauge", lambda: contact_writer.depth))
+metrics.registry.register(metrics.CallbackMetric(
+    "live_stream_connections", "Открытых SSE-потоков /track/stream", "gauge", lambda: live.broker.connections))
+metrics.registry.register(metrics.CallbackMetric(
+    "live_events_published_total", "Опубликованных живых обновлений", "counter", lambda: live.broker.published))
+
+# ---------------------------------------
+# HTTP-кэш: статика с хэшем в URL, ETag страниц, сжатие ответов
+# ---------------------------------------
+http_cache.init_app(app)
 
-configure_logging()
+# ---------------------------------------
+# Кэш страниц: прогревается в фоне по первому запросу воркера (не при импорте)
+# ---------------------------------------
+page_cache.init_app(app)
 
 # ---------------------------------------
 # Обработчики ошибок
@@ -65,38 +111,76 @@ def forbidden(e):
     app.logger.warning(f"Доступ запрещен к {request.url} для пользователя {session.get('username')}")
     return render_template("error_403.html"), 403 # И шаблон для 403
 
+# ---------------------------------------
+# Фильтры шаблонов
+# ---------------------------------------
+@app.template_filter('dt')
+def format_datetime(value, fmt="%Y-%m-%d %H:%M"):
+    """Форматирует datetime для вывода; прочие значения (в т.ч. None) отдаёт как есть."""
+    if isinstance(value, datetime.datetime):
+        return value.strftime(fmt)
+    return value
+
 # ---------------------------------------
 # Вспомогательные функции и декораторы
 # ---------------------------------------
 def get_db() -> SQLAlchemySession:
-    """Фабрика для получения сессии БД."""
-    return SessionLocal()
+    """
+    Сессия БД текущего запроса: создаётся при первом обращении, дальше
+    переиспользуется всеми функциями запроса и закрывается в shutdown_session.
+    """
+    if 'db' not in g:
+        g.db = SessionLocal()
+    return g.db
 
-# Контекстный менеджер для сессий (альтернатива постоянному with)
 @app.teardown_appcontext
 def shutdown_session(exception=None):
-    # Этот подход менее явный, чем with, но тоже работает,
-    # если не использовать with SessionLocal() as db: везде.
-    # Оставим with SessionLocal() as db: для явности.
-    pass
+    """Закрывает сессию запроса; незафиксированные изменения при ошибке откатываются."""
+    db = g.pop('db', None)
+    if db is not None:
+        if exception is not None:
+            db.rollback()
+        db.close()
+
+# Пользователи по user_id, общие для потоков воркера. Короткий TTL ограничивает, как долго
+# воркер видит старую роль или удалённого пользователя; сами объекты отсоединены от сессий.
+user_cache = TTLCache(maxsize=app.config["USER_CACHE_SIZE"], ttl=app.config["USER_CACHE_TTL"])
 
 def get_current_user():
-    """Возвращает объект пользователя из БД, если он залогинен, иначе None."""
+    """
+    Возвращает объект пользователя, если он залогинен, иначе None.
+    За запрос пользователь ищется один раз (g), между запросами - в user_cache.
+    При ошибке БД - тоже None, а в g.user_lookup_failed остаётся отметка.
+    """
+    if 'current_user' in g:
+        return g.current_user
     user_id = session.get('user_id')
-    if not user_id:
-        return None
-    try:
-        with SessionLocal() as db:
-            user = db.query(User).filter_by(user_id=user_id).first()
-        return user
-    except Exception as e:
-        app.logger.error(f"Ошибка при получении пользователя {user_id}: {e}", exc_info=True)
-        return None
+    user = None
+    if user_id:
+        user = user_cache.get(user_id)
+        if user is None:
+            try:
+                db = get_db()
+                user = db.query(User).filter_by(user_id=user_id).first()
+            except Exception as e:
+                app.logger.error(f"Ошибка при получении пользователя {user_id}: {e}", exc_info=True)
+                g.user_lookup_failed = True
+                return None
+            if user is not None:
+                db.expunge(user) # объект переживёт сессию запроса и пойдёт в общий кэш
+                user_cache.set(user_id, user)
+    g.current_user = user
+    return user
+
+def current_user_is_admin():
+    """Роль проверяется у пользователя из БД (через кэш), а не по копии в cookie сессии."""
+    user = get_current_user()
+    return user is not None and user.role == 'admin'
 
 def login_required(role=None):
     """
     Декоратор для роутов, требующих авторизации.
-    Проверяет наличие user_id в сессии и опционально роль.
+    Проверяет, что пользователь из сессии существует, и опционально его роль.
     """
     def decorator(f):
         @wraps(f)
@@ -104,14 +188,21 @@ def login_required(role=None):
             if 'user_id' not in session:
                 flash("Для доступа к этой странице требуется авторизация.", "warning")
                 return redirect(url_for('login', next=request.url)) # next для редиректа обратно
-            if role == 'admin' and session.get('role') != 'admin':
+            user = get_current_user()
+            if user is None and g.get('user_lookup_failed'):
+                # БД недоступна - это не повод разлогинивать пользователя
+                return render_template("error_500.html"), 503
+            if user is None:
+                # Пользователь удалён - сессия больше не действительна
+                session.clear()
+                flash("Сессия недействительна, войдите снова.", "warning")
+                return redirect(url_for('login', next=request.url))
+            if role == 'admin' and user.role != 'admin':
                 app.logger.warning(
                     f"Пользователь {session.get('username')} ({session.get('user_id')}) "
                     f"попытался получить доступ к admin-ресурсу {request.url} без прав."
                 )
                 abort(403) # Вызываем ошибку "Доступ запрещен"
-            # Можно добавить вызов get_current_user() и передать его в view, если нужно
-            # kwargs['current_user'] = get_current_user()
             return f(*args, **kwargs)
         return decorated_function
     return decorator
@@ -120,26 +211,30 @@ def login_required(role=None):
 # Маршруты (публичная часть)
 # ---------------------------------------
 @app.route('/')
+@page_cache.cached
 def index():
-    return render_template('index.html')
+    etag = http_cache.page_etag('index')
+    return http_cache.not_modified_response(etag) or http_cache.make_conditional(
+        make_response(render_template('index.html')), etag)
 
 @app.route('/about')
+@page_cache.cached
 def about():
-    return render_template('about.html')
+    etag = http_cache.page_etag('about')
+    return http_cache.not_modified_response(etag) or http_cache.make_conditional(
+        make_response(render_template('about.html')), etag)
 
 @app.route('/contact', methods=['GET', 'POST'])
 def contact():
     form = ContactForm()
     if form.validate_on_submit():
         try:
-            with SessionLocal() as db:
-                new_msg = Contact(
-                    name=form.name.data,
-                    email=form.email.data,
-                    message=form.message.data
-                )
-                db.add(new_msg)
-                db.commit()
+            # Запись в БД - фоновым потоком пачками (contact_queue.py), запрос её не ждёт
+            contact_writer.submit(
+                name=form.name.data,
+                email=form.email.data,
+                message=form.message.data
+            )
             flash("Сообщение отправлено! Мы свяжемся с вами.", "success")
             # Можно редиректить, чтобы избежать повторной отправки при обновлении
             return redirect(url_for('contact_success'))
@@ -151,22 +246,25 @@ def contact():
     return render_template('contact.html', form=form)
 
 @app.route('/contact/success')
+@page_cache.cached
 def contact_success():
     # Простая страница подтверждения
     return render_template('contact_success.html')
 
 
 @app.route('/track', methods=['GET', 'POST'])
+@page_cache.cached # пустая форма без параметров одинакова для всех анонимных посетителей
 def track():
     result = None
     search_type = None
     error = False
     identifier_input = None # Сохраним оригинальный ввод пользователя
 
-    if request.method == 'POST':
-        identifier_input = request.form.get('identifier', '').strip()
-        search_type = request.form.get('search_type') # 'cargo' или 'train'
-        app.logger.info(f"Попытка отслеживания: Тип={search_type}, Идентификатор='{identifier_input}'") # Логируем ввод
+    # GET с параметрами - ссылки вида /track?search_type=train&identifier=5 и страницы хронологии
+    if request.method == 'POST' or request.args.get('identifier'):
+        identifier_input = request.values.get('identifier', '').strip()
+        search_type = request.values.get('search_type') # 'cargo' или 'train'
+        app.logger.info("Попытка отслеживания: Тип=%s, Идентификатор='%s'", search_type, identifier_input) # Логируем ввод
 
         if not identifier_input or not search_type:
             flash("Введите идентификатор и выберите тип для поиска.", "warning")
@@ -186,19 +284,17 @@ def track():
 
         # Если преобразование удалось, продолжаем поиск
         try:
-            with SessionLocal() as db:
-                if search_type == 'cargo':
-                    result = db.query(Cargo).options(joinedload(Cargo.train)).filter(Cargo.cargo_id == identifier_int).first() # Используем identifier_int
-                elif search_type == 'train':
-                    result = db.query(Train).filter(Train.train_id == identifier_int).first() # Используем identifier_int
-                else:
-                    flash("Неверный тип поиска.", "danger")
-                    error = True # Не должно произойти, если форма правильная
+            if search_type in ('cargo', 'train'):
+                # Read-through кэш: БД трогаем только при промахе
+                result = tracking.lookup(search_type, identifier_int)
+            else:
+                flash("Неверный тип поиска.", "danger")
+                error = True # Не должно произойти, если форма правильная
 
             if result:
-                 app.logger.info(f"Найден результат для {search_type} ID {identifier_int}")
+                 app.logger.info("Найден результат для %s ID %s", search_type, identifier_int)
             elif not error: # Только если не было ошибки типа поиска
-                app.logger.warning(f"Объект не найден: Тип={search_type}, ID={identifier_int}")
+                app.logger.warning("Объект не найден: Тип=%s, ID=%s", search_type, identifier_int)
                 flash(f"Объект с идентификатором '{identifier_input}' не найден.", "warning")
                 error = True
 
@@ -207,12 +303,294 @@ def track():
             flash("Произошла ошибка при поиске.", "danger")
             error = True
 
+        # Хронология перемещений: страницы от новых событий к старым по курсору history_before
+        history_items, history_cursor = [], None
+        if result:
+            try:
+                history_items, history_cursor = history.timeline(
+                    search_type, identifier_int, before=request.args.get('history_before'),
+                    limit=app.config["HISTORY_PAGE_SIZE"])
+            except Exception as e:
+                app.logger.error(f"Ошибка чтения истории {search_type} ID {identifier_int}: {e}", exc_info=True)
+
+        # Расчётное прибытие уже прошло, а груз ещё в пути (ETA - пакетный расчёт eta.py)
+        overdue = bool(result and result.get('eta') and result['eta'] < datetime.datetime.now())
+
+        # ETag - из состояния объекта и страницы хронологии: если ничего не менялось, 304 без рендера
+        etag = (http_cache.page_etag('track', result, history_items, history_cursor, overdue)
+                if result and not error and request.method == 'GET' else None)
+        not_modified = http_cache.not_modified_response(etag)
+        if not_modified:
+            return not_modified
+
         # Отображаем результат (или его отсутствие)
-        return render_template('track.html', result=result, search_type=search_type, error=error, identifier=identifier_input)
+        return http_cache.make_conditional(make_response(render_template(
+            'track.html', result=result, search_type=search_type, error=error, identifier=identifier_input,
+            history=history_items, history_cursor=history_cursor, overdue=overdue)), etag)
 
     # Для GET запроса просто показываем форму
     return render_template('track.html')
 
+# ---------------------------------------
+# JSON API
+# ---------------------------------------
+@app.route('/track/stream')
+def track_stream():
+    """
+    Живые обновления (Server-Sent Events): GET /track/stream?cargo_ids=1,2&train_ids=5.
+    Первое событие snapshot - текущее состояние, дальше update (только изменившиеся поля)
+    и deleted. Браузер переподключается сам (EventSource).
+    """
+    try:
+        keys = ([('cargo', i) for i in _parse_id_list(request.args.get('cargo_ids'))] +
+                [('train', i) for i in _parse_id_list(request.args.get('train_ids'))])
+    except (TypeError, ValueError) as e:
+        return api_error(f"Некорректный список ID: {e}")
+    if not keys:
+        return api_error("Укажите cargo_ids и/или train_ids.")
+    if len(keys) > app.config["SSE_MAX_IDS"]:
+        return api_error(f"Слишком много ID в одной подписке (максимум {app.config['SSE_MAX_IDS']}).", 413)
+
+    try:
+        events = live.stream(
+            keys,
+            keepalive=app.config["SSE_KEEPALIVE_SECONDS"],
+            max_duration=app.config["SSE_MAX_STREAM_SECONDS"],
+        )
+    except live.TooManyConnections:
+        app.logger.warning("Достигнут лимит SSE-потоков, новое подключение отклонено")
+        response = api_error("Слишком много подключений, повторите позже.", 503)
+        response.headers["Retry-After"] = "30"
+        return response
+
+    return Response(events, mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no", # nginx не должен буферизовать поток
+    })
+
+def json_response(data, status=200):
+    """
+    Компактный JSON: без отступов (даже в debug) и без \\u-экранирования кириллицы.
+    """
+    body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def api_error(message, status=400):
+    return json_response({"error": message}, status)
+
+def _parse_id_list(value):
+    """
+    Список ID из JSON-массива или строки "1,2,3".
+    Дубликаты убираются с сохранением порядка; при нечисловом или дробном ID - ValueError
+    (1.7 не округляется до 1).
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = [part for part in value.split(',') if part.strip()]
+    if not isinstance(value, list):
+        raise ValueError("ожидался список идентификаторов")
+    ids = []
+    for item in value:
+        if not isinstance(item, (int, str)) or isinstance(item, bool):
+            raise ValueError(f"некорректный идентификатор: {item!r}")
+        ids.append(int(item))
+    return list(dict.fromkeys(ids))
+
+@app.route('/api/v1/track', methods=['GET', 'POST'])
+def api_track():
+    """
+    Пакетное отслеживание: до TRACK_API_MAX_IDS грузов и/или поездов за один запрос.
+    POST {"cargo_ids": [1, 2], "train_ids": [5]} или GET ?cargo_ids=1,2&train_ids=5.
+    В ответе ненайденным ID соответствует null.
+    """
+    payload = request.get_json(silent=True) if request.method == 'POST' else request.args
+    if request.method == 'POST' and not isinstance(payload, dict):
+        return api_error("Ожидалось JSON-тело запроса.")
+    try:
+        cargo_ids = _parse_id_list(payload.get('cargo_ids'))
+        train_ids = _parse_id_list(payload.get('train_ids'))
+    except (TypeError, ValueError) as e:
+        return api_error(f"Некорректный список ID: {e}")
+
+    if not cargo_ids and not train_ids:
+        return api_error("Укажите cargo_ids и/или train_ids.")
+    max_ids = app.config["TRACK_API_MAX_IDS"]
+    if len(cargo_ids) + len(train_ids) > max_ids:
+        return api_error(f"Слишком много ID в одном запросе (максимум {max_ids}).", 413)
+
+    try:
+        cargos = tracking.lookup_many('cargo', cargo_ids) if cargo_ids else {}
+        trains = tracking.lookup_many('train', train_ids) if train_ids else {}
+    except Exception as e:
+        app.logger.error(f"Ошибка пакетного отслеживания: {e}", exc_info=True)
+        return api_error("Внутренняя ошибка сервера.", 500)
+
+    etag = http_cache.page_etag('api_track', cargos, trains) if request.method == 'GET' else None
+    return http_cache.not_modified_response(etag) or http_cache.make_conditional(json_response({
+        "cargos": {str(i): tracking.to_json(cargos[i]) for i in cargo_ids},
+        "trains": {str(i): tracking.to_json(trains[i]) for i in train_ids},
+    }), etag)
+
+def _api_page(page, serializer):
+    return json_response({
+        "items": [tracking.to_json(serializer(obj)) for obj in page],
+        "next_cursor": page.next_cursor,
+        "prev_cursor": page.prev_cursor,
+    })
+
+@app.route('/api/v1/trains')
+@login_required(role='admin')
+def api_train_list():
+    """Постраничный список поездов с теми же фильтрами, что и /admin/trains (включая окна по времени)."""
+    filters = parse_filters(request.args, TRAIN_FILTERS)
+    per_page = parse_per_page(request.args, app.config["ADMIN_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
+    with ReadSessionLocal() as db:
+        page = keyset_page(
+            apply_train_filters(db.query(Train), filters), Train.train_id, per_page,
+            after=parse_int_arg(request.args, 'after'),
+            before=parse_int_arg(request.args, 'before'),
+        )
+        return _api_page(page, tracking.serialize_train)
+
+@app.route('/api/v1/cargos')
+@login_required(role='admin')
+def api_cargo_list():
+    """Постраничный список грузов с теми же фильтрами, что и /admin/cargos (включая окна по времени)."""
+    filters = parse_filters(request.args, CARGO_FILTERS)
+    per_page = parse_per_page(request.args, app.config["ADMIN_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
+    with ReadSessionLocal() as db:
+        page = keyset_page(
+            apply_cargo_filters(db.query(Cargo).options(joinedload(Cargo.train)), filters), Cargo.cargo_id, per_page,
+            after=parse_int_arg(request.args, 'after'),
+            before=parse_int_arg(request.args, 'before'),
+        )
+        return _api_page(page, tracking.serialize_cargo)
+
+@app.route('/api/v1/search')
+@login_required(role='admin')
+def api_search():
+    """
+    Полнотекстовый поиск: ?q=зерно алматы&type=cargos|trains&page=1&per_page=20.
+    Результаты упорядочены по релевантности, next_cursor / prev_cursor - номера страниц.
+    """
+    kind = request.args.get('type', 'cargos')
+    if kind not in search.INDEXES:
+        return api_error("Параметр type должен быть cargos или trains.")
+    per_page = parse_per_page(request.args, app.config["SEARCH_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
+    page = search.search(
+        kind, request.args.get('q', ''), page=parse_int_arg(request.args, 'page') or 1,
+        per_page=per_page, max_results=app.config["SEARCH_MAX_RESULTS"],
+        rank_candidates=app.config["SEARCH_RANK_CANDIDATES"],
+    )
+    serializer = tracking.serialize_cargo if kind == 'cargos' else tracking.serialize_train
+    return _api_page(page, serializer)
+
+@app.route('/api/v1/arrivals')
+@login_required(role='admin')
+def api_arrivals():
+    """
+    Ближайшие прибытия грузов по ETA: ?hours=24 - окно от текущего момента,
+    упорядочено по (eta, cargo_id); следующая страница - ?after=<next_cursor>.
+    Идёт по индексу cargos.eta, без сортировки.
+    """
+    per_page = parse_per_page(request.args, app.config["ADMIN_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
+    hours = parse_int_arg(request.args, 'hours') or 24
+    now = datetime.datetime.now()
+    query = select(Cargo).options(joinedload(Cargo.train)).where(
+        Cargo.eta >= now, Cargo.eta < now + datetime.timedelta(hours=hours))
+    after = request.args.get('after')
+    if after:
+        try:
+            after_eta, after_id = after.rsplit('_', 1)
+            after_eta, after_id = datetime.datetime.fromisoformat(after_eta), int(after_id)
+        except ValueError:
+            return api_error("Некорректный курсор after.")
+        query = query.where(tuple_(Cargo.eta, Cargo.cargo_id) > tuple_(after_eta, after_id))
+    with ReadSessionLocal() as db:
+        cargos = db.execute(query.order_by(Cargo.eta, Cargo.cargo_id).limit(per_page + 1)).scalars().all()
+        items = [tracking.to_json(tracking.serialize_cargo(c)) for c in cargos[:per_page]]
+    last = cargos[per_page - 1] if len(cargos) > per_page else None
+    return json_response({
+        "items": items,
+        "next_cursor": f"{last.eta.isoformat()}_{last.cargo_id}" if last else None,
+    })
+
+@app.route('/api/v1/eta/recompute', methods=['POST'])
+@login_required(role='admin')
+def api_eta_recompute():
+    """Пересчёт ETA всех грузов в пути (то же, что flask --app app compute-eta)."""
+    try:
+        result = eta.run()
+    except Exception as e:
+        app.logger.error(f"Ошибка пакетного расчёта ETA: {e}", exc_info=True)
+        return api_error("Внутренняя ошибка сервера.", 500)
+    if result.updated or result.cleared:
+        tracking.tracking_cache.clear()
+    app.logger.info(f"Пользователь {session['username']} пересчитал ETA: {result.as_dict()}")
+    return json_response(result.as_dict())
+
+@app.route('/api/v1/<any(cargos, trains):entity>/bulk', methods=['POST'])
+@login_required(role='admin')
+def api_bulk(entity):
+    """
+    Массовая операция: POST {"action": "set_status", "ids": [1, 2], "value": "Доставлен"}.
+    Действия грузов - set_status, reassign_train, move_station, delete;
+    поездов - move_station, delete. Ответ - {"affected": <затронуто строк>}.
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return api_error("Ожидалось JSON-тело запроса.")
+    try:
+        ids = _parse_id_list(payload.get('ids'))
+    except (TypeError, ValueError) as e:
+        return api_error(f"Некорректный список ID: {e}")
+    try:
+        affected = _run_bulk(entity, payload.get('action'), ids, payload.get('value'))
+    except bulk_ops.BulkError as e:
+        return api_error(str(e), 413 if len(ids) > app.config["BULK_MAX_IDS"] else 400)
+    except Exception as e:
+        app.logger.error(f"Ошибка массовой операции {entity}: {e}", exc_info=True)
+        return api_error("Внутренняя ошибка сервера.", 500)
+    return json_response({"affected": affected})
+
+def _bearer_token_ok(token):
+    """Заголовок Authorization: Bearer <token> совпадает с настроенным токеном (пустой токен - выключено)."""
+    auth = request.headers.get('Authorization', '')
+    return bool(token) and hmac.compare_digest(auth, f"Bearer {token}")
+
+@app.route('/api/v1/telemetry', methods=['POST'])
+def api_telemetry():
+    """
+    Пакетный приём местоположения поездов: POST {"events": [...]} или просто [...].
+    Для устройств - по TELEMETRY_TOKEN, иначе - только администратор.
+    Некорректные события пропускаются и перечисляются в rejected.
+    """
+    if not _bearer_token_ok(app.config.get("TELEMETRY_TOKEN")) and not current_user_is_admin():
+        return api_error("Доступ запрещён.", 403)
+
+    payload = request.get_json(silent=True)
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(events, list):
+        return api_error("Ожидался JSON-массив событий или объект {\"events\": [...]}.")
+    max_events = app.config["TELEMETRY_MAX_EVENTS"]
+    if len(events) > max_events:
+        return api_error(f"Слишком много событий в одном запросе (максимум {max_events}).", 413)
+
+    try:
+        result = telemetry.ingest(events, frozen_statuses=app.config["TELEMETRY_FROZEN_STATUSES"])
+    except Exception as e:
+        app.logger.error(f"Ошибка приёма телеметрии: {e}", exc_info=True)
+        return api_error("Внутренняя ошибка сервера.", 500)
+    return json_response(result.as_dict())
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Метрики в формате Prometheus: для администратора или по METRICS_TOKEN."""
+    if not _bearer_token_ok(app.config.get("METRICS_TOKEN")) and not current_user_is_admin():
+        abort(403)
+    return app.response_class(metrics.registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
 # ---------------------------------------
 # Авторизация
 # ---------------------------------------
@@ -225,11 +603,11 @@ def login():
     if form.validate_on_submit():
         username = form.username.data
         password = form.password.data
-        app.logger.info(f"Попытка входа пользователя: {username}")
+        app.logger.info("Попытка входа пользователя: %s", username)
 
         try:
-            with SessionLocal() as db:
-                user = db.query(User).filter(User.username == username).first()
+            db = get_db()
+            user = db.query(User).filter(User.username == username).first()
 
             # Проверяем пользователя и хеш пароля
             if user and check_password_hash(user.password_hash, password): # <-- Проверка хеша
@@ -237,7 +615,7 @@ def login():
                 session['user_id'] = user.user_id
                 session['username'] = user.username
                 session['role'] = user.role
-                app.logger.info(f"Успешный вход пользователя: {username} (ID: {user.user_id})")
+                app.logger.info("Успешный вход пользователя: %s (ID: %s)", username, user.user_id, extra={"sample": False})
                 flash("Успешная авторизация!", "success")
 
                 # Редирект на страницу, с которой пришли, или на дашборд
@@ -246,7 +624,7 @@ def login():
                     return redirect(next_page)
                 return redirect(url_for('admin_dashboard'))
             else:
-                app.logger.warning(f"Неудачная попытка входа для пользователя: {username}")
+                app.logger.warning("Неудачная попытка входа для пользователя: %s", username)
                 flash("Неверный логин или пароль.", "danger")
 
         except Exception as e:
@@ -260,8 +638,9 @@ def login():
 def logout():
     username = session.get('username', 'N/A')
     user_id = session.get('user_id', 'N/A')
+    user_cache.delete(user_id)
     session.clear()
-    app.logger.info(f"Пользователь {username} (ID: {user_id}) вышел из системы.")
+    app.logger.info("Пользователь %s (ID: %s) вышел из системы.", username, user_id, extra={"sample": False})
     flash("Вы успешно вышли из системы.", "info")
     return redirect(url_for('index'))
 
@@ -277,17 +656,43 @@ def logout():
 @app.route('/admin')
 @login_required(role='admin')
 def admin_dashboard():
-    # Можно добавить сюда какую-то статистику или быстрые ссылки
-    return render_template('admin_dashboard.html')
+    # Сводка поддерживается триггерами (summary.py) - несколько строк, без сканирования таблиц
+    try:
+        stats = summary.dashboard()
+    except Exception as e:
+        app.logger.error(f"Ошибка чтения сводки админ-панели: {e}", exc_info=True)
+        stats = None
+    return render_template('admin_dashboard.html', stats=stats)
+
+@app.route('/admin/page-cache/purge', methods=['POST'])
+@login_required(role='admin')
+def page_cache_purge():
+    """Сброс и прогрев кэша страниц (после правки шаблонов без перезапуска)."""
+    http_cache.reset_site_version() # ETag страниц пересчитаются с учётом новых шаблонов
+    purged = page_cache.purge()
+    warmed = page_cache.warm(app)
+    app.logger.info(f"Кэш страниц сброшен администратором {session.get('username')}: "
+                    f"удалено {purged}, прогрето {warmed}")
+    flash(f"Кэш страниц сброшен ({purged} записей) и прогрет ({warmed} страниц). "
+          f"Другие процессы сервера обновят его в течение {app.config['PAGE_CACHE_TTL']} с.", "success")
+    return redirect(url_for('admin_dashboard'))
 
 # ------ Управление поездами ------
 @app.route('/admin/trains')
 @login_required(role='admin')
 def train_list():
+    filters = parse_filters(request.args, TRAIN_FILTERS)
+    per_page = parse_per_page(request.args, app.config["ADMIN_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
     try:
-        with SessionLocal() as db:
-            trains = db.query(Train).order_by(Train.train_id).all()
-        return render_template('train_list.html', trains=trains)
+        db = get_db()
+        query = apply_train_filters(db.query(Train), filters)
+        trains = keyset_page(
+            query, Train.train_id, per_page,
+            after=parse_int_arg(request.args, 'after'),
+            before=parse_int_arg(request.args, 'before'),
+        )
+        return render_template('train_list.html', trains=trains, filters=filters, per_page=per_page,
+                               bulk_form=BulkTrainForm(), export_formats=export.available_formats())
     except Exception as e:
         app.logger.error(f"Ошибка при загрузке списка поездов: {e}", exc_info=True)
         flash("Не удалось загрузить список поездов.", "danger")
@@ -299,13 +704,15 @@ def train_add():
     form = TrainForm()
     if form.validate_on_submit():
         try:
-            with SessionLocal() as db:
-                new_train = Train()
-                form.populate_obj(new_train) # <-- Удобный способ заполнить объект из формы
-                db.add(new_train)
-                db.commit()
-                flash(f"Поезд '{new_train.name}' успешно добавлен.", "success")
-                app.logger.info(f"Пользователь {session['username']} добавил поезд ID {new_train.train_id}")
+            db = get_db()
+            new_train = Train()
+            form.populate_obj(new_train) # <-- Удобный способ заполнить объект из формы
+            db.add(new_train)
+            db.commit()
+            train_choices.invalidate()
+            live.notify_trains([new_train.train_id]) # подписчики этого ID ждали его появления
+            flash(f"Поезд '{new_train.name}' успешно добавлен.", "success")
+            app.logger.info(f"Пользователь {session['username']} добавил поезд ID {new_train.train_id}")
             return redirect(url_for('train_list'))
         except Exception as e:
             app.logger.error(f"Ошибка при добавлении поезда: {e}", exc_info=True)
@@ -318,28 +725,32 @@ def train_add():
 @login_required(role='admin')
 def train_edit(train_id):
     try:
-        with SessionLocal() as db:
-            # Получаем поезд и сразу используем его в сессии
-            train_obj = db.query(Train).filter_by(train_id=train_id).first()
-            if not train_obj:
-                flash("Поезд не найден.", "danger")
-                return redirect(url_for('train_list'))
-
-            # Создаем форму, заполняя её данными из объекта, если GET
-            # Если POST и валидация не прошла, WTForms сама подставит введенные данные
-            form = TrainForm(obj=train_obj if request.method == 'GET' else None)
-
-            if form.validate_on_submit():
-                form.populate_obj(train_obj) # Обновляем объект данными из формы
-                db.commit() # Фиксируем изменения
-                flash(f"Поезд '{train_obj.name}' успешно обновлен.", "success")
-                app.logger.info(f"Пользователь {session['username']} обновил поезд ID {train_id}")
-                return redirect(url_for('train_list'))
+        db = get_db()
+        # Получаем поезд и сразу используем его в сессии
+        train_obj = db.query(Train).filter_by(train_id=train_id).first()
+        if not train_obj:
+            flash("Поезд не найден.", "danger")
+            return redirect(url_for('train_list'))
+
+        # Создаем форму, заполняя её данными из объекта, если GET
+        # Если POST и валидация не прошла, WTForms сама подставит введенные данные
+        form = TrainForm(obj=train_obj if request.method == 'GET' else None)
+
+        if form.validate_on_submit():
+            form.populate_obj(train_obj) # Обновляем объект данными из формы
+            db.commit() # Фиксируем изменения
+            tracking.invalidate_train(train_id) # Вместе с поездом сбрасываются и его грузы
+            train_choices.invalidate()
+            live.notify_trains([train_id])
+            flash(f"Поезд '{train_obj.name}' успешно обновлен.", "success")
+            app.logger.info(f"Пользователь {session['username']} обновил поезд ID {train_id}")
+            return redirect(url_for('train_list'))
 
     except Exception as e:
         app.logger.error(f"Ошибка при редактировании поезда {train_id}: {e}", exc_info=True)
         flash("Произошла ошибка при сохранении изменений.", "danger")
         # Не делаем редирект, чтобы пользователь видел ошибки валидации или сообщение
+        db.rollback() # сессия запроса нужна дальше - для повторного показа формы
 
     # Для GET запроса или если POST не прошел валидацию
     return render_template('train_edit.html', form=form, title=f"Редактировать поезд: {train_obj.name}", train=train_obj)
@@ -349,17 +760,20 @@ def train_edit(train_id):
 @login_required(role='admin')
 def train_delete(train_id):
     try:
-        with SessionLocal() as db:
-            train_obj = db.query(Train).filter_by(train_id=train_id).first()
-            if train_obj:
-                train_name = train_obj.name # Сохраним имя для сообщения
-                db.delete(train_obj)
-                db.commit()
-                flash(f"Поезд '{train_name}' удалён.", "info")
-                app.logger.info(f"Пользователь {session['username']} удалил поезд ID {train_id}")
-            else:
-                flash("Поезд не найден.", "danger")
-                app.logger.warning(f"Пользователь {session['username']} пытался удалить несуществующий поезд ID {train_id}")
+        db = get_db()
+        train_obj = db.query(Train).filter_by(train_id=train_id).first()
+        if train_obj:
+            train_name = train_obj.name # Сохраним имя для сообщения
+            db.delete(train_obj)
+            db.commit()
+            tracking.invalidate_train(train_id)
+            live.notify_trains([train_id]) # Подписчики увидят удаление поезда и его грузов
+            train_choices.invalidate()
+            flash(f"Поезд '{train_name}' удалён.", "info")
+            app.logger.info(f"Пользователь {session['username']} удалил поезд ID {train_id}")
+        else:
+            flash("Поезд не найден.", "danger")
+            app.logger.warning(f"Пользователь {session['username']} пытался удалить несуществующий поезд ID {train_id}")
     except Exception as e:
         app.logger.error(f"Ошибка при удалении поезда {train_id}: {e}", exc_info=True)
         flash("Произошла ошибка при удалении поезда.", "danger")
@@ -368,61 +782,85 @@ def train_delete(train_id):
     return redirect(url_for('train_list'))
 
 
+@app.route('/admin/trains/suggest')
+@login_required(role='admin')
+def train_suggest():
+    """Автодополнение поезда в форме груза: ?q=<префикс имени или ID>, ответ - JSON [{id, name}]."""
+    limit = max(1, min(parse_int_arg(request.args, 'limit') or 20, 100))
+    suggestions = train_choices.search(request.args.get('q', ''), limit=limit)
+    return json_response([{"id": train_id, "name": name} for train_id, name in suggestions])
+
+
 # ------ Управление грузами (аналогично поездам) ------
 
 @app.route('/admin/cargos')
 @login_required(role='admin')
 def cargo_list():
+    filters = parse_filters(request.args, CARGO_FILTERS)
+    per_page = parse_per_page(request.args, app.config["ADMIN_PAGE_SIZE"], app.config["ADMIN_PAGE_SIZE_MAX"])
     try:
-        with SessionLocal() as db:
-            cargos = db.query(Cargo).options(joinedload(Cargo.train)).order_by(Cargo.cargo_id).all()
-        return render_template('cargo_list.html', cargos=cargos)
+        db = get_db()
+        query = apply_cargo_filters(db.query(Cargo).options(joinedload(Cargo.train)), filters)
+        cargos = keyset_page(
+            query, Cargo.cargo_id, per_page,
+            after=parse_int_arg(request.args, 'after'),
+            before=parse_int_arg(request.args, 'before'),
+        )
+        return render_template('cargo_list.html', cargos=cargos, filters=filters, per_page=per_page,
+                               bulk_form=BulkCargoForm(), export_formats=export.available_formats())
     except Exception as e:
         app.logger.error(f"Ошибка при загрузке списка грузов: {e}", exc_info=True)
         flash("Не удалось загрузить список грузов.", "danger")
         return redirect(url_for('admin_dashboard'))
 
+@app.route('/admin/search')
+@login_required(role='admin')
+def admin_search():
+    query = request.args.get('q', '').strip()
+    kind = request.args.get('kind', 'cargos')
+    if kind not in search.INDEXES:
+        kind = 'cargos'
+    results = None
+    if query:
+        try:
+            results = search.search(
+                kind, query, page=parse_int_arg(request.args, 'page') or 1,
+                per_page=app.config["SEARCH_PAGE_SIZE"], max_results=app.config["SEARCH_MAX_RESULTS"],
+                rank_candidates=app.config["SEARCH_RANK_CANDIDATES"],
+            )
+        except Exception as e:
+            app.logger.error(f"Ошибка полнотекстового поиска '{query}': {e}", exc_info=True)
+            flash("Не удалось выполнить поиск.", "danger")
+    return render_template('search.html', query=query, kind=kind, results=results)
+
 @app.route('/admin/cargos/add', methods=['GET', 'POST'])
 @login_required(role='admin')
 def cargo_add():
     form = CargoForm()
-    # Динамическое заполнение выбора поезда в форме (если это SelectField)
-    try:
-        with SessionLocal() as db:
-            form.train_id.choices = [(t.train_id, t.name) for t in db.query(Train).order_by(Train.name).all()]
-    except Exception as e:
-        app.logger.error(f"Ошибка загрузки поездов для формы груза: {e}", exc_info=True)
-        flash("Ошибка загрузки списка поездов.", "danger")
-        # Можно редирект или просто пустой список в форме
+    # Поезд вводится числом с подсказками (train_suggest); существование проверяет train_choices.exists()
 
     if form.validate_on_submit():
         try:
-            with SessionLocal() as db:
-                new_cargo = Cargo()
-                form.populate_obj(new_cargo)
-                # Убедимся, что train_id из формы существует
-                train_exists = db.query(Train).filter_by(train_id=new_cargo.train_id).count() > 0
-                if not train_exists:
-                    flash(f"Ошибка: Поезд с ID {new_cargo.train_id} не найден.", "danger")
-                    # Не добавляем, возвращаем форму с ошибкой
-                    return render_template('cargo_edit.html', form=form, title="Добавить груз", cargo=None)
+            db = get_db()
+            new_cargo = Cargo()
+            form.populate_obj(new_cargo)
+            # Убедимся, что train_id из формы существует
+            if not train_choices.exists(new_cargo.train_id):
+                flash(f"Ошибка: Поезд с ID {new_cargo.train_id} не найден.", "danger")
+                # Не добавляем, возвращаем форму с ошибкой
+                return render_template('cargo_edit.html', form=form, title="Добавить груз", cargo=None)
                 
-                db.add(new_cargo)
-                db.commit()
-                flash(f"Груз '{new_cargo.cargo_type}' (ID: {new_cargo.cargo_id}) успешно добавлен.", "success")
-                app.logger.info(f"Пользователь {session['username']} добавил груз ID {new_cargo.cargo_id}")
+            db.add(new_cargo)
+            db.commit()
+            tracking.invalidate_cargo(new_cargo.cargo_id)
+            live.notify_cargos([new_cargo.cargo_id]) # подписчики этого ID ждали его появления
+            flash(f"Груз '{new_cargo.cargo_type}' (ID: {new_cargo.cargo_id}) успешно добавлен.", "success")
+            app.logger.info(f"Пользователь {session['username']} добавил груз ID {new_cargo.cargo_id}")
             return redirect(url_for('cargo_list'))
         except Exception as e:
             app.logger.error(f"Ошибка при добавлении груза: {e}", exc_info=True)
             flash("Произошла ошибка при добавлении груза.", "danger")
             db.rollback()
-            # Может потребоваться снова заполнить choices для поезда перед рендером
-            try:
-                with SessionLocal() as db_retry:
-                    form.train_id.choices = [(t.train_id, t.name) for t in db_retry.query(Train).order_by(Train.name).all()]
-            except Exception as e_retry:
-                 app.logger.error(f"Повторная ошибка загрузки поездов для формы груза: {e_retry}", exc_info=True)
-
 
     # Для GET запроса или если POST не прошел валидацию
     return render_template('cargo_edit.html', form=form, title="Добавить груз", cargo=None)
@@ -432,44 +870,35 @@ def cargo_add():
 @login_required(role='admin')
 def cargo_edit(cargo_id):
     try:
-        with SessionLocal() as db:
-            cargo_obj = db.query(Cargo).filter_by(cargo_id=cargo_id).first()
-            if not cargo_obj:
-                flash("Груз не найден.", "danger")
-                return redirect(url_for('cargo_list'))
-
-            # Заполняем choices для поезда в любом случае (GET или POST с ошибкой)
-            train_choices = [(t.train_id, t.name) for t in db.query(Train).order_by(Train.name).all()]
-            
-            # Создаем форму
-            form = CargoForm(obj=cargo_obj if request.method == 'GET' else None)
-            form.train_id.choices = train_choices
-
-            if form.validate_on_submit():
-                # Проверяем существование выбранного поезда перед сохранением
-                selected_train_id = form.train_id.data
-                train_exists = db.query(Train).filter_by(train_id=selected_train_id).count() > 0
-                if not train_exists:
-                     flash(f"Ошибка: Поезд с ID {selected_train_id} не найден.", "danger")
-                     # Возвращаем форму с ошибкой
-                     return render_template('cargo_edit.html', form=form, title=f"Редактировать груз: {cargo_obj.cargo_type}", cargo=cargo_obj)
-
-                form.populate_obj(cargo_obj)
-                db.commit()
-                flash(f"Груз '{cargo_obj.cargo_type}' (ID: {cargo_id}) успешно обновлен.", "success")
-                app.logger.info(f"Пользователь {session['username']} обновил груз ID {cargo_id}")
-                return redirect(url_for('cargo_list'))
+        db = get_db()
+        cargo_obj = db.query(Cargo).filter_by(cargo_id=cargo_id).first()
+        if not cargo_obj:
+            flash("Груз не найден.", "danger")
+            return redirect(url_for('cargo_list'))
+
+        # Создаем форму
+        form = CargoForm(obj=cargo_obj if request.method == 'GET' else None)
+
+        if form.validate_on_submit():
+            # Проверяем существование выбранного поезда перед сохранением
+            selected_train_id = form.train_id.data
+            if not train_choices.exists(selected_train_id):
+                 flash(f"Ошибка: Поезд с ID {selected_train_id} не найден.", "danger")
+                 # Возвращаем форму с ошибкой
+                 return render_template('cargo_edit.html', form=form, title=f"Редактировать груз: {cargo_obj.cargo_type}", cargo=cargo_obj)
+
+            form.populate_obj(cargo_obj)
+            db.commit()
+            tracking.invalidate_cargo(cargo_id)
+            live.notify_cargos([cargo_id])
+            flash(f"Груз '{cargo_obj.cargo_type}' (ID: {cargo_id}) успешно обновлен.", "success")
+            app.logger.info(f"Пользователь {session['username']} обновил груз ID {cargo_id}")
+            return redirect(url_for('cargo_list'))
 
     except Exception as e:
         app.logger.error(f"Ошибка при редактировании груза {cargo_id}: {e}", exc_info=True)
         flash("Произошла ошибка при сохранении изменений.", "danger")
-        # Может потребоваться снова заполнить choices для поезда перед рендером
-        try:
-            with SessionLocal() as db_retry:
-                form.train_id.choices = [(t.train_id, t.name) for t in db_retry.query(Train).order_by(Train.name).all()]
-        except Exception as e_retry:
-            app.logger.error(f"Повторная ошибка загрузки поездов для формы груза: {e_retry}", exc_info=True)
-
+        db.rollback() # сессия запроса нужна дальше - для повторного показа формы
 
     # Для GET или POST с ошибкой
     return render_template('cargo_edit.html', form=form, title=f"Редактировать груз: {cargo_obj.cargo_type}", cargo=cargo_obj)
@@ -479,17 +908,19 @@ def cargo_edit(cargo_id):
 @login_required(role='admin')
 def cargo_delete(cargo_id):
     try:
-        with SessionLocal() as db:
-            cargo_obj = db.query(Cargo).filter_by(cargo_id=cargo_id).first()
-            if cargo_obj:
-                cargo_type = cargo_obj.cargo_type # Сохраним для сообщения
-                db.delete(cargo_obj)
-                db.commit()
-                flash(f"Груз '{cargo_type}' (ID: {cargo_id}) удалён.", "info")
-                app.logger.info(f"Пользователь {session['username']} удалил груз ID {cargo_id}")
-            else:
-                flash("Груз не найден.", "danger")
-                app.logger.warning(f"Пользователь {session['username']} пытался удалить несуществующий груз ID {cargo_id}")
+        db = get_db()
+        cargo_obj = db.query(Cargo).filter_by(cargo_id=cargo_id).first()
+        if cargo_obj:
+            cargo_type = cargo_obj.cargo_type # Сохраним для сообщения
+            db.delete(cargo_obj)
+            db.commit()
+            tracking.invalidate_cargo(cargo_id)
+            live.notify_cargos([cargo_id])
+            flash(f"Груз '{cargo_type}' (ID: {cargo_id}) удалён.", "info")
+            app.logger.info(f"Пользователь {session['username']} удалил груз ID {cargo_id}")
+        else:
+            flash("Груз не найден.", "danger")
+            app.logger.warning(f"Пользователь {session['username']} пытался удалить несуществующий груз ID {cargo_id}")
     except Exception as e:
         # Обработка возможных ошибок ForeignKeyConstraint, если груз используется где-то еще
         app.logger.error(f"Ошибка при удалении груза {cargo_id}: {e}", exc_info=True)
@@ -498,6 +929,245 @@ def cargo_delete(cargo_id):
 
     return redirect(url_for('cargo_list'))
 
+# ------ Массовые операции (bulk_ops.py) ------
+
+def _run_bulk(entity, action, ids, value):
+    """Общая часть формы и API: лимит на число ID, выполнение, лог. :return: затронуто строк"""
+    if len(ids) > app.config["BULK_MAX_IDS"]:
+        raise bulk_ops.BulkError(f"Слишком много записей за раз (максимум {app.config['BULK_MAX_IDS']}).")
+    affected = bulk_ops.run(entity, action, ids, value, batch_size=app.config["BULK_BATCH_SIZE"])
+    app.logger.info(f"Пользователь {session['username']} выполнил {entity}.{action} "
+                    f"({value!r}) для {len(ids)} ID: затронуто {affected}")
+    return affected
+
+def _bulk_from_form(entity, form, list_endpoint):
+    # Возвращаемся на ту же страницу списка: фильтры и курсор приходят в query string формы
+    back = url_for(list_endpoint, **request.args.to_dict())
+    if not form.validate_on_submit():
+        flash("Некорректный запрос массовой операции.", "danger")
+        return redirect(back)
+    try:
+        affected = _run_bulk(entity, form.action.data, _parse_id_list(request.form.getlist('ids')), form.value.data)
+        flash(f"Готово: затронуто записей - {affected}.", "success")
+    except (bulk_ops.BulkError, ValueError) as e:
+        flash(str(e), "warning")
+    except Exception as e:
+        app.logger.error(f"Ошибка массовой операции {entity}: {e}", exc_info=True)
+        flash("Произошла ошибка при выполнении массовой операции.", "danger")
+    return redirect(back)
+
+@app.route('/admin/cargos/bulk', methods=['POST'])
+@login_required(role='admin')
+def cargo_bulk():
+    return _bulk_from_form('cargos', BulkCargoForm(), 'cargo_list')
+
+@app.route('/admin/trains/bulk', methods=['POST'])
+@login_required(role='admin')
+def train_bulk():
+    return _bulk_from_form('trains', BulkTrainForm(), 'train_list')
+
+# ------ Выгрузка (export.py) ------
+
+@app.route('/admin/<any(cargos, trains):entity>/export')
+@login_required(role='admin')
+def data_export(entity):
+    """
+    Потоковая выгрузка: ?format=csv|jsonl|parquet и те же фильтры, что у списка.
+    Ответ отдаётся кусками по мере чтения из курсора.
+    """
+    fmt = request.args.get('format', 'csv')
+    if fmt not in export.available_formats():
+        flash(f"Формат выгрузки {fmt} недоступен.", "warning")
+        return redirect(url_for('cargo_list' if entity == 'cargos' else 'train_list'))
+    filters = parse_filters(request.args, export.ENTITIES[entity][1])
+    app.logger.info(f"Пользователь {session['username']} выгружает {entity} в {fmt}, фильтры {filters}")
+    mimetype, _ = export.FORMATS[fmt]
+    return Response(export.generate(entity, fmt, filters, app.config["EXPORT_CHUNK_SIZE"]), mimetype=mimetype, headers={
+        "Content-Disposition": f'attachment; filename="{export.filename(entity, fmt)}"',
+        "X-Accel-Buffering": "no", # nginx отдаёт куски сразу, не собирая ответ целиком
+    })
+
+# ------ Массовый импорт ------
+
+@app.route('/admin/import', methods=['GET', 'POST'])
+@login_required(role='admin')
+def data_import():
+    form = ImportForm()
+    report = None
+    if form.validate_on_submit():
+        upload = form.file.data
+        fmt = form.file_format.data or bulk_import.detect_format(upload.filename)
+        if fmt not in bulk_import.FORMATS:
+            flash("Не удалось определить формат файла. Выберите CSV или JSONL явно.", "warning")
+            return render_template('import.html', form=form, report=None)
+        try:
+            # Werkzeug сбрасывает крупные загрузки во временный файл,
+            # а TextIOWrapper читает его построчно - файл целиком в память не попадает.
+            stream = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+            result = bulk_import.import_stream(
+                stream, form.entity.data, fmt,
+                batch_size=app.config["IMPORT_BATCH_SIZE"],
+                max_errors=app.config["IMPORT_MAX_REPORTED_ERRORS"],
+            )
+            report = result.as_dict()
+            app.logger.info(
+                f"Пользователь {session['username']} импортировал {form.entity.data} из '{upload.filename}': "
+                f"{result.imported}/{result.total} строк, {result.rows_per_sec:.0f} строк/с"
+            )
+            flash(f"Импорт завершён: загружено {result.imported} из {result.total} строк.",
+                  "success" if not result.failed else "warning")
+        except Exception as e:
+            app.logger.error(f"Ошибка при импорте файла '{upload.filename}': {e}", exc_info=True)
+            flash("Произошла ошибка при импорте файла.", "danger")
+
+    return render_template('import.html', form=form, report=report)
+
+# ------ Сеть станций (routing.py) ------
+@app.route('/admin/network', methods=['GET', 'POST'])
+@login_required(role='admin')
+def network():
+    form = SegmentForm()
+    if form.validate_on_submit():
+        try:
+            with models.engine.begin() as conn:
+                pairs, rows = routing.set_segment(conn, form.station_a.data, form.station_b.data, form.length_km.data)
+        except ValueError as e:
+            flash(str(e), "warning")
+        except Exception as e:
+            app.logger.error(f"Ошибка при сохранении участка {form.station_a.data} - {form.station_b.data}: {e}", exc_info=True)
+            flash("Произошла ошибка при сохранении участка.", "danger")
+        else:
+            _after_network_change(pairs, rows)
+            app.logger.info(f"Пользователь {session['username']} сохранил участок {form.station_a.data} - "
+                            f"{form.station_b.data} ({form.length_km.data} км): пар {pairs}, строк {rows}")
+            flash(f"Участок сохранён: пересчитано расстояний {pairs}, обновлено поездов и грузов {rows}.", "success")
+            return redirect(url_for('network'))
+
+    # Расстояние между двумя станциями - проверка сети
+    route_from = request.args.get('route_from', '').strip()
+    route_to = request.args.get('route_to', '').strip()
+    route = routing.distance(route_from, route_to) if route_from and route_to else None
+    try:
+        segments = routing.segments()
+        stations, pairs = routing.network_size()
+    except Exception as e:
+        app.logger.error(f"Ошибка при загрузке сети станций: {e}", exc_info=True)
+        flash("Не удалось загрузить сеть станций.", "danger")
+        return redirect(url_for('admin_dashboard'))
+    return render_template('network.html', form=form, segments=segments, stations=stations, pairs=pairs,
+                           route_from=route_from, route_to=route_to, route=route)
+
+@app.route('/admin/network/delete/<int:segment_id>', methods=['POST'])
+@login_required(role='admin')
+def network_segment_delete(segment_id):
+    try:
+        with models.engine.begin() as conn:
+            pairs, rows = routing.delete_segment(conn, segment_id)
+    except Exception as e:
+        app.logger.error(f"Ошибка при удалении участка {segment_id}: {e}", exc_info=True)
+        flash("Произошла ошибка при удалении участка.", "danger")
+    else:
+        _after_network_change(pairs, rows)
+        app.logger.info(f"Пользователь {session['username']} удалил участок ID {segment_id}: пар {pairs}, строк {rows}")
+        flash(f"Участок удалён: пересчитано расстояний {pairs}, обновлено поездов и грузов {rows}.", "success")
+    return redirect(url_for('network'))
+
+def _after_network_change(pairs, rows):
+    # Расстояния могли поменяться у многих объектов сразу - проще сбросить кэш отслеживания целиком
+    if rows:
+        tracking.tracking_cache.clear()
+
+# ---------------------------------------
+# CLI-команды (flask --app app <команда>)
+# ---------------------------------------
+@app.cli.command("import-data")
+@click.argument("entity", type=click.Choice(sorted(bulk_import.ENTITIES)))
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--format", "fmt", type=click.Choice(bulk_import.FORMATS), default=None,
+              help="Формат файла (по умолчанию - по расширению).")
+@click.option("--batch-size", type=int, default=None, help="Строк в одной транзакции.")
+@click.option("--errors-out", type=click.Path(dir_okay=False), default=None,
+              help="Куда писать полный отчёт об ошибках (JSONL).")
+def import_data_command(entity, path, fmt, batch_size, errors_out):
+    """Потоковый импорт поездов/грузов из CSV или JSONL."""
+    fmt = fmt or bulk_import.detect_format(path)
+    if fmt is None:
+        raise click.UsageError("Не удалось определить формат по расширению, укажите --format.")
+
+    errors_file = open(errors_out, "w", encoding="utf-8") if errors_out else None
+
+    def write_error(line_no, errors):
+        if errors_file:
+            errors_file.write(json.dumps({"line": line_no, "errors": errors}, ensure_ascii=False) + "\n")
+
+    try:
+        with open(path, encoding="utf-8-sig", newline="") as stream:
+            result = bulk_import.import_stream(
+                stream, entity, fmt,
+                batch_size=batch_size or app.config["IMPORT_BATCH_SIZE"],
+                max_errors=app.config["IMPORT_MAX_REPORTED_ERRORS"],
+                on_error=write_error,
+            )
+    finally:
+        if errors_file:
+            errors_file.close()
+
+    click.echo(
+        f"[import] {entity}: всего {result.total}, загружено {result.imported}, "
+        f"ошибок {result.failed}, {result.elapsed:.2f} с ({result.rows_per_sec:.0f} строк/с)"
+    )
+    if result.failed and not errors_out:
+        for line_no, errors in result.errors[:20]:
+            click.echo(f"  строка {line_no}: {errors}", err=True)
+    if result.failed:
+        sys.exit(1)
+
+@app.cli.command("export-data")
+@click.argument("entity", type=click.Choice(list(export.ENTITIES)))
+@click.argument("path", type=click.Path(dir_okay=False, writable=True, allow_dash=True))
+@click.option("--format", "fmt", type=click.Choice(list(export.FORMATS)), default=None,
+              help="Формат файла (по умолчанию - по расширению, иначе csv).")
+@click.option("--filter", "filters", multiple=True, metavar="NAME=VALUE",
+              help="Фильтр как в списках админки, например --filter status='В пути'.")
+@click.option("--chunk-size", type=int, default=None, help="Строк, забираемых из курсора за раз.")
+def export_data_command(entity, path, fmt, filters, chunk_size):
+    """Потоковая выгрузка поездов/грузов в CSV, JSONL или Parquet (- вместо пути - stdout)."""
+    fmt = fmt or next((name for name, (_, ext) in export.FORMATS.items() if path.endswith("." + ext)), "csv")
+    if fmt not in export.available_formats():
+        raise click.UsageError("Для выгрузки в Parquet нужен пакет pyarrow.")
+    pairs = [item.split("=", 1) for item in filters]
+    if any(len(pair) != 2 for pair in pairs):
+        raise click.UsageError("Фильтр задаётся как NAME=VALUE.")
+    parsed = parse_filters(MultiDict(pairs), export.ENTITIES[entity][1])
+
+    size = 0
+    started = datetime.datetime.now()
+    with click.open_file(path, "wb") as out:
+        for chunk in export.generate(entity, fmt, parsed, chunk_size or app.config["EXPORT_CHUNK_SIZE"]):
+            out.write(chunk)
+            size += len(chunk)
+    elapsed = (datetime.datetime.now() - started).total_seconds()
+    click.echo(f"[export] {entity} -> {path} ({fmt}, фильтры {parsed}): {size} байт, {elapsed:.2f} с", err=True)
+
+@app.cli.command("compute-eta")
+@click.option("--batch-size", type=int, default=None, help="Строк в одной транзакции записи.")
+def compute_eta_command(batch_size):
+    """Пакетный расчёт ETA всех грузов в пути - запускать по расписанию (cron)."""
+    result = eta.run(batch_size=batch_size)
+    timings = ", ".join(f"{step} {seconds:.2f} с" for step, seconds in result.timings.items())
+    click.echo(
+        f"[eta] грузов в пути {result.cargos}, с ETA {result.with_eta}, записано {result.updated}, "
+        f"очищено {result.cleared}, участков со своей скоростью {result.segments}; "
+        f"{result.elapsed:.2f} с ({timings})"
+    )
+
+@app.cli.command("compress-static")
+def compress_static_command():
+    """Создаёт сжатые копии статики (.gz, .br при установленном brotli) - запускать при выкладывании."""
+    for path, size, variants in precompress_static(app.static_folder):
+        sizes = ", ".join(f"{suffix} {compressed}" for suffix, compressed in variants.items()) or "не сжимается"
+        click.echo(f"[static] {path}: {size} -> {sizes}")
+
 # ---------------------------------------
 # Запуск приложения
 # ---------------------------------------
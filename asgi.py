@@ -0,0 +1,269 @@
+"""
+asgi.py
+
+ASGI-режим: публичная часть «только для чтения» работает на asyncio, всё
+остальное - то же Flask-приложение.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000 --workers 4
+
+Асинхронно (без потока на соединение) обслуживаются:
+- GET/POST /api/v1/track - пакетное отслеживание;
+- GET /track/stream - живые обновления (SSE): ожидающий поток - это корутина
+  с очередью asyncio, а не занятый поток сервера, поэтому открытых соединений
+  на процесс могут быть тысячи (предел - SSE_MAX_CONNECTIONS).
+БД читается через aiosqlite (models.make_async_engine, только чтение), кэш
+отслеживания и брокер живых обновлений общие с Flask-частью: правки из админки
+и телеметрия в этом же процессе сразу доходят до async-потоков.
+
+Остальные маршруты (страница /track, админка, формы) передаются Flask через
+asgiref WsgiToAsgi и выполняются в пуле потоков. Страница /track дешёвая
+(кэш отслеживания, ETag/304, кэш страниц) и рендерится шаблонами Flask с
+сессией и flash-сообщениями, поэтому остаётся там.
+
+Зависимости режима: uvicorn, asgiref, aiosqlite, greenlet (см. requirements.txt).
+"""
+
+import asyncio
+import gzip
+import json
+import time
+from http.cookies import SimpleCookie
+from urllib.parse import parse_qs
+
+from asgiref.wsgi import WsgiToAsgi
+from itsdangerous import BadSignature
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+import live
+import metrics
+import models
+import tracking
+from app import app, _parse_id_list
+from http_cache import http_cache, etag_matches
+
+async_read_engine = models.make_async_engine(read_only=True)
+AsyncReadSession = async_sessionmaker(async_read_engine, expire_on_commit=False)
+
+flask_application = WsgiToAsgi(app)
+
+
+class Request:
+    """Минимальная обёртка над scope/receive для async-обработчиков."""
+
+    def __init__(self, scope, receive):
+        self.scope = scope
+        self.receive = receive
+        self.method = scope["method"]
+        self.args = {k: v[-1] for k, v in parse_qs(scope.get("query_string", b"").decode("latin-1")).items()}
+        self.headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers", [])}
+
+    async def body(self, limit=1_000_000):
+        chunks, size = [], 0
+        while True:
+            message = await self.receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > limit:
+                return None
+            chunks.append(chunk)
+            if not message.get("more_body"):
+                return b"".join(chunks)
+
+    def flask_session(self):
+        """Содержимое cookie сессии Flask (подпись проверяется тем же SECRET_KEY); {} - нет или подделана."""
+        cookie = SimpleCookie(self.headers.get("cookie", "")).get(app.config["SESSION_COOKIE_NAME"])
+        if cookie is None:
+            return {}
+        serializer = app.session_interface.get_signing_serializer(app)
+        try:
+            return serializer.loads(cookie.value, max_age=int(app.permanent_session_lifetime.total_seconds()))
+        except BadSignature:
+            return {}
+
+    def accepts_gzip(self):
+        return "gzip" in self.headers.get("accept-encoding", "")
+
+
+class Response:
+    def __init__(self, body=b"", status=200, headers=None):
+        self.body = body
+        self.status = status
+        self.headers = dict(headers or {})
+
+    async def __call__(self, scope, receive, send):
+        await send({"type": "http.response.start", "status": self.status,
+                    "headers": [(k.encode(), v.encode()) for k, v in self.headers.items()]})
+        await send({"type": "http.response.body", "body": self.body})
+
+
+def json_response(data, status=200, headers=None):
+    """Компактный JSON без \\u-экранирования кириллицы - как json_response во Flask-части."""
+    body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode()
+    return Response(body, status, {"content-type": "application/json", **(headers or {})})
+
+
+def api_error(message, status=400, headers=None):
+    return json_response({"error": message}, status, headers)
+
+
+async def api_track(request):
+    """Async-версия /api/v1/track (тот же формат запроса и ответа, ETag/304 и gzip)."""
+    if request.method == "POST":
+        raw = await request.body()
+        try:
+            payload = json.loads(raw) if raw else None
+        except ValueError:
+            payload = None
+        if not isinstance(payload, dict):
+            return api_error("Ожидалось JSON-тело запроса.")
+    else:
+        payload = request.args
+    try:
+        cargo_ids = _parse_id_list(payload.get("cargo_ids"))
+        train_ids = _parse_id_list(payload.get("train_ids"))
+    except (TypeError, ValueError) as e:
+        return api_error(f"Некорректный список ID: {e}")
+
+    if not cargo_ids and not train_ids:
+        return api_error("Укажите cargo_ids и/или train_ids.")
+    max_ids = app.config["TRACK_API_MAX_IDS"]
+    if len(cargo_ids) + len(train_ids) > max_ids:
+        return api_error(f"Слишком много ID в одном запросе (максимум {max_ids}).", 413)
+
+    try:
+        cargos = await tracking.lookup_many_async("cargo", cargo_ids, AsyncReadSession) if cargo_ids else {}
+        trains = await tracking.lookup_many_async("train", train_ids, AsyncReadSession) if train_ids else {}
+    except Exception as e:
+        app.logger.error(f"Ошибка пакетного отслеживания (async): {e}", exc_info=True)
+        return api_error("Внутренняя ошибка сервера.", 500)
+
+    headers = {"vary": "Accept-Encoding"}
+    if request.method == "GET":
+        # ETag и заголовки - как у http_cache.page_etag / make_conditional во Flask-версии
+        session = request.flask_session()
+        if not session.get("_flashes"):
+            etag = http_cache.etag_for(session.get("user_id"), ("api_track", cargos, trains))
+            conditional = http_cache.conditional_headers(etag)
+            headers.update({
+                "etag": conditional["ETag"],
+                "cache-control": conditional["Cache-Control"],
+                "vary": f"Accept-Encoding, {conditional['Vary']}",
+            })
+            if etag_matches(request.headers.get("if-none-match"), etag):
+                return Response(status=304, headers=headers)
+
+    response = json_response({
+        "cargos": {str(i): tracking.to_json(cargos[i]) for i in cargo_ids},
+        "trains": {str(i): tracking.to_json(trains[i]) for i in train_ids},
+    }, headers=headers)
+    if len(response.body) >= app.config["COMPRESS_MIN_SIZE"] and request.accepts_gzip():
+        response.body = gzip.compress(response.body, compresslevel=app.config["COMPRESS_GZIP_LEVEL"])
+        response.headers["content-encoding"] = "gzip"
+    return response
+
+
+class EventStreamResponse:
+    """SSE-ответ: шлёт события до конца потока или до отключения клиента."""
+
+    def __init__(self, events):
+        self.events = events
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"), # nginx не должен буферизовать поток
+            ]})
+            pump = asyncio.ensure_future(self._pump(send))
+            disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+            done, pending = await asyncio.wait({pump, disconnect}, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+            # Дожидаемся отмены: закрывать генератор, пока его итерирует pump, нельзя
+            await asyncio.gather(*pending, return_exceptions=True)
+            if pump in done and pump.exception() is None:
+                await send({"type": "http.response.body", "body": b""})
+        finally:
+            await self.events.aclose()
+
+    async def _pump(self, send):
+        async for chunk in self.events:
+            await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+
+
+async def _wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+
+async def track_stream(request):
+    """Async-версия /track/stream: те же параметры и события, что и во Flask-части."""
+    try:
+        keys = ([("cargo", i) for i in _parse_id_list(request.args.get("cargo_ids"))] +
+                [("train", i) for i in _parse_id_list(request.args.get("train_ids"))])
+    except (TypeError, ValueError) as e:
+        return api_error(f"Некорректный список ID: {e}")
+    if not keys:
+        return api_error("Укажите cargo_ids и/или train_ids.")
+    if len(keys) > app.config["SSE_MAX_IDS"]:
+        return api_error(f"Слишком много ID в одной подписке (максимум {app.config['SSE_MAX_IDS']}).", 413)
+
+    try:
+        events = live.stream_async(
+            keys,
+            lambda search_type, ids: tracking.lookup_many_async(search_type, ids, AsyncReadSession),
+            keepalive=app.config["SSE_KEEPALIVE_SECONDS"],
+            max_duration=app.config["SSE_MAX_STREAM_SECONDS"],
+        )
+    except live.TooManyConnections:
+        app.logger.warning("Достигнут лимит SSE-потоков, новое подключение отклонено")
+        return api_error("Слишком много подключений, повторите позже.", 503, {"retry-after": "30"})
+    return EventStreamResponse(events)
+
+
+# (метод, путь) -> (имя endpoint'а для метрик, обработчик)
+ROUTES = {
+    ("GET", "/api/v1/track"): ("api_track", api_track),
+    ("POST", "/api/v1/track"): ("api_track", api_track),
+    ("GET", "/track/stream"): ("track_stream", track_stream),
+}
+
+
+async def application(scope, receive, send):
+    if scope["type"] == "lifespan":
+        await _lifespan(receive, send)
+        return
+    route = ROUTES.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+    if route is None:
+        await flask_application(scope, receive, send)
+        return
+
+    endpoint, handler = route
+    started = time.perf_counter()
+    response = await handler(Request(scope, receive))
+    if isinstance(response, EventStreamResponse):
+        # Для потока в метрики идёт время до начала ответа, а не длительность подписки
+        _observe(endpoint, scope["method"], 200, started)
+        await response(scope, receive, send)
+        return
+    await response(scope, receive, send)
+    _observe(endpoint, scope["method"], response.status, started)
+
+
+def _observe(endpoint, method, status, started):
+    metrics.REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint, method)
+    metrics.REQUESTS_TOTAL.inc(endpoint, method, str(status))
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await async_read_engine.dispose()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -0,0 +1,350 @@
+"""
+benchmark.py
+
+Воспроизводимый нагрузочный бенчмарк приложения через Flask test client
+(без сети и внешнего сервера - измеряется только сам код приложения и БД).
+
+Порядок работы:
+    DB_PATH=bench.db python db_setup.py init
+    DB_PATH=bench.db python db_setup.py seed --trains 10000 --cargos 1000000
+    DB_PATH=bench.db python benchmark.py --concurrency 8 --requests 2000 --output before.json
+    ... изменения ...
+    DB_PATH=bench.db python benchmark.py --concurrency 8 --requests 2000 --compare before.json
+
+Каждый сценарий выполняется --requests раз в --concurrency потоках, у каждого потока
+свой test client (своя cookie-сессия). Идентификаторы выбираются генератором
+с фиксированным --seed, поэтому два прогона дают одинаковую последовательность запросов.
+Результат - JSON с p50/p95/p99, средним и максимумом задержки (мс) и пропускной
+способностью (запросов/с) по каждому сценарию.
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import func, select
+
+DEFAULT_ADMIN_PASSWORD = "ChangeMeImmediately123!"
+
+
+class Scenario:
+    """
+    Один сценарий нагрузки.
+    make_request(rng, ids) -> (method, url, data) - какой запрос отправить;
+    expected - допустимые коды ответа (всё остальное считается ошибкой);
+    csrf - перед запросом открыть ту же страницу GET (вне замера) и отправить
+    CSRF-токен из формы, как это делает браузер.
+    """
+
+    def __init__(self, name, make_request, admin=False, expected=(200,), csrf=False):
+        self.name = name
+        self.make_request = make_request
+        self.admin = admin
+        self.expected = expected
+        self.csrf = csrf
+
+
+_CSRF_RE = re.compile(r'name="csrf_token"[^>]*value="([^"]+)"')
+
+
+def csrf_token(client, url):
+    """CSRF-токен из формы на странице url (None - формы с токеном нет)."""
+    response = client.get(url)
+    match = _CSRF_RE.search(response.get_data(as_text=True))
+    response.close()
+    return match.group(1) if match else None
+
+
+def _track(search_type):
+    def make(rng, ids):
+        identifier = rng.randint(1, ids[search_type])
+        return "POST", "/track", {"search_type": search_type, "identifier": str(identifier)}
+    return make
+
+
+def _api_track_batch(rng, ids):
+    cargo_ids = ",".join(str(rng.randint(1, ids["cargo"])) for _ in range(50))
+    return "GET", f"/api/v1/track?cargo_ids={cargo_ids}", None
+
+
+def _cargo_list(rng, ids):
+    return "GET", "/admin/cargos", None
+
+
+def _cargo_list_page(rng, ids):
+    # Страница из середины таблицы - проверяет, что keyset-пагинация не деградирует с глубиной
+    return "GET", f"/admin/cargos?after={rng.randint(1, ids['cargo'])}", None
+
+
+def _cargo_list_filtered(rng, ids):
+    return "GET", "/admin/cargos?status=%D0%92%20%D0%BF%D1%83%D1%82%D0%B8&stalled_hours=24", None
+
+
+def _search(rng, ids):
+    query = rng.choice(["зерно", "алматы", "уголь астана", "в пути", "KZ-001"])
+    return "GET", f"/api/v1/search?q={query}", None
+
+
+def _train_list(rng, ids):
+    return "GET", "/admin/trains", None
+
+
+def _cargo_add_form(rng, ids):
+    return "GET", "/admin/cargos/add", None
+
+
+def _cargo_edit_form(rng, ids):
+    return "GET", f"/admin/cargos/edit/{rng.randint(1, ids['cargo'])}", None
+
+
+# Значения для сценария сохранения груза: один и тот же --seed пишет одни и те же данные
+_CARGO_TYPES = ["Зерно", "Уголь", "Металлопрокат", "Контейнеры", "Нефтепродукты"]
+_CARGO_STATUSES = ["В пути", "На станции", "Погрузка"]
+_CARGO_STATIONS = ["Алматы", "Астана", "Караганда", "Кокшетау", "Павлодар"]
+
+
+def _cargo_edit_submit(rng, ids):
+    return "POST", f"/admin/cargos/edit/{rng.randint(1, ids['cargo'])}", {
+        "cargo_type": rng.choice(_CARGO_TYPES),
+        "train_id": str(rng.randint(1, ids["train"])),
+        "current_station": rng.choice(_CARGO_STATIONS),
+        "status": rng.choice(_CARGO_STATUSES),
+        "next_station": rng.choice(_CARGO_STATIONS),
+    }
+
+
+def _login(password):
+    def make(rng, ids):
+        return "POST", "/login", {"username": "admin", "password": password}
+    return make
+
+
+def build_scenarios(password):
+    return [
+        Scenario("track_cargo", _track("cargo")),
+        Scenario("track_train", _track("train")),
+        Scenario("api_track_batch50", _api_track_batch),
+        Scenario("admin_cargo_list", _cargo_list, admin=True),
+        Scenario("admin_cargo_list_deep_page", _cargo_list_page, admin=True),
+        Scenario("admin_cargo_list_filtered", _cargo_list_filtered, admin=True),
+        Scenario("admin_train_list", _train_list, admin=True),
+        Scenario("admin_search", _search, admin=True),
+        Scenario("admin_cargo_add_form", _cargo_add_form, admin=True),
+        # Удалённый id - редирект на список с flash-сообщением, это корректный ответ, а не ошибка
+        Scenario("admin_cargo_edit_form", _cargo_edit_form, admin=True, expected=(200, 302)),
+        # Запись через форму: валидация, CSRF, UPDATE с триггерами, инвалидация кэшей.
+        # Успех - редирект на список; 200 означает, что форма вернулась с ошибкой
+        Scenario("admin_cargo_edit_submit", _cargo_edit_submit, admin=True, expected=(302,), csrf=True),
+        # Успешный вход - редирект; сценарий включает проверку хеша пароля (намеренно дорогую)
+        Scenario("login", _login(password), expected=(302,), csrf=True),
+    ]
+
+
+def percentile(sorted_values, fraction):
+    """Перцентиль по методу ближайшего ранга (значения уже отсортированы)."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def _login_client(client, password):
+    response = client.post("/login", data={
+        "username": "admin", "password": password, "csrf_token": csrf_token(client, "/login"),
+    })
+    if response.status_code != 302:
+        raise RuntimeError(f"Не удалось войти как admin (код {response.status_code}); проверьте --admin-password")
+
+
+def run_scenario(app, scenario, ids, requests, concurrency, seed, password, warmup):
+    """Выполняет сценарий и возвращает словарь с метриками."""
+    local = threading.local()
+    counter_lock = threading.Lock()
+    next_index = [0]
+    latencies = []
+    errors = {}
+
+    def client_for_thread():
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = app.test_client()
+            if scenario.admin:
+                _login_client(client, password)
+        return client
+
+    def request_params(index):
+        # Отдельный генератор на каждый номер запроса - последовательность не зависит от планирования потоков
+        return scenario.make_request(random.Random(f"{seed}:{scenario.name}:{index}"), ids)
+
+    def send(client, index):
+        method, url, data = request_params(index)
+        if scenario.name == "login":
+            # Для повторного входа нужна чистая сессия (иначе /login сразу редиректит)
+            with client.session_transaction() as sess:
+                sess.clear()
+        if scenario.csrf:
+            data = dict(data, csrf_token=csrf_token(client, url))
+        started = time.perf_counter()
+        response = client.open(url, method=method, data=data)
+        elapsed = time.perf_counter() - started
+        response.close()
+        return elapsed, response.status_code
+
+    def worker():
+        client = client_for_thread()
+        for index in range(warmup):
+            send(client, -index - 1)
+        while True:
+            with counter_lock:
+                index = next_index[0]
+                if index >= requests:
+                    return
+                next_index[0] += 1
+            elapsed, status = send(client, index)
+            with counter_lock:
+                latencies.append(elapsed)
+                if status not in scenario.expected:
+                    errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(worker) for _ in range(concurrency)]
+        for future in futures:
+            future.result()
+    wall = time.perf_counter() - started
+
+    latencies.sort()
+    ms = [value * 1000 for value in latencies]
+    return {
+        "requests": len(ms),
+        "errors": sum(errors.values()),
+        "errors_by_status": errors,
+        "wall_sec": round(wall, 3),
+        "throughput_rps": round(len(ms) / wall, 1) if wall else 0.0,
+        "latency_ms": {
+            "p50": round(percentile(ms, 0.50), 3),
+            "p95": round(percentile(ms, 0.95), 3),
+            "p99": round(percentile(ms, 0.99), 3),
+            "mean": round(sum(ms) / len(ms), 3) if ms else 0.0,
+            "max": round(ms[-1], 3) if ms else 0.0,
+        },
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def compare(current, baseline):
+    """Печатает изменение p95 и пропускной способности относительно прошлого прогона."""
+    print(f"\nСравнение с {baseline.get('git_commit') or 'baseline'}:")
+    print(f"{'сценарий':32} {'p95, мс':>20} {'изменение':>10} {'rps':>18}")
+    for name, result in current["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            print(f"{name:32} {'(нет в baseline)':>20}")
+            continue
+        p95, base_p95 = result["latency_ms"]["p95"], base["latency_ms"]["p95"]
+        change = (p95 - base_p95) / base_p95 * 100 if base_p95 else 0.0
+        print(f"{name:32} {base_p95:>9.2f} -> {p95:>8.2f} {change:>+9.1f}% "
+              f"{base['throughput_rps']:>8.1f} -> {result['throughput_rps']:>7.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный бенчмарк через Flask test client")
+    parser.add_argument("--concurrency", type=int, default=4, help="Число параллельных клиентов")
+    parser.add_argument("--requests", type=int, default=500, help="Запросов на сценарий")
+    parser.add_argument("--warmup", type=int, default=5, help="Прогревочных запросов на клиента (не учитываются)")
+    parser.add_argument("--seed", type=int, default=1, help="Зерно выбора идентификаторов")
+    parser.add_argument("--scenario", action="append", help="Запустить только указанные сценарии (можно несколько раз)")
+    parser.add_argument("--admin-password", default=os.getenv("BENCH_ADMIN_PASSWORD", DEFAULT_ADMIN_PASSWORD),
+                        help="Пароль пользователя admin (или переменная BENCH_ADMIN_PASSWORD)")
+    parser.add_argument("--disable-caches", action="store_true",
+                        help="Отключить кэш отслеживания (измерить «холодный» путь до БД)")
+    parser.add_argument("--output", help="Куда записать JSON (по умолчанию - stdout)")
+    parser.add_argument("--compare", help="JSON прошлого прогона для сравнения")
+    args = parser.parse_args(argv)
+
+    # Импорт после разбора аргументов: приложение читает DB_PATH при импорте
+    import logging
+    from app import app
+    from models import engine, Train, Cargo
+    import tracking
+
+    # CSRF остаётся включённым: сценарии с формами берут токен со страницы, как браузер
+    app.config.update(TESTING=True)
+    # Строка доступа и INFO-записи каждого запроса (JSON lines в LOG_FILE через очередь
+    # log_pipeline) исказили бы замеры и забили бы очередь - оставляем WARNING и выше
+    app.logger.setLevel(logging.WARNING)
+    if args.disable_caches:
+        tracking.tracking_cache.maxsize = 0
+
+    with engine.connect() as conn:
+        ids = {
+            "train": conn.execute(select(func.max(Train.train_id))).scalar() or 0,
+            "cargo": conn.execute(select(func.max(Cargo.cargo_id))).scalar() or 0,
+        }
+    if not ids["train"] or not ids["cargo"]:
+        parser.error("В базе нет поездов или грузов: сначала выполните python db_setup.py seed")
+
+    scenarios = build_scenarios(args.admin_password)
+    if args.scenario:
+        unknown = set(args.scenario) - {s.name for s in scenarios}
+        if unknown:
+            parser.error(f"Неизвестные сценарии: {', '.join(sorted(unknown))}")
+        scenarios = [s for s in scenarios if s.name in args.scenario]
+
+    report = {
+        "git_commit": _git_commit(),
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "config": {
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "seed": args.seed,
+            "disable_caches": args.disable_caches,
+            "db_path": app.config.get("DB_PATH"),
+            "max_train_id": ids["train"],
+            "max_cargo_id": ids["cargo"],
+        },
+        "scenarios": {},
+    }
+    for scenario in scenarios:
+        print(f"[benchmark] {scenario.name}...", file=sys.stderr)
+        report["scenarios"][scenario.name] = run_scenario(
+            app, scenario, ids, args.requests, args.concurrency, args.seed, args.admin_password, args.warmup)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"[benchmark] Результаты записаны в {args.output}", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(report, json.load(f))
+
+    failed = sum(result["errors"] for result in report["scenarios"].values())
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""
+bulk_import.py
+
+Потоковый импорт поездов и грузов из CSV / JSONL.
+
+Файл читается построчно, каждая строка проверяется теми же формами, что и
+админка (TrainForm / CargoForm), а валидные строки пишутся пакетами:
+один пакет = одна транзакция и один executemany. Строки с id обновляют
+существующую запись (upsert по первичному ключу), строки без id добавляются.
+В памяти одновременно находится не больше одного пакета, поэтому расход
+памяти не зависит от размера файла.
+
+Функции валидации используют FlaskForm, поэтому вызывать их нужно
+внутри контекста приложения (CLI-команда и роут его обеспечивают).
+"""
+
+import csv
+import json
+import time
+
+from sqlalchemy import select, insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from werkzeug.datastructures import MultiDict
+
+import live
+import tracking
+from forms import TrainForm, CargoForm
+from models import engine, Train, Cargo
+from train_choices import train_choices
+
+FORMATS = ("csv", "jsonl")
+
+
+class EntitySpec:
+    """Описание импортируемой сущности: таблица, форма и ключ."""
+
+    def __init__(self, model, form_class, pk, check_train, invalidate, notify):
+        self.model = model
+        self.table = model.__table__
+        self.form_class = form_class
+        self.pk = pk
+        self.check_train = check_train
+        self.invalidate = invalidate
+        self.notify = notify
+        # Пишем только те поля формы, которым соответствует колонка таблицы
+        self.columns = [c.name for c in self.table.columns
+                        if c.name != pk and c.name in form_class.__dict__]
+
+        stmt = sqlite_insert(self.table)
+        self.upsert = stmt.on_conflict_do_update(
+            index_elements=[pk],
+            set_={name: stmt.excluded[name] for name in self.columns},
+        )
+        self.insert = insert(self.table)
+
+
+ENTITIES = {
+    "trains": EntitySpec(Train, TrainForm, "train_id", check_train=False,
+                         invalidate=tracking.invalidate_train, notify=live.notify_trains),
+    "cargos": EntitySpec(Cargo, CargoForm, "cargo_id", check_train=True,
+                         invalidate=tracking.invalidate_cargo, notify=live.notify_cargos),
+}
+
+
+class ImportResult:
+    """
+    Итог импорта. В errors хранится не больше max_errors записей
+    (line, errors), остальные ошибки только считаются.
+    """
+
+    def __init__(self, max_errors=1000):
+        self.max_errors = max_errors
+        self.total = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_sec(self):
+        return self.total / self.elapsed if self.elapsed else 0.0
+
+    def add_error(self, line_no, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append((line_no, errors))
+
+    def as_dict(self):
+        return {
+            "total": self.total,
+            "imported": self.imported,
+            "failed": self.failed,
+            "elapsed_sec": round(self.elapsed, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+            "errors": [{"line": line, "errors": errors} for line, errors in self.errors],
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def detect_format(filename):
+    """Формат по расширению файла (.csv / .jsonl / .ndjson) или None."""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson")):
+        return "jsonl"
+    return None
+
+
+def iter_rows(stream, fmt):
+    """
+    Лениво читает текстовый поток и выдаёт пары (номер_строки, dict).
+    Вместо dict может прийти строка с описанием ошибки разбора.
+    """
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif fmt == "jsonl":
+        for line_no, line in enumerate(stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                yield line_no, f"Некорректный JSON: {e}"
+                continue
+            if not isinstance(row, dict):
+                yield line_no, "Ожидался JSON-объект"
+                continue
+            yield line_no, row
+    else:
+        raise ValueError(f"Неподдерживаемый формат: {fmt}")
+
+
+def _validate(form, spec, raw):
+    """Прогоняет строку через форму. Возвращает (record, None) или (None, errors)."""
+    formdata = MultiDict({k: str(v) for k, v in raw.items() if v is not None and k})
+    form.process(formdata)
+    if not form.validate():
+        return None, form.errors
+
+    record = {}
+    for name in spec.columns:
+        value = getattr(form, name).data
+        record[name] = None if value == "" else value
+
+    pk_value = str(raw.get(spec.pk) or "").strip()
+    if pk_value:
+        try:
+            record[spec.pk] = int(pk_value)
+        except ValueError:
+            return None, {spec.pk: ["Идентификатор должен быть числом."]}
+    return record, None
+
+
+def _flush(batch, spec, result, on_error):
+    """Пишет пакет одной транзакцией. batch - список (line_no, record)."""
+    try:
+        with engine.begin() as conn:
+            if spec.check_train:
+                train_ids = {r["train_id"] for _, r in batch if r.get("train_id") is not None}
+                existing = set()
+                if train_ids:
+                    existing = set(conn.execute(
+                        select(Train.train_id).where(Train.train_id.in_(train_ids))
+                    ).scalars())
+                valid = []
+                for line_no, record in batch:
+                    if record.get("train_id") is not None and record["train_id"] not in existing:
+                        errors = {"train_id": [f"Поезд с ID {record['train_id']} не найден."]}
+                        result.add_error(line_no, errors)
+                        if on_error:
+                            on_error(line_no, errors)
+                    else:
+                        valid.append((line_no, record))
+                batch = valid
+
+            with_id = [r for _, r in batch if spec.pk in r]
+            without_id = [r for _, r in batch if spec.pk not in r]
+            if with_id:
+                conn.execute(spec.upsert, with_id)
+            if without_id:
+                conn.execute(spec.insert, without_id)
+    except Exception as e:
+        for line_no, _ in batch:
+            errors = {"__all__": [f"Ошибка записи пакета: {e}"]}
+            result.add_error(line_no, errors)
+            if on_error:
+                on_error(line_no, errors)
+        return
+
+    result.imported += len(batch)
+    # Обновлённые записи могли лежать в кэше отслеживания, а на них - подписчики живых обновлений
+    updated_ids = [record[spec.pk] for _, record in batch if spec.pk in record]
+    for pk_value in updated_ids:
+        spec.invalidate(pk_value)
+    if updated_ids:
+        spec.notify(updated_ids)
+    if spec.model is Train and batch:
+        train_choices.invalidate()
+
+
+def import_stream(stream, entity, fmt, batch_size=1000, max_errors=1000, on_error=None):
+    """
+    Импортирует строки из текстового потока.
+
+    :param entity: "trains" или "cargos"
+    :param fmt: "csv" или "jsonl"
+    :param on_error: необязательный callback(line_no, errors) - вызывается для
+                     каждой ошибочной строки (например, чтобы писать полный отчёт в файл).
+    :return: ImportResult
+    """
+    spec = ENTITIES[entity]
+    form = spec.form_class(formdata=None, meta={"csrf": False})
+    result = ImportResult(max_errors=max_errors)
+    batch = []
+    started = time.perf_counter()
+
+    for line_no, raw in iter_rows(stream, fmt):
+        result.total += 1
+        if isinstance(raw, str):
+            errors = {"__all__": [raw]}
+        else:
+            record, errors = _validate(form, spec, raw)
+        if errors:
+            result.add_error(line_no, errors)
+            if on_error:
+                on_error(line_no, errors)
+            continue
+
+        batch.append((line_no, record))
+        if len(batch) >= batch_size:
+            _flush(batch, spec, result, on_error)
+            batch = []
+
+    if batch:
+        _flush(batch, spec, result, on_error)
+
+    result.elapsed = time.perf_counter() - started
+    return result
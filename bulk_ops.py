@@ -0,0 +1,133 @@
+"""
+bulk_ops.py
+
+Массовые операции админки над грузами и поездами: сменить статус,
+перепривязать к поезду, переместить на станцию, удалить.
+
+Вместо цикла «SELECT ... first() -> правка объекта -> commit» на каждую
+строку каждая операция - один UPDATE / DELETE ... WHERE id IN (...) на
+пакет из BULK_BATCH_SIZE ID, все пакеты в одной транзакции: либо применено
+всё, либо ничего. Триггеры SQLite (сводка, журнал перемещений, расстояния
+по сети станций) срабатывают так же, как при правке по одной строке.
+
+После commit сбрасывается кэш отслеживания и уведомляются SSE-подписчики -
+так же, как это делают одиночные роуты в app.py.
+"""
+
+from sqlalchemy import update, delete
+
+import live
+import tracking
+from models import engine, Train, Cargo
+from train_choices import train_choices
+
+
+class BulkError(ValueError):
+    """Операцию нельзя выполнить с такими параметрами (сообщение - для пользователя)."""
+
+
+def _batches(ids, batch_size):
+    for start in range(0, len(ids), batch_size):
+        yield ids[start:start + batch_size]
+
+
+def _execute(statement, key, ids, batch_size):
+    """Один statement на каждый пакет ID в одной транзакции. :return: затронуто строк"""
+    affected = 0
+    with engine.begin() as conn:
+        for batch in _batches(ids, batch_size):
+            affected += conn.execute(statement.where(key.in_(batch))).rowcount
+    return affected
+
+
+def _required(value, message):
+    value = str(value or "").strip()
+    if not value:
+        raise BulkError(message)
+    return value
+
+
+def _after_cargos(ids):
+    for cargo_id in ids:
+        tracking.invalidate_cargo(cargo_id)
+    live.notify_cargos(ids)
+
+
+def _after_trains(ids):
+    for train_id in ids:
+        tracking.invalidate_train(train_id)
+    train_choices.invalidate()
+    live.notify_trains(ids)
+
+
+def cargo_set_status(ids, batch_size, status=None):
+    status = _required(status, "Укажите статус.")
+    return _execute(update(Cargo).values(status=status), Cargo.cargo_id, ids, batch_size)
+
+
+def cargo_reassign_train(ids, batch_size, train_id=None):
+    try:
+        train_id = int(train_id)
+    except (TypeError, ValueError):
+        raise BulkError("Укажите числовой ID поезда.")
+    if not train_choices.exists(train_id):
+        raise BulkError(f"Поезд с ID {train_id} не найден.")
+    return _execute(update(Cargo).values(train_id=train_id), Cargo.cargo_id, ids, batch_size)
+
+
+def cargo_move_station(ids, batch_size, station=None):
+    station = _required(station, "Укажите станцию.")
+    return _execute(update(Cargo).values(current_station=station), Cargo.cargo_id, ids, batch_size)
+
+
+def cargo_delete(ids, batch_size):
+    return _execute(delete(Cargo), Cargo.cargo_id, ids, batch_size)
+
+
+def train_move_station(ids, batch_size, station=None):
+    station = _required(station, "Укажите станцию.")
+    return _execute(update(Train).values(last_operation_station=station), Train.train_id, ids, batch_size)
+
+
+def train_delete(ids, batch_size):
+    """
+    Поезда вместе с их грузами (как cascade="all, delete-orphan" у Train.cargos,
+    только без загрузки объектов). :return: удалено поездов
+    """
+    affected = 0
+    with engine.begin() as conn:
+        for batch in _batches(ids, batch_size):
+            conn.execute(delete(Cargo).where(Cargo.train_id.in_(batch)))
+            affected += conn.execute(delete(Train).where(Train.train_id.in_(batch))).rowcount
+    return affected
+
+
+# Операция -> (функция, параметр из запроса или None, действие после commit)
+ACTIONS = {
+    "cargos": {
+        "set_status": (cargo_set_status, "status", _after_cargos),
+        "reassign_train": (cargo_reassign_train, "train_id", _after_cargos),
+        "move_station": (cargo_move_station, "station", _after_cargos),
+        "delete": (cargo_delete, None, _after_cargos),
+    },
+    "trains": {
+        "move_station": (train_move_station, "station", _after_trains),
+        "delete": (train_delete, None, _after_trains),
+    },
+}
+
+
+def run(entity, action, ids, value=None, batch_size=500):
+    """
+    Выполняет массовую операцию над списком ID (дубликаты уже убраны).
+    :return: число затронутых строк; BulkError - неизвестная операция или пустой параметр
+    """
+    try:
+        func, param, after = ACTIONS[entity][action]
+    except KeyError:
+        raise BulkError(f"Неизвестная операция: {action}.")
+    if not ids:
+        raise BulkError("Не выбрано ни одной записи.")
+    affected = func(ids, batch_size, **({param: value} if param else {}))
+    after(ids)
+    return affected
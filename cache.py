@@ -0,0 +1,106 @@
+"""
+cache.py
+
+Простой потокобезопасный in-process кэш (LRU + TTL) с тегами для
+точечной инвалидации и счётчиками попаданий/промахов.
+
+Кэш живёт внутри одного процесса: у каждого воркера gunicorn он свой,
+поэтому TTL ограничивает «устаревание» данных между воркерами.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU-кэш с ограничением по размеру и времени жизни записей.
+
+    Каждой записи можно назначить набор тегов; invalidate_tag(tag)
+    удаляет все записи с этим тегом (например, все грузы одного поезда).
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}             # tag -> set(keys)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value, _ = entry
+            if expires_at <= self._clock():
+                self._remove(key)
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, tags=()):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            tags = frozenset(tags)
+            self._data[key] = (self._clock() + self.ttl, value, tags)
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._data) > self.maxsize:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def invalidate_tag(self, tag):
+        """Удаляет все записи, помеченные тегом. Возвращает число удалённых записей."""
+        with self._lock:
+            keys = self._tags.pop(tag, ())
+            for key in list(keys):
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._tags.clear()
+
+    def stats(self):
+        """Снимок счётчиков для логов / метрик."""
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+    def _remove(self, key):
+        # Вызывается только под self._lock
+        entry = self._data.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
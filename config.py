@@ -13,9 +13,154 @@ class Config:
     # DB_PATH="sqlite:///C:/myproject/database.db" или относительный.
     DB_PATH = os.getenv("DB_PATH", "database.db")
 
+    # Настройки SQLite, применяются PRAGMA при каждом новом соединении.
+    # WAL позволяет читателям не ждать писателя (и наоборот), NORMAL в WAL-режиме
+    # безопасен от порчи БД и заметно быстрее FULL.
+    SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-20000"))   # <0 - в КиБ (т.е. ~20 МБ)
+    SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", "268435456"))  # 256 МБ, 0 - выключить
+
+    # Пул соединений (на процесс)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+
+    # Отдельный read-only engine (mode=ro) для публичных read-путей (/track и т.п.).
+    # false - публичные чтения идут через основной engine.
+    DB_READ_ONLY_ENGINE = os.getenv("DB_READ_ONLY_ENGINE", "true").lower() == "true"
+
     # Пример дополнительной настройки
     DEBUG = os.getenv("FLASK_DEBUG", "false").lower() == "true"
 
+    # Кэш пользователей по user_id из сессии (на воркер): login_required не ходит в БД
+    # на каждый запрос. USER_CACHE_TTL - сколько секунд воркер может не замечать смену
+    # роли или удаление пользователя.
+    USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+    USER_CACHE_TTL = int(os.getenv("USER_CACHE_TTL", "30"))
+
+    # Пагинация списков в админке (keyset по первичному ключу).
+    # ADMIN_PAGE_SIZE - размер страницы по умолчанию, ADMIN_PAGE_SIZE_MAX - верхняя
+    # граница для параметра ?per_page=, чтобы один запрос не мог выгрузить всю таблицу.
+    ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
+    ADMIN_PAGE_SIZE_MAX = int(os.getenv("ADMIN_PAGE_SIZE_MAX", "500"))
+
+    # Кэш результатов /track (в памяти процесса): максимум записей и TTL в секундах.
+    # TRACK_CACHE_SIZE=0 отключает кэш.
+    TRACK_CACHE_SIZE = int(os.getenv("TRACK_CACHE_SIZE", "10000"))
+    TRACK_CACHE_TTL = int(os.getenv("TRACK_CACHE_TTL", "30"))
+
+    # Кэш списка поездов (train_id, name) для форм грузов, TTL в секундах
+    TRAIN_CHOICES_TTL = int(os.getenv("TRAIN_CHOICES_TTL", "300"))
+
+    # Метрики (/metrics): порог медленного SQL-запроса в мс (0 - не логировать)
+    # и необязательный токен для Prometheus (Authorization: Bearer <токен>);
+    # без токена /metrics доступен только администратору.
+    SLOW_QUERY_MS = int(os.getenv("SLOW_QUERY_MS", "200"))
+    METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+    # Пакетный JSON API отслеживания: максимум ID (грузов + поездов) в одном запросе
+    TRACK_API_MAX_IDS = int(os.getenv("TRACK_API_MAX_IDS", "500"))
+
+    # Массовый импорт (CSV/JSONL): строк в одной транзакции и сколько ошибок
+    # показывать в отчёте (остальные только считаются).
+    IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+    IMPORT_MAX_REPORTED_ERRORS = int(os.getenv("IMPORT_MAX_REPORTED_ERRORS", "1000"))
+
+    # Массовые операции в админке (bulk_ops.py): ID в одном UPDATE/DELETE ... IN (...)
+    # и сколько ID можно передать за один запрос (все пакеты - одна транзакция).
+    BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", "500"))
+    BULK_MAX_IDS = int(os.getenv("BULK_MAX_IDS", "10000"))
+
+    # Потоковая выгрузка (export.py): строк, забираемых из курсора за раз
+    # (одна пачка = один кусок chunked-ответа / одна группа строк Parquet).
+    EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "5000"))
+
+    # Полнотекстовый поиск (FTS5): размер страницы выдачи и сколько результатов
+    # можно пролистать (выдача ранжирована, поэтому страницы - через OFFSET).
+    SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+    SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+    # Сколько самых новых совпадений ранжировать по bm25 для очень частых слов
+    # («в пути», «алматы»): ограничивает время запроса независимо от размера таблицы.
+    SEARCH_RANK_CANDIDATES = int(os.getenv("SEARCH_RANK_CANDIDATES", "10000"))
+
+    # Живые обновления /track (Server-Sent Events): лимит одновременных потоков
+    # на процесс, ID в одной подписке, интервал keep-alive и максимальная длительность
+    # потока (секунды; после неё браузер переподключается сам), размер очереди событий потока.
+    SSE_MAX_CONNECTIONS = int(os.getenv("SSE_MAX_CONNECTIONS", "1000"))
+    SSE_MAX_IDS = int(os.getenv("SSE_MAX_IDS", "50"))
+    SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
+    SSE_MAX_STREAM_SECONDS = int(os.getenv("SSE_MAX_STREAM_SECONDS", "3600"))
+    SSE_QUEUE_SIZE = int(os.getenv("SSE_QUEUE_SIZE", "100"))
+
+    # Приём телеметрии поездов (POST /api/v1/telemetry): токен устройств
+    # (Authorization: Bearer <токен>; без него - только администратор),
+    # максимум событий в одном запросе и статусы грузов, которые уже не едут
+    # с поездом (им местоположение не переносится), через запятую.
+    TELEMETRY_TOKEN = os.getenv("TELEMETRY_TOKEN", "")
+    TELEMETRY_MAX_EVENTS = int(os.getenv("TELEMETRY_MAX_EVENTS", "5000"))
+    TELEMETRY_FROZEN_STATUSES = [
+        s.strip() for s in os.getenv("TELEMETRY_FROZEN_STATUSES", "Доставлен").split(",") if s.strip()
+    ]
+
+    # Журнал перемещений: сколько дней события хранятся без сжатия, общий срок
+    # хранения (дни, 0 - бессрочно; python db_setup.py compact-history) и размер
+    # страницы хронологии на /track.
+    HISTORY_RAW_DAYS = int(os.getenv("HISTORY_RAW_DAYS", "90"))
+    HISTORY_RETENTION_DAYS = int(os.getenv("HISTORY_RETENTION_DAYS", "1825"))
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+
+    # HTTP-кэш и сжатие (http_cache.py): срок кэширования статики с хэшем в URL
+    # (секунды), минимальный размер ответа для сжатия (байты) и уровни сжатия
+    # «на лету» - умеренные, чтобы не тратить на них больше, чем экономится на сети.
+    STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", str(365 * 24 * 3600)))
+    COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+    COMPRESS_GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+    COMPRESS_BROTLI_QUALITY = int(os.getenv("COMPRESS_BROTLI_QUALITY", "5"))
+
+    # Кэш готовых страниц для анонимных посетителей (page_cache.py): число страниц,
+    # время жизни (секунды), языки сайта (первый - по умолчанию; ключ кэша - путь + язык)
+    # и прогрев при старте воркера.
+    PAGE_CACHE_SIZE = int(os.getenv("PAGE_CACHE_SIZE", "256"))
+    PAGE_CACHE_TTL = int(os.getenv("PAGE_CACHE_TTL", "600"))
+    PAGE_CACHE_LOCALES = [
+        s.strip() for s in os.getenv("PAGE_CACHE_LOCALES", "ru").split(",") if s.strip()
+    ]
+    PAGE_CACHE_WARM = os.getenv("PAGE_CACHE_WARM", "1") == "1"
+
+    # Отложенная запись сообщений формы контактов (contact_queue.py): размер очереди,
+    # сколько сообщений пишется одной транзакцией и сколько ждать добора пачки (мс),
+    # каталог журнала для сообщений, которые не удалось сразу записать в БД.
+    CONTACT_QUEUE_SIZE = int(os.getenv("CONTACT_QUEUE_SIZE", "10000"))
+    CONTACT_BATCH_SIZE = int(os.getenv("CONTACT_BATCH_SIZE", "200"))
+    CONTACT_BATCH_WAIT_MS = int(os.getenv("CONTACT_BATCH_WAIT_MS", "50"))
+    CONTACT_JOURNAL_DIR = os.getenv("CONTACT_JOURNAL_DIR", "contact_journal")
+
+    # Расчёт ETA грузов (eta.py): статусы «в пути» через запятую, за сколько дней
+    # история перемещений поездов даёт среднюю скорость по участкам, сколько
+    # перемещений нужно, чтобы доверять скорости участка/станции, скорость по
+    # умолчанию и допустимый диапазон (км/ч), строк в одной транзакции записи.
+    ETA_STATUSES = [s.strip() for s in os.getenv("ETA_STATUSES", "В пути").split(",") if s.strip()]
+    ETA_HISTORY_DAYS = int(os.getenv("ETA_HISTORY_DAYS", "30"))
+    ETA_MIN_SAMPLES = int(os.getenv("ETA_MIN_SAMPLES", "3"))
+    ETA_DEFAULT_SPEED_KMH = float(os.getenv("ETA_DEFAULT_SPEED_KMH", "40"))
+    ETA_MIN_SPEED_KMH = float(os.getenv("ETA_MIN_SPEED_KMH", "5"))
+    ETA_MAX_SPEED_KMH = float(os.getenv("ETA_MAX_SPEED_KMH", "120"))
+    ETA_BATCH_SIZE = int(os.getenv("ETA_BATCH_SIZE", "50000"))
+
+    # Логирование (log_pipeline.py): JSON lines в LOG_FILE (пусто - только консоль),
+    # ротация по размеру, размер очереди до фонового потока записи (при переполнении
+    # записи отбрасываются, а не тормозят запросы) и выборка шумных уровней:
+    # "INFO=0.1" - пишется каждый десятый запрос со всеми его INFO-записями.
+    LOG_FILE = os.getenv("LOG_FILE", "logs/app.jsonl")
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+    LOG_SAMPLING = os.getenv("LOG_SAMPLING", "")
+    LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+    LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "5"))
+    LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+    # Логгеры модулей, которые пишут через тот же конвейер
+    LOG_EXTRA_LOGGERS = ("contact_queue", "werkzeug")
+
 class ProductionConfig(Config):
     """Настройки для продакшена."""
     DEBUG = False
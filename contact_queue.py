@@ -0,0 +1,273 @@
+"""
+contact_queue.py
+
+Отложенная запись сообщений формы «Контакты» (write-behind).
+
+View кладёт сообщение в ограниченную очередь и сразу отвечает; фоновый
+поток забирает сообщения пачками (до CONTACT_BATCH_SIZE штук или
+CONTACT_BATCH_WAIT_MS ожидания) и записывает каждую пачку одним INSERT
+(executemany) в одной транзакции. Во время всплесков трафика вместо сотен
+коротких транзакций, спорящих с админкой за блокировку записи SQLite,
+получается несколько групповых.
+
+Сообщения не теряются:
+- очередь переполнена или БД недоступна - сообщения дописываются в журнал
+  на диске (JSONL, свой файл у каждого процесса: contacts-<pid>.jsonl);
+- журнал переигрывается в БД, когда очередь простаивает; журналы
+  завершившихся процессов подхватывает любой живой процесс;
+- при остановке процесса (atexit) очередь дописывается в БД, а что не
+  успело - в журнал.
+"""
+
+import atexit
+import datetime
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from sqlalchemy import insert
+
+import metrics
+from config import Config
+from models import engine, Contact
+
+MESSAGES_TOTAL = metrics.registry.register(metrics.Counter(
+    "contact_messages_total", "Сообщения формы контактов по способу записи", ("result",)))
+COMMIT_SECONDS = metrics.registry.register(metrics.Histogram(
+    "contact_commit_seconds", "Время записи одной пачки сообщений в БД"))
+BATCH_SIZE = metrics.registry.register(metrics.Histogram(
+    "contact_batch_size", "Сообщений в одной пачке", buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500)))
+
+_STOP = object()
+
+logger = logging.getLogger(__name__)
+
+
+def _pid_alive(pid):
+    if os.name != "posix":
+        return True # без надёжной проверки чужие журналы не трогаем
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class ContactWriter:
+    def __init__(self, maxsize=10000, batch_size=200, batch_wait=0.05, journal_dir="contact_journal",
+                 replay_interval=30.0):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.journal_dir = journal_dir
+        self.replay_interval = replay_interval
+        self._journal_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._next_replay = 0.0
+
+    @property
+    def depth(self):
+        return self.queue.qsize()
+
+    # --- Приём сообщений (поток запроса) ---
+
+    def submit(self, name, email, message):
+        """Ставит сообщение в очередь на запись. Не блокирует: при переполнении пишет в журнал."""
+        row = {"name": name, "email": email, "message": message,
+               "created_at": datetime.datetime.utcnow().isoformat()}
+        self._ensure_started()
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            self._journal([row])
+
+    def _ensure_started(self):
+        # Поток запускается в том процессе, где пришло первое сообщение (после fork воркера gunicorn)
+        if self._thread is not None and self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or self._pid != os.getpid() or not self._thread.is_alive():
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="contact-writer", daemon=True)
+                self._thread.start()
+
+    # --- Фоновая запись ---
+
+    def _run(self):
+        while True:
+            batch, stop = self._next_batch()
+            if batch:
+                self._write(batch)
+            if stop:
+                return
+            if not batch and time.monotonic() >= self._next_replay:
+                self.replay_journals()
+                self._next_replay = time.monotonic() + self.replay_interval
+
+    def _next_batch(self):
+        """Пачка сообщений: ждёт первое (до секунды), затем добирает до batch_size за batch_wait."""
+        try:
+            first = self.queue.get(timeout=1.0)
+        except queue.Empty:
+            return [], False
+        if first is _STOP:
+            return [], True
+        batch = [first]
+        deadline = time.monotonic() + self.batch_wait
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                item = self.queue.get(timeout=timeout) if timeout > 0 else self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _insert(self, rows):
+        started = time.perf_counter()
+        with engine.begin() as conn:
+            conn.execute(insert(Contact.__table__), [
+                {**row, "created_at": datetime.datetime.fromisoformat(row["created_at"])} for row in rows
+            ])
+        COMMIT_SECONDS.observe(time.perf_counter() - started)
+        BATCH_SIZE.observe(len(rows))
+
+    def _write(self, rows):
+        try:
+            self._insert(rows)
+            MESSAGES_TOTAL.inc("committed", amount=len(rows))
+        except Exception as e:
+            # БД недоступна / заблокирована дольше busy_timeout - сохраняем на диск, переиграем позже
+            self._log_error(f"Не удалось записать {len(rows)} сообщений в БД, сохраняем в журнал: {e}")
+            self._journal(rows)
+            self._next_replay = time.monotonic() + self.replay_interval
+
+    # --- Журнал на диске ---
+
+    def _journal_path(self, pid=None):
+        return os.path.join(self.journal_dir, f"contacts-{pid or os.getpid()}.jsonl")
+
+    def _journal(self, rows):
+        os.makedirs(self.journal_dir, exist_ok=True)
+        data = "".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+        with self._journal_lock:
+            with open(self._journal_path(), "a", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+        MESSAGES_TOTAL.inc("journaled", amount=len(rows))
+
+    def replay_journals(self):
+        """
+        Переносит в БД свой журнал и журналы завершившихся процессов.
+        Файл сначала атомарно переименовывается (его «забирает» один процесс),
+        после успешной записи удаляется. Возвращает число записанных сообщений.
+        """
+        if not os.path.isdir(self.journal_dir):
+            return 0
+        replayed = 0
+        my_pid = os.getpid()
+        for path in sorted(glob.glob(os.path.join(self.journal_dir, "contacts-*.jsonl*"))):
+            claimed = self._claim(path, my_pid)
+            if claimed is None:
+                continue
+            try:
+                rows = self._read_journal(claimed)
+                if rows:
+                    self._insert(rows) # одной транзакцией: при ошибке файл переиграется целиком без дублей
+                replayed += len(rows)
+            except Exception as e:
+                self._log_error(f"Не удалось переиграть журнал {claimed}: {e}")
+                return replayed # файл остаётся .replay - повторим в следующий раз
+            os.remove(claimed)
+        if replayed:
+            MESSAGES_TOTAL.inc("replayed", amount=replayed)
+        return replayed
+
+    def _read_journal(self, path):
+        rows = []
+        with open(path, encoding="utf-8") as f:
+            for line_no, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # Оборванная строка (процесс упал посреди записи) - пропускаем, остальное сохраняем
+                    self._log_error(f"Повреждённая строка {line_no} в журнале {path} пропущена")
+        return rows
+
+    def _claim(self, path, my_pid):
+        """Переименовывает журнал в <имя>.<pid>.replay, если его можно забрать; иначе None."""
+        name = os.path.basename(path)
+        owner = name[len("contacts-"):].split(".")[0]
+        if name.endswith(".replay"):
+            claimer = int(name.split(".")[-2])
+            if claimer != my_pid and _pid_alive(claimer):
+                return None # его переигрывает другой живой процесс
+        elif int(owner) != my_pid and _pid_alive(int(owner)):
+            return None
+        if name.endswith(f".{my_pid}.replay"):
+            return path
+        base = path[:path.index(".jsonl") + len(".jsonl")]
+        claimed = f"{base}.{my_pid}.replay"
+        if os.path.exists(claimed):
+            return None # сначала переиграется уже забранный файл, этот - в следующий раз
+        if my_pid == int(owner):
+            # Свой файл забираем под блокировкой, чтобы не разорвать дописывание
+            with self._journal_lock:
+                return self._rename(path, claimed)
+        return self._rename(path, claimed)
+
+    @staticmethod
+    def _rename(path, claimed):
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError: # файл успел забрать другой процесс
+            return None
+        return claimed
+
+    # --- Остановка ---
+
+    def stop(self, timeout=10.0):
+        """Дописывает очередь и останавливает поток; не успевшее - в журнал."""
+        thread = self._thread
+        if thread is not None and thread.is_alive() and self._pid == os.getpid():
+            try:
+                self.queue.put(_STOP, timeout=timeout)
+            except queue.Full:
+                pass
+            thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not _STOP:
+                leftover.append(item)
+        if leftover:
+            self._journal(leftover)
+
+    @staticmethod
+    def _log_error(message):
+        logger.error(message)
+
+
+contact_writer = ContactWriter(
+    maxsize=Config.CONTACT_QUEUE_SIZE,
+    batch_size=Config.CONTACT_BATCH_SIZE,
+    batch_wait=Config.CONTACT_BATCH_WAIT_MS / 1000,
+    journal_dir=Config.CONTACT_JOURNAL_DIR,
+)
+atexit.register(contact_writer.stop)
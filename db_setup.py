@@ -4,30 +4,62 @@ db_setup.py
 
 Скрипт для инициализации (пересоздания) базы данных и заполнения тестовыми данными.
 Использует SQLAlchemy и модели из models.py.
+
+Режимы запуска:
+    python db_setup.py            - пересоздать БД с нуля (drop_all + create_all)
+    python db_setup.py migrate    - без потери данных добавить недостающие таблицы, колонки и индексы
+    python db_setup.py explain    - проверить через EXPLAIN QUERY PLAN, что горячие запросы идут по индексам
+    python db_setup.py backfill-datetimes - привести старые строковые значения времени к формату DateTime
+    python db_setup.py seed --trains 10000 --cargos 1000000 - добавить синтетические данные (для нагрузочных тестов)
+    python db_setup.py rebuild-search - перестроить полнотекстовый индекс (FTS5) по грузам и поездам
+    python db_setup.py compact-history - сжать старую историю перемещений и удалить события старше срока хранения
+    python db_setup.py rebuild-summary - пересчитать сводку админ-панели
+    python db_setup.py rebuild-routes - пересчитать расстояния по сети станций и обновить distance_to_arrival
 """
 
-import os
-from sqlalchemy import create_engine
+import argparse
+import datetime
+import itertools
+import random
+import sys
+import time
+from sqlalchemy import (
+    inspect, text, select, update, insert, bindparam, cast, literal, and_, or_, func, Text
+)
 from sqlalchemy.orm import Session
 
+import history
+import routing
+import search
+import summary
 from config import Config
-from models import Base, create_default_data
+from models import Base, engine, create_default_data, parse_datetime, DATETIME_COLUMNS, Train, Cargo
 
 def init_db(drop_all: bool = True):
     """
     Инициализирует (и при необходимости пересоздаёт) базу данных.
     :param drop_all: Если True, удаляет все существующие таблицы перед созданием.
     """
-    # Формируем путь к базе (SQLite) из config
-    db_path = Config.DB_PATH  # или DevelopmentConfig/ProductionConfig
-    engine = create_engine(f"sqlite:///{db_path}", echo=False)
+    # Используем основной engine из models: к нему уже привязаны PRAGMA
+    # (в т.ч. journal_mode=WAL, который сохраняется в файле БД)
+    print(f"[db_setup] База данных: {Config.DB_PATH}")
 
     if drop_all:
         print("[db_setup] Удаляем все таблицы...")
+        with engine.begin() as conn:
+            search.drop(conn) # FTS-таблицы SQLAlchemy не знает - удаляем сами
+            history.drop_triggers(conn)
+            summary.drop_triggers(conn)
+            routing.drop_triggers(conn)
         Base.metadata.drop_all(bind=engine)
 
     print("[db_setup] Создаём таблицы...")
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        search.install(conn)
+        routing.install(conn)
+        history.install(conn)
+        summary.install(conn)
 
     # При желании добавляем базовые/тестовые данные
     with Session(engine) as session:
@@ -36,6 +68,432 @@ def init_db(drop_all: bool = True):
 
     print("[db_setup] База данных успешно инициализирована.")
 
+def migrate():
+    """
+    Неразрушающая миграция «живой» базы: создаёт отсутствующие таблицы,
+    добавляет отсутствующие колонки (ALTER TABLE ADD COLUMN) и индексы.
+    Существующие данные и объекты не трогает.
+    """
+    print(f"[db_setup] Миграция базы данных: {Config.DB_PATH}")
+    inspector = inspect(engine)
+    existing_tables = set(inspector.get_table_names())
+    changes = 0
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                print(f"[db_setup] + таблица {table.name}")
+                table.create(bind=conn)
+                changes += 1
+                continue # create() создаёт таблицу вместе с её индексами
+
+            existing_columns = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                if column.primary_key or (not column.nullable and column.server_default is None):
+                    # SQLite не умеет добавлять такие колонки через ALTER TABLE
+                    print(f"[db_setup] ! пропущена колонка {table.name}.{column.name}: "
+                          f"NOT NULL без server_default или первичный ключ, нужна ручная миграция")
+                    continue
+                col_type = column.type.compile(dialect=engine.dialect)
+                ddl = f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {col_type}'
+                if column.server_default is not None:
+                    default = column.server_default.arg
+                    default_sql = default.text if hasattr(default, "text") else f"'{default}'"
+                    ddl += f" DEFAULT {default_sql}"
+                print(f"[db_setup] + колонка {table.name}.{column.name} ({col_type})")
+                conn.execute(text(ddl))
+                changes += 1
+
+            existing_indexes = {ix["name"] for ix in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    print(f"[db_setup] + индекс {index.name}")
+                    index.create(bind=conn)
+                    changes += 1
+
+        # Полнотекстовый индекс и триггеры синхронизации (новый индекс сразу заполняется)
+        created = search.install(conn)
+        if created:
+            print(f"[db_setup] + полнотекстовых индексов: {created}")
+            changes += created
+        # Сеть станций: триггеры расчёта расстояний, таблица расстояний, если её ещё нет
+        routed = routing.install(conn)
+        if routed:
+            print(f"[db_setup] + рассчитано расстояний по сети станций: {routed}")
+            changes += routed
+        # Смена формата времени ниже - не перемещение: на время backfill журнал выключен
+        history.drop_triggers(conn)
+
+    # Данные: строковое время -> формат DateTime (безопасно запускать повторно)
+    changes += backfill_datetimes()
+
+    # Журнал перемещений: триггеры и начальные события для объектов без истории
+    with engine.begin() as conn:
+        created = history.install(conn)
+        # Сводка админ-панели: триггеры и начальный пересчёт, если сводка пуста
+        filled = summary.install(conn)
+    if created:
+        print(f"[db_setup] + начальных событий в журнале перемещений: {created}")
+        changes += created
+    if filled:
+        print("[db_setup] + сводка админ-панели заполнена")
+        changes += 1
+
+    # ANALYZE здесь намеренно не делаем: статистика, снятая на почти пустой
+    # базе, потом толкает планировщик к полным сканам на больших таблицах.
+    print(f"[db_setup] Миграция завершена, изменений: {changes}.")
+    return changes
+
+
+# Так SQLAlchemy хранит DateTime в SQLite: 'YYYY-MM-DD HH:MM:SS.ffffff'.
+# Значения в этом формате сравниваются как строки в хронологическом порядке.
+_CANONICAL_DATETIME_GLOB = (
+    "[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] "
+    "[0-9][0-9]:[0-9][0-9]:[0-9][0-9].[0-9][0-9][0-9][0-9][0-9][0-9]"
+)
+
+
+def backfill_datetimes(batch_size: int = 5000):
+    """
+    Потоково переводит строковые значения времени (бывшие String-колонки)
+    в канонический формат DateTime.
+
+    Таблица проходится пакетами по первичному ключу (keyset), каждый пакет -
+    отдельная короткая транзакция, поэтому миграция не держит блокировку
+    и не грузит всю таблицу в память. Нераспознанные значения обнуляются
+    и перечисляются в выводе.
+
+    Смена формата времени - не перемещение: триггеры журнала перемещений
+    на время backfill снимаются и затем ставятся обратно (если были).
+    :return: число обновлённых строк
+    """
+    with engine.begin() as conn:
+        journal_installed = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = :name"
+        ), {"name": history.SOURCES["cargo"].trigger_names()[0]}).first() is not None
+        history.drop_triggers(conn)
+    try:
+        return _backfill_datetimes(batch_size)
+    finally:
+        if journal_installed:
+            with engine.begin() as conn:
+                history.install(conn)
+
+
+def _backfill_datetimes(batch_size):
+    total_updated = 0
+    for table_name, column_names in DATETIME_COLUMNS.items():
+        table = Base.metadata.tables[table_name]
+        pk = table.primary_key.columns.values()[0]
+        # Читаем «сырые» строки через CAST, минуя преобразование типов SQLAlchemy
+        raw_columns = [cast(table.c[name], Text) for name in column_names]
+        # Только строки, где хотя бы одно значение ещё не в каноническом формате
+        pattern = literal(_CANONICAL_DATETIME_GLOB, Text)
+        needs_fix = or_(*[
+            and_(raw.isnot(None), raw.op("NOT GLOB", is_comparison=True)(pattern))
+            for raw in raw_columns
+        ])
+        stmt_update = (
+            update(table)
+            .where(pk == bindparam("_pk"))
+            .values({name: bindparam(f"v_{name}") for name in column_names})
+        )
+
+        last_pk = 0
+        updated = 0
+        unparsed = []
+        while True:
+            with engine.begin() as conn:
+                rows = conn.execute(
+                    select(pk, *raw_columns)
+                    .where(pk > last_pk, needs_fix)
+                    .order_by(pk)
+                    .limit(batch_size)
+                ).all()
+                if not rows:
+                    break
+                params = []
+                for row in rows:
+                    values = {"_pk": row[0]}
+                    for name, raw in zip(column_names, row[1:]):
+                        try:
+                            values[f"v_{name}"] = parse_datetime(raw)
+                        except ValueError:
+                            values[f"v_{name}"] = None
+                            unparsed.append((row[0], name, raw))
+                    params.append(values)
+                conn.execute(stmt_update, params)
+                updated += len(params)
+                last_pk = rows[-1][0]
+
+        if updated:
+            print(f"[db_setup] {table_name}: время приведено к DateTime в {updated} строках")
+        for pk_value, name, raw in unparsed[:50]:
+            print(f"[db_setup] ! {table_name} #{pk_value}: не удалось разобрать {name}={raw!r}, значение обнулено")
+        if len(unparsed) > 50:
+            print(f"[db_setup] ! ... и ещё {len(unparsed) - 50} нераспознанных значений")
+        total_updated += updated
+    return total_updated
+
+
+# Горячие запросы приложения и индексы, которые они обязаны использовать.
+# (описание, SQL, параметры, ожидаемый фрагмент плана[, допустима ли сортировка])
+HOT_QUERIES = [
+    ("Список грузов: фильтр по статусу",
+     "SELECT * FROM cargos WHERE status = :status AND cargo_id > :after ORDER BY cargo_id LIMIT 50",
+     {"status": "В пути", "after": 0}, "USING INDEX ix_cargos_status "),
+    ("Список грузов: фильтр по станции",
+     "SELECT * FROM cargos WHERE current_station = :station AND cargo_id > :after ORDER BY cargo_id LIMIT 50",
+     {"station": "Астана", "after": 0}, "USING INDEX ix_cargos_current_station "),
+    ("Список грузов: статус + станция",
+     "SELECT * FROM cargos WHERE status = :status AND current_station = :station "
+     "AND cargo_id > :after ORDER BY cargo_id LIMIT 50",
+     {"status": "В пути", "station": "Астана", "after": 0}, "USING INDEX ix_cargos_status_station "),
+    ("Грузы поезда",
+     "SELECT * FROM cargos WHERE train_id = :train_id AND cargo_id > :after ORDER BY cargo_id LIMIT 50",
+     {"train_id": 1, "after": 0}, "USING INDEX ix_cargos_train_id "),
+    ("Выбор поезда в форме груза (order_by(Train.name))",
+     "SELECT train_id, name FROM trains ORDER BY name",
+     {}, "USING COVERING INDEX ix_trains_name"),
+    ("Последние сообщения обратной связи",
+     "SELECT * FROM contacts ORDER BY created_at DESC LIMIT 50",
+     {}, "USING INDEX ix_contacts_created_at"),
+    ("Отслеживание груза по ID",
+     "SELECT * FROM cargos WHERE cargo_id = :cargo_id",
+     {"cargo_id": 1}, "USING INTEGER PRIMARY KEY"),
+    # Окна по времени: range scan по индексу, найденные строки досортировываются по ключу страницы
+    ("Поезда, отправившиеся за последние N часов",
+     "SELECT * FROM trains WHERE departure_time >= :since AND departure_time <= :now "
+     "AND train_id > :after ORDER BY train_id LIMIT 50",
+     {"since": "2025-04-10 00:00:00.000000", "now": "2025-04-10 06:00:00.000000", "after": 0},
+     "USING INDEX ix_trains_departure_time", True),
+    ("Грузы с последней остановкой в интервале",
+     "SELECT * FROM cargos WHERE last_stop_time >= :start AND last_stop_time < :end "
+     "AND cargo_id > :after ORDER BY cargo_id LIMIT 50",
+     {"start": "2025-04-09 00:00:00.000000", "end": "2025-04-10 00:00:00.000000", "after": 0},
+     "USING INDEX ix_cargos_last_stop_time", True),
+]
+
+
+def check_query_plans():
+    """
+    Прогоняет HOT_QUERIES через EXPLAIN QUERY PLAN и проверяет, что каждый
+    запрос использует ожидаемый индекс и (если не разрешено явно) не строит
+    временное B-дерево для сортировки.
+    :return: True, если все проверки прошли.
+    """
+    ok = True
+    with engine.connect() as conn:
+        for title, sql, params, expected, *rest in HOT_QUERIES:
+            allow_sort = rest[0] if rest else False
+            plan = [row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params)]
+            plan_text = " | ".join(plan)
+            passed = expected in plan_text and (allow_sort or "TEMP B-TREE" not in plan_text)
+            ok = ok and passed
+            print(f"[db_setup] {'OK  ' if passed else 'FAIL'} {title}: {plan_text}")
+    return ok
+
+
+# ------------------------------------
+# СИНТЕТИЧЕСКИЕ ДАННЫЕ
+# ------------------------------------
+
+# Станции в порядке «загруженности»: вес станции ~ 1 / ранг^0.8 (распределение Ципфа),
+# т.е. крупные узлы встречаются заметно чаще мелких - как в реальной сети.
+SEED_STATIONS = [
+    "Алматы", "Астана", "Караганда", "Шымкент", "Актобе", "Павлодар", "Костанай",
+    "Кокшетау", "Семей", "Атырау", "Уральск", "Усть-Каменогорск", "Тараз", "Кызылорда",
+    "Петропавловск", "Экибастуз", "Актау", "Туркестан", "Балхаш", "Жезказган",
+    "Сарыагаш", "Достык", "Хоргос", "Бейнеу", "Мойынты",
+]
+SEED_STATUSES = [
+    ("В пути", 55), ("На станции", 12), ("Погрузка", 8),
+    ("Выгрузка", 5), ("Доставлен", 15), ("Задержан", 5),
+]
+SEED_CARGO_TYPES = [
+    "Зерно", "Уголь", "Нефтепродукты", "Контейнеры", "Металлопрокат", "Удобрения",
+    "Лес", "Продовольственные товары", "Цемент", "Автомобили", "Руда", "Химия",
+]
+SEED_OPERATIONS = ["Прибытие", "Отправление", "Погрузка", "Выгрузка", "Проследование", "Стоянка"]
+
+
+def seed_network(conn, rng):
+    """
+    Сеть для синтетических данных, если участков ещё нет: цепочка через все
+    SEED_STATIONS и несколько «хорд», длины участков 80-600 км.
+    Таблица расстояний считается в конце seed (routing.install).
+    """
+    if conn.execute(text("SELECT 1 FROM track_segments LIMIT 1")).first() is not None:
+        return
+    conn.execute(text("INSERT OR IGNORE INTO stations (name) VALUES (:name)"), [{"name": n} for n in SEED_STATIONS])
+    ids = dict(conn.execute(text("SELECT name, station_id FROM stations")).all())
+    pairs = set(zip(SEED_STATIONS, SEED_STATIONS[1:]))
+    while len(pairs) < len(SEED_STATIONS) + 10:
+        a, b = rng.sample(SEED_STATIONS, 2)
+        if (b, a) not in pairs:
+            pairs.add((a, b))
+    conn.execute(text("INSERT INTO track_segments (from_station_id, to_station_id, length_km) VALUES (:a, :b, :km)"), [
+        {"a": min(ids[a], ids[b]), "b": max(ids[a], ids[b]), "km": rng.randint(80, 600)} for a, b in sorted(pairs)
+    ])
+
+
+def seed_synthetic(trains: int, cargos: int, seed: int = 42, batch_size: int = 10000):
+    """
+    Добавляет trains поездов и cargos грузов со случайными, но правдоподобными
+    данными. При одинаковом seed результат воспроизводим.
+
+    Вставка идёт пакетами по batch_size строк (executemany, одна транзакция на пакет),
+    в памяти держится только текущий пакет и компактное описание поездов.
+    """
+    rng = random.Random(seed)
+    station_weights = list(itertools.accumulate(1 / (rank ** 0.8) for rank in range(1, len(SEED_STATIONS) + 1)))
+    status_names = [name for name, _ in SEED_STATUSES]
+    status_weights = list(itertools.accumulate(weight for _, weight in SEED_STATUSES))
+    now = datetime.datetime.now().replace(second=0, microsecond=0)
+
+    def station():
+        return rng.choices(SEED_STATIONS, cum_weights=station_weights)[0]
+
+    Base.metadata.create_all(bind=engine)
+    # Построчные триггеры FTS, журнала, сводки и расстояний замедлили бы вставку в несколько раз:
+    # снимаем их и в конце строим индекс, расстояния, начальные события и сводку одним проходом
+    with engine.begin() as conn:
+        search.drop(conn)
+        history.drop_triggers(conn)
+        summary.drop_triggers(conn)
+        routing.drop_triggers(conn)
+        seed_network(conn, rng)
+    with engine.connect() as conn:
+        first_train_id = (conn.execute(select(func.max(Train.train_id))).scalar() or 0) + 1
+    print(f"[db_setup] Синтетические данные: {trains} поездов, {cargos} грузов (seed={seed})")
+    started = time.perf_counter()
+
+    # Поезда. Запоминаем (станция последней операции, конечная станция, время операции) -
+    # по ним согласованно заполняются грузы.
+    train_info = []
+    train_stmt = insert(Train.__table__)
+    for batch_start in range(0, trains, batch_size):
+        rows = []
+        for i in range(batch_start, min(batch_start + batch_size, trains)):
+            departure, arrival = station(), station()
+            while arrival == departure:
+                arrival = station()
+            departure_time = now - datetime.timedelta(minutes=rng.randint(0, 30 * 24 * 60))
+            arrival_time = departure_time + datetime.timedelta(hours=rng.randint(6, 96))
+            last_station = rng.choice((departure, arrival, station()))
+            last_time = min(now, departure_time + datetime.timedelta(minutes=rng.randint(0, 48 * 60)))
+            rows.append({
+                "train_id": first_train_id + i,
+                "name": f"KZ-{first_train_id + i:05d}",
+                "departure_station": departure,
+                "arrival_station": arrival,
+                "departure_time": departure_time,
+                "arrival_time": arrival_time,
+                "last_operation_station": last_station,
+                "last_operation_time": last_time,
+                "distance_to_arrival": rng.randint(0, 2500),
+                "operation_desc": f"{rng.choice(SEED_OPERATIONS)} ({last_station})",
+            })
+            train_info.append((last_station, arrival, last_time))
+        with engine.begin() as conn:
+            conn.execute(train_stmt, rows)
+
+    # Грузы: ~3% без поезда, остальные на случайном поезде и на его текущей станции
+    cargo_stmt = insert(Cargo.__table__)
+    for batch_start in range(0, cargos, batch_size):
+        rows = []
+        for _ in range(batch_start, min(batch_start + batch_size, cargos)):
+            if train_info and rng.random() > 0.03:
+                index = rng.randrange(len(train_info))
+                train_id = first_train_id + index
+                current, next_station, stop_time = train_info[index]
+            else:
+                train_id = None
+                current, next_station = station(), station()
+                stop_time = now - datetime.timedelta(minutes=rng.randint(0, 7 * 24 * 60))
+            status = rng.choices(status_names, cum_weights=status_weights)[0]
+            rows.append({
+                "cargo_type": rng.choice(SEED_CARGO_TYPES),
+                "train_id": train_id,
+                "current_station": current,
+                "status": status,
+                "last_stop_time": stop_time,
+                "next_station": next_station,
+                "distance_to_arrival": rng.randint(0, 2500),
+                "last_operation": f"{rng.choice(SEED_OPERATIONS)} ({current})",
+            })
+        with engine.begin() as conn:
+            conn.execute(cargo_stmt, rows)
+
+    with engine.begin() as conn:
+        search.install(conn)
+        routing.install(conn)
+        routing.refresh(conn)
+        history.install(conn)
+        if not summary.install(conn):
+            summary.rebuild(conn) # сводка уже была: добавить новые строки
+
+    elapsed = time.perf_counter() - started
+    total = trains + cargos
+    print(f"[db_setup] Добавлено {total} строк за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.0f} строк/с).")
+
+
 if __name__ == "__main__":
-    # Можно указать, хотим ли мы дропнуть все таблицы или нет
-    init_db(drop_all=True)
+    parser = argparse.ArgumentParser(description="Инициализация и миграция базы данных.")
+    parser.add_argument(
+        "command", nargs="?", default="init", choices=["init", "migrate", "explain", "backfill-datetimes", "seed", "rebuild-search",
+                                            "compact-history", "rebuild-summary", "rebuild-routes"],
+        help="init - пересоздать БД (по умолчанию), migrate - добавить недостающее без потери данных, "
+             "explain - проверить планы горячих запросов, backfill-datetimes - перевести строковое время в DateTime, "
+             "seed - добавить синтетические поезда и грузы, rebuild-search - перестроить полнотекстовый индекс, "
+             "compact-history - сжать и почистить историю перемещений, "
+             "rebuild-summary - пересчитать сводку админ-панели, "
+             "rebuild-routes - пересчитать расстояния по сети станций",
+    )
+    parser.add_argument("--batch-size", type=int, default=5000, help="Размер пакета для backfill-datetimes, seed и compact-history")
+    parser.add_argument("--trains", type=int, default=10000, help="seed: число поездов")
+    parser.add_argument("--cargos", type=int, default=1000000, help="seed: число грузов")
+    parser.add_argument("--seed", type=int, default=42, help="seed: зерно генератора (для воспроизводимости)")
+    parser.add_argument("--raw-days", type=int, default=Config.HISTORY_RAW_DAYS,
+                        help="compact-history: сколько дней история хранится без сжатия")
+    parser.add_argument("--retention-days", type=int, default=Config.HISTORY_RETENTION_DAYS,
+                        help="compact-history: срок хранения истории в днях (0 - бессрочно)")
+    args = parser.parse_args()
+
+    if args.command == "rebuild-search":
+        print("[db_setup] Перестраиваем полнотекстовый индекс...")
+        with engine.begin() as conn:
+            search.install(conn)
+            search.rebuild(conn)
+        print("[db_setup] Готово.")
+    elif args.command == "rebuild-summary":
+        print("[db_setup] Пересчитываем сводку админ-панели...")
+        with engine.begin() as conn:
+            summary.install(conn)
+            drift = summary.rebuild(conn)
+        print(f"[db_setup] Готово, исправлено строк сводки: {drift}.")
+    elif args.command == "rebuild-routes":
+        print("[db_setup] Пересчитываем расстояния по сети станций...")
+        with engine.begin() as conn:
+            routing.install(conn)
+            pairs, _ = routing.rebuild(conn)
+            rows = routing.refresh(conn)
+        print(f"[db_setup] Готово: исправлено расстояний {pairs}, обновлено поездов и грузов {rows}.")
+    elif args.command == "compact-history":
+        print(f"[db_setup] Сжимаем историю старше {args.raw_days} дн., срок хранения {args.retention_days} дн...")
+        stats = history.compact(engine, raw_days=args.raw_days, retention_days=args.retention_days,
+                                batch_size=args.batch_size)
+        print(f"[db_setup] Схлопнуто событий: {stats['merged']}, удалено по сроку хранения: {stats['expired']}.")
+    elif args.command == "seed":
+        seed_synthetic(args.trains, args.cargos, seed=args.seed, batch_size=args.batch_size)
+    elif args.command == "migrate":
+        migrate()
+    elif args.command == "backfill-datetimes":
+        backfill_datetimes(batch_size=args.batch_size)
+    elif args.command == "explain":
+        sys.exit(0 if check_query_plans() else 1)
+    else:
+        # Можно указать, хотим ли мы дропнуть все таблицы или нет
+        init_db(drop_all=True)
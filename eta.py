@@ -0,0 +1,255 @@
+"""
+eta.py
+
+Пакетный расчёт расчётного времени прибытия (ETA) для всех грузов в пути.
+
+Расчёт идёт сразу по всему парку, без цикла по грузам:
+1. средняя скорость по участкам считается одним SQL-запросом по журналу
+   перемещений поездов (movement_events): подряд идущие события на одной
+   станции - одна стоянка (прибытие - первое событие, отправление и
+   расстояние - последнее); соседние стоянки одного поезда, где расстояние
+   до прибытия уменьшилось, дают пройденные км и часы на участке
+   «станция -> станция». Пересчёт расстояния на той же станции (изменилась
+   сеть станций) перемещением не считается;
+2. нужные колонки грузов в пути (расстояние, время последней операции -
+   более позднее из груза и его поезда, станции) читаются одним запросом
+   прямо в массивы NumPy (np.fromiter по курсору, без ORM-объектов);
+3. скорость подбирается векторно: участок (текущая -> следующая станция),
+   если по нему достаточно истории, иначе средняя скорость отправления
+   с текущей станции, иначе средняя по парку, иначе ETA_DEFAULT_SPEED_KMH;
+4. ETA = время операции + расстояние / скорость с точностью до минуты.
+   Прошедшее ETA не подтягивается к «сейчас»: это опоздание (его видно
+   на /track), а значение не меняется от запуска к запуску и не переписывается;
+5. записываются только изменившиеся значения (executemany пачками по
+   ETA_BATCH_SIZE, время переводит в формат DateTime сам SQLite); у грузов,
+   вышедших из статусов «в пути», ETA очищается по индексу cargos.eta.
+
+Колонку cargos.eta читает /track (через кэш отслеживания) и API. Расчёт
+запускается по расписанию (cron): flask --app app compute-eta, - или
+администратором через POST /api/v1/eta/recompute.
+"""
+
+import datetime
+import time
+
+import numpy as np
+from sqlalchemy import text
+
+import history
+import metrics
+from config import Config
+from models import engine, MovementEvent
+
+RUN_SECONDS = metrics.registry.register(metrics.Histogram(
+    "eta_run_seconds", "Длительность пакетного расчёта ETA", buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300)))
+
+_CARGO_DTYPE = np.dtype([
+    ("cargo_id", np.int64),
+    ("distance", np.float64),   # -1 - расстояние неизвестно
+    ("base", np.int64),         # время последней операции, секунды эпохи; -1 - нет
+    ("station", np.int64),      # ID текущей станции; -1 - нет в справочнике
+    ("next_station", np.int64),
+    ("old_eta", np.int64),      # текущее значение eta; -1 - NULL
+])
+
+# Ключ участка в одном int64: станция отправления << 32 | станция назначения
+_SEGMENT_SHIFT = np.int64(32)
+
+
+class EtaResult:
+    def __init__(self):
+        self.cargos = 0       # грузов в пути
+        self.with_eta = 0     # из них с рассчитанным ETA
+        self.updated = 0      # записано изменившихся ETA
+        self.cleared = 0      # очищено у грузов не в пути
+        self.segments = 0     # участков с собственной скоростью
+        self.elapsed = 0.0
+        self.timings = {}
+
+    def as_dict(self):
+        return {
+            "cargos": self.cargos,
+            "with_eta": self.with_eta,
+            "updated": self.updated,
+            "cleared": self.cleared,
+            "segments": self.segments,
+            "elapsed_sec": round(self.elapsed, 3),
+            "timings": {k: round(v, 3) for k, v in self.timings.items()},
+        }
+
+
+def _status_params(statuses):
+    names = [f"s{i}" for i in range(len(statuses))]
+    return ", ".join(f":{n}" for n in names), dict(zip(names, statuses))
+
+
+class SpeedModel:
+    """
+    Средние скорости (км/ч): по участкам (отсортированные ключи и скорости -
+    поиск через searchsorted), по станциям отправления (массив по ID станции,
+    NaN - нет данных) и по парку.
+    """
+
+    def __init__(self, segment_keys, segment_speeds, station_speeds, fleet_speed):
+        self.segment_keys = segment_keys
+        self.segment_speeds = segment_speeds
+        self.station_speeds = station_speeds
+        self.fleet_speed = fleet_speed
+
+    @classmethod
+    def load(cls, conn, since, min_samples, min_speed, max_speed, default_speed):
+        rows = conn.execute(text(
+            # Номер стоянки: растёт на каждом событии, где станция сменилась
+            "WITH events AS ("
+            " SELECT entity_id, station_id, distance_to_arrival AS distance, ts, seq,"
+            "  station_id IS NOT LAG(station_id) OVER (PARTITION BY entity_id ORDER BY ts, seq) AS arrival"
+            " FROM movement_events WHERE entity_type = :train AND ts >= :since),"
+            " visits AS ("
+            " SELECT entity_id, station_id, distance, ts, seq,"
+            "  SUM(arrival) OVER (PARTITION BY entity_id ORDER BY ts, seq) AS visit"
+            " FROM events),"
+            " stays AS ("
+            " SELECT DISTINCT entity_id, visit, station_id,"
+            "  FIRST_VALUE(ts) OVER v AS arrived, LAST_VALUE(ts) OVER v AS departed,"
+            "  LAST_VALUE(distance) OVER v AS distance"
+            " FROM visits WINDOW v AS (PARTITION BY entity_id, visit ORDER BY ts, seq"
+            "  ROWS BETWEEN UNBOUNDED PRECEDING AND UNBOUNDED FOLLOWING)),"
+            " moves AS ("
+            " SELECT station_id, distance, arrived,"
+            "  LAG(station_id) OVER w AS prev_station,"
+            "  LAG(distance) OVER w AS prev_distance,"
+            "  LAG(departed) OVER w AS prev_departed"
+            " FROM stays WINDOW w AS (PARTITION BY entity_id ORDER BY visit))"
+            " SELECT prev_station, station_id, SUM(prev_distance - distance), SUM(arrived - prev_departed), COUNT(*)"
+            " FROM moves WHERE prev_station IS NOT NULL AND station_id IS NOT NULL"
+            " AND prev_distance > distance AND arrived > prev_departed"
+            " GROUP BY prev_station, station_id"
+        ), {"train": MovementEvent.ENTITY_TRAIN, "since": since}).all()
+        if not rows:
+            return cls(np.empty(0, np.int64), np.empty(0), np.empty(0), default_speed)
+
+        data = np.array(rows, dtype=np.float64)
+        source, target, km, seconds, samples = data.T
+        source, target = source.astype(np.int64), target.astype(np.int64)
+        hours = seconds / 3600.0
+
+        # Скорость = суммарные км / суммарные часы (длинные перегоны весят больше коротких)
+        trusted = samples >= min_samples
+        keys = (source[trusted] << _SEGMENT_SHIFT) | target[trusted]
+        speeds = np.clip(km[trusted] / hours[trusted], min_speed, max_speed)
+        order = np.argsort(keys)
+
+        station_km = np.bincount(source, weights=km)
+        station_hours = np.bincount(source, weights=hours)
+        station_samples = np.bincount(source, weights=samples)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            station_speeds = np.clip(station_km / station_hours, min_speed, max_speed)
+        station_speeds[station_samples < min_samples] = np.nan
+
+        fleet = np.clip(km.sum() / hours.sum(), min_speed, max_speed) if samples.sum() >= min_samples else default_speed
+        return cls(keys[order], speeds[order], station_speeds, float(fleet))
+
+    def speeds_for(self, stations, next_stations):
+        """Скорость для каждого груза (векторно)."""
+        speed = np.full(len(stations), self.fleet_speed)
+
+        known = (stations >= 0) & (stations < len(self.station_speeds))
+        by_station = np.full(len(stations), np.nan)
+        by_station[known] = self.station_speeds[stations[known]]
+        speed = np.where(np.isnan(by_station), speed, by_station)
+
+        if len(self.segment_keys):
+            keys = (stations << _SEGMENT_SHIFT) | next_stations
+            index = np.minimum(np.searchsorted(self.segment_keys, keys), len(self.segment_keys) - 1)
+            found = (self.segment_keys[index] == keys) & (stations >= 0) & (next_stations >= 0)
+            speed = np.where(found, self.segment_speeds[index], speed)
+        return speed
+
+
+def _load_cargos(conn, statuses):
+    """Колонки грузов в пути -> структурированный массив NumPy (одним проходом по курсору)."""
+    placeholders, params = _status_params(statuses)
+    sql = (
+        "SELECT c.cargo_id, COALESCE(c.distance_to_arrival, -1),"
+        " COALESCE(CAST(strftime('%s', COALESCE(MAX(c.last_stop_time, t.last_operation_time),"
+        "  c.last_stop_time, t.last_operation_time)) AS INTEGER), -1),"
+        " COALESCE((SELECT station_id FROM stations WHERE name = c.current_station), -1),"
+        " COALESCE((SELECT station_id FROM stations WHERE name = c.next_station), -1),"
+        " COALESCE(CAST(strftime('%s', c.eta) AS INTEGER), -1)"
+        " FROM cargos c LEFT JOIN trains t ON t.train_id = c.train_id"
+        f" WHERE c.status IN ({placeholders})"
+    )
+    # Курсор драйвера напрямую: строки SQLAlchemy для миллиона записей заметно дороже кортежей
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(sql, params)
+        return np.fromiter(cursor, dtype=_CARGO_DTYPE)
+    finally:
+        cursor.close()
+
+
+def compute_etas(cargos, speed_model, now):
+    """
+    ETA (секунды эпохи, с точностью до минуты) для массива грузов; -1 - не рассчитать
+    (неизвестно расстояние). Время операции неизвестно - считаем от now.
+    """
+    speed = speed_model.speeds_for(cargos["station"], cargos["next_station"])
+    base = np.where(cargos["base"] >= 0, cargos["base"], now)
+    travel = np.rint(cargos["distance"] / speed * 3600.0).astype(np.int64)
+    eta = (base + travel + 59) // 60 * 60
+    return np.where(cargos["distance"] >= 0, eta, -1)
+
+
+def run(batch_size=None, statuses=None, now=None):
+    """
+    Пересчитывает ETA всех грузов в пути и записывает изменившиеся значения.
+    :return: EtaResult
+    """
+    batch_size = batch_size or Config.ETA_BATCH_SIZE
+    statuses = statuses or Config.ETA_STATUSES
+    now = history.to_epoch(now or datetime.datetime.now())
+    result = EtaResult()
+    started = time.perf_counter()
+
+    with engine.connect() as conn:
+        step = time.perf_counter()
+        model = SpeedModel.load(
+            conn, since=now - Config.ETA_HISTORY_DAYS * 86400, min_samples=Config.ETA_MIN_SAMPLES,
+            min_speed=Config.ETA_MIN_SPEED_KMH, max_speed=Config.ETA_MAX_SPEED_KMH,
+            default_speed=Config.ETA_DEFAULT_SPEED_KMH,
+        )
+        result.segments = len(model.segment_keys)
+        result.timings["speeds"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        cargos = _load_cargos(conn, statuses)
+        result.cargos = len(cargos)
+        result.timings["load"] = time.perf_counter() - step
+    step = time.perf_counter()
+    etas = compute_etas(cargos, model, now)
+    result.with_eta = int((etas >= 0).sum())
+    changed = np.flatnonzero(etas != cargos["old_eta"])
+    result.timings["compute"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    ids = cargos["cargo_id"][changed].tolist()
+    values = [None if v < 0 else v for v in etas[changed].tolist()]
+    for start in range(0, len(ids), batch_size):
+        # Короткие транзакции: запись не держит блокировку SQLite дольше одной пачки
+        with engine.begin() as conn:
+            conn.connection.dbapi_connection.cursor().executemany(
+                "UPDATE cargos SET eta = strftime('%Y-%m-%d %H:%M:%S.000000', ?, 'unixepoch') WHERE cargo_id = ?",
+                zip(values[start:start + batch_size], ids[start:start + batch_size]),
+            )
+    result.updated = len(ids)
+
+    placeholders, params = _status_params(statuses)
+    with engine.begin() as conn:
+        result.cleared = conn.execute(text(
+            f"UPDATE cargos SET eta = NULL WHERE eta IS NOT NULL AND (status IS NULL OR status NOT IN ({placeholders}))"
+        ), params).rowcount
+    result.timings["write"] = time.perf_counter() - step
+
+    result.elapsed = time.perf_counter() - started
+    RUN_SECONDS.observe(result.elapsed)
+    return result
@@ -0,0 +1,153 @@
+"""
+export.py
+
+Потоковая выгрузка поездов и грузов в CSV / JSONL / Parquet - пара к bulk_import.py.
+
+Строки читаются одним запросом в одной читающей транзакции (согласованный
+снимок) и забираются из курсора пачками по EXPORT_CHUNK_SIZE
+(stream_results + yield_per): каждая пачка сразу превращается в байты и
+отдаётся дальше - в chunked HTTP-ответ или в файл. В памяти одновременно
+не больше одной пачки, поэтому первые байты уходят сразу, а расход памяти
+воркера не зависит от числа строк. ORM-объекты не создаются.
+
+Фильтры те же, что у списков в админке (queries.py). Время пишется в формате
+"ГГГГ-ММ-ДД ЧЧ:ММ:СС" - выгруженный CSV/JSONL можно загрузить обратно
+через импорт (строки с id обновят существующие записи).
+
+Parquet - колоночный формат для аналитики, по одной группе строк на пачку;
+нужен пакет pyarrow (необязательная зависимость, без него - CSV и JSONL).
+"""
+
+import csv
+import datetime
+import io
+import json
+
+from sqlalchemy import select, Integer, SmallInteger, DateTime
+
+from models import read_engine, Train, Cargo
+from queries import CARGO_FILTERS, TRAIN_FILTERS, apply_cargo_filters, apply_train_filters
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError: # необязательная зависимость: без неё - только CSV и JSONL
+    pa = pq = None
+
+DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Формат -> (MIME-тип, расширение файла)
+FORMATS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "jsonl": ("application/x-ndjson; charset=utf-8", "jsonl"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+# Сущность -> (модель, допустимые фильтры, функция наложения фильтров)
+ENTITIES = {
+    "cargos": (Cargo, CARGO_FILTERS, apply_cargo_filters),
+    "trains": (Train, TRAIN_FILTERS, apply_train_filters),
+}
+
+
+def available_formats():
+    return [fmt for fmt in FORMATS if fmt != "parquet" or pq is not None]
+
+
+def columns(entity):
+    return list(ENTITIES[entity][0].__table__.columns)
+
+
+def iter_chunks(entity, filters, chunk_size):
+    """Пачки строк (кортежи значений колонок) в порядке первичного ключа."""
+    model, _, apply_filters = ENTITIES[entity]
+    table = model.__table__
+    query = apply_filters(select(*table.columns), filters).order_by(*table.primary_key.columns)
+    with read_engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(query)
+        for rows in result.partitions():
+            yield rows
+
+
+def _plain(value):
+    return value.strftime(DATETIME_FORMAT) if isinstance(value, datetime.datetime) else value
+
+
+def _csv(names, chunks):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(names)
+    for rows in chunks:
+        writer.writerows([_plain(value) for value in row] for row in rows)
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell(): # пустая выгрузка - только заголовок
+        yield buffer.getvalue().encode("utf-8")
+
+
+def _jsonl(names, chunks):
+    for rows in chunks:
+        yield "".join(
+            json.dumps(dict(zip(names, map(_plain, row))), ensure_ascii=False) + "\n" for row in rows
+        ).encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Файл только на запись: накопленные байты забираются через take()."""
+
+    def __init__(self):
+        self._parts = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def take(self):
+        data = b"".join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow_type(column):
+    if isinstance(column.type, (Integer, SmallInteger)):
+        return pa.int64()
+    if isinstance(column.type, DateTime):
+        return pa.timestamp("us")
+    return pa.string()
+
+
+def _parquet(table_columns, chunks):
+    if pq is None:
+        raise RuntimeError("Для выгрузки в Parquet нужен пакет pyarrow.")
+    schema = pa.schema([(column.name, _arrow_type(column)) for column in table_columns])
+    sink = _ChunkSink()
+    with pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema) as writer:
+        for rows in chunks:
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+                schema=schema,
+            ))
+            yield sink.take()
+    # Метаданные (footer) пишутся при закрытии
+    yield sink.take()
+
+
+def generate(entity, fmt, filters, chunk_size=5000):
+    """Байтовые куски выгрузки - для Response(...) или записи в файл."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Неподдерживаемый формат: {fmt}")
+    table_columns = columns(entity)
+    chunks = iter_chunks(entity, filters, chunk_size)
+    if fmt == "parquet":
+        return _parquet(table_columns, chunks)
+    names = [column.name for column in table_columns]
+    return _csv(names, chunks) if fmt == "csv" else _jsonl(names, chunks)
+
+
+def filename(entity, fmt, now=None):
+    now = now or datetime.datetime.now()
+    return f"{entity}-{now:%Y%m%d-%H%M%S}.{FORMATS[fmt][1]}"
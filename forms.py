@@ -5,10 +5,14 @@ forms.py
 """
 
 from flask_wtf import FlaskForm
+from flask_wtf.file import FileField, FileRequired
 from wtforms import (
-    StringField, PasswordField, SubmitField, TextAreaField, IntegerField, HiddenField
+    StringField, PasswordField, SubmitField, TextAreaField, IntegerField, SelectField,
+    DateTimeField
 )
-from wtforms.validators import DataRequired, Email, Length, Optional
+from wtforms.validators import DataRequired, Email, Length, NumberRange, Optional
+
+from models import DATETIME_INPUT_FORMATS
 
 # ----------------------
 # ФОРМЫ
@@ -20,25 +24,23 @@ class LoginForm(FlaskForm):
     submit = SubmitField("Войти")
 
 class TrainForm(FlaskForm):
-    train_id = HiddenField()  # скрытое поле, если редактируем
     name = StringField("Название (№ поезда)", validators=[DataRequired(), Length(max=100)])
     departure_station = StringField("Начальная станция", validators=[Optional()])
     arrival_station = StringField("Конечная станция", validators=[Optional()])
-    departure_time = StringField("Время отправления", validators=[Optional()]) 
-    arrival_time = StringField("Время прибытия", validators=[Optional()])
+    departure_time = DateTimeField("Время отправления", format=DATETIME_INPUT_FORMATS, validators=[Optional()])
+    arrival_time = DateTimeField("Время прибытия", format=DATETIME_INPUT_FORMATS, validators=[Optional()])
     last_operation_station = StringField("Станция последней операции", validators=[Optional()])
-    last_operation_time = StringField("Время последней операции", validators=[Optional()])
+    last_operation_time = DateTimeField("Время последней операции", format=DATETIME_INPUT_FORMATS, validators=[Optional()])
     distance_to_arrival = IntegerField("Расстояние до конечной станции (км)", validators=[Optional()])
     operation_desc = StringField("Описание операции (прибытие/отправление и т.д.)", validators=[Optional()])
     submit = SubmitField("Сохранить")
 
 class CargoForm(FlaskForm):
-    cargo_id = HiddenField()
     cargo_type = StringField("Тип груза", validators=[DataRequired(), Length(max=100)])
     train_id = IntegerField("ID поезда", validators=[Optional()])
     current_station = StringField("Текущая станция", validators=[Optional()])
     status = StringField("Статус", validators=[Optional()])
-    last_stop_time = StringField("Время последней остановки", validators=[Optional()])
+    last_stop_time = DateTimeField("Время последней остановки", format=DATETIME_INPUT_FORMATS, validators=[Optional()])
     next_station = StringField("Следующая станция", validators=[Optional()])
     distance_to_arrival = IntegerField("Расстояние до конечной (км)", validators=[Optional()])
     last_operation = StringField("Последняя операция", validators=[Optional()])
@@ -49,3 +51,35 @@ class ContactForm(FlaskForm):
     email = StringField("E-mail", validators=[DataRequired(), Email(message="Неверный формат email")])
     message = TextAreaField("Сообщение", validators=[DataRequired(message="Введите текст сообщения")])
     submit = SubmitField("Отправить")
+
+class SegmentForm(FlaskForm):
+    station_a = StringField("Станция", validators=[DataRequired(), Length(max=100)])
+    station_b = StringField("Соседняя станция", validators=[DataRequired(), Length(max=100)])
+    length_km = IntegerField("Длина участка (км)", validators=[DataRequired(), NumberRange(min=1)])
+    submit = SubmitField("Сохранить участок")
+
+class BulkCargoForm(FlaskForm):
+    # ID выбранных грузов приходят отдельными полями ids (чекбоксы в таблице)
+    action = SelectField("Действие", choices=[
+        ("set_status", "Сменить статус"), ("reassign_train", "Перепривязать к поезду (ID)"),
+        ("move_station", "Переместить на станцию"), ("delete", "Удалить"),
+    ])
+    value = StringField("Значение", validators=[Optional(), Length(max=100)])
+    submit = SubmitField("Применить к выбранным")
+
+class BulkTrainForm(FlaskForm):
+    action = SelectField("Действие", choices=[
+        ("move_station", "Станция последней операции"), ("delete", "Удалить вместе с грузами"),
+    ])
+    value = StringField("Значение", validators=[Optional(), Length(max=100)])
+    submit = SubmitField("Применить к выбранным")
+
+class ImportForm(FlaskForm):
+    entity = SelectField("Что импортируем", choices=[("cargos", "Грузы"), ("trains", "Поезда")])
+    file_format = SelectField(
+        "Формат",
+        choices=[("", "Определить по расширению"), ("csv", "CSV"), ("jsonl", "JSONL")],
+        validators=[Optional()]
+    )
+    file = FileField("Файл (CSV с заголовком или JSONL)", validators=[FileRequired(message="Выберите файл")])
+    submit = SubmitField("Импортировать")
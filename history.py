@@ -0,0 +1,278 @@
+"""
+history.py
+
+Журнал перемещений поездов и грузов (таблица movement_events, см. models.py).
+
+Записи добавляют триггеры SQLite AFTER INSERT / AFTER UPDATE: событие пишется,
+только если изменилось отслеживаемое состояние (станция, время, расстояние,
+статус, операция), и при любом способе записи - ORM, импорт, телеметрия.
+Расстояние в событии - по сети станций (routing.py), если маршрут известен:
+триггер сети пишет его в строку отдельным UPDATE уже после смены станции, и
+без этого перемещение попало бы в журнал дважды - сначала со старым
+расстоянием. Повтор последнего события с тем же временем не записывается.
+Название станции заменяется ID из справочника stations (пополняется тем же
+триггером), время хранится в секундах эпохи.
+
+Сжатие старой истории (compact): среди событий старше raw_days в каждой серии
+подряд идущих событий с той же станцией и статусом остаются первое (прибытие)
+и последнее (отправление), промежуточные удаляются, а их число прибавляется
+к счётчику merged первого события. События старше retention_days удаляются.
+"""
+
+import calendar
+import datetime
+
+from sqlalchemy import text, select, delete, update, tuple_, bindparam
+
+from models import ReadSessionLocal, MovementEvent, Station, Train, Cargo
+from routing import route_distance_sql
+
+
+def to_epoch(value):
+    """«Наивное» время приложения -> секунды эпохи (как strftime('%s') в SQLite)."""
+    return calendar.timegm(value.timetuple())
+
+
+def from_epoch(ts):
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).replace(tzinfo=None)
+
+
+class HistorySource:
+    """Какие колонки таблицы попадают в журнал."""
+
+    def __init__(self, model, entity_type, pk, station, target, time, distance, status, detail):
+        self.model = model
+        self.table = model.__tablename__
+        self.entity_type = entity_type
+        self.pk = pk
+        self.station = station
+        self.target = target # станция назначения - для расстояния по сети
+        self.time = time
+        self.distance = distance
+        self.status = status
+        self.detail = detail
+
+    @property
+    def watched(self):
+        return [c for c in (self.station, self.time, self.distance, self.status, self.detail) if c]
+
+    def _values(self, row):
+        """SQL-выражения (ts, station_id, расстояние, статус, операция) события из row.*"""
+        ts = (f"COALESCE(CAST(strftime('%s', {row}.{self.time}) AS INTEGER), "
+              f"CAST(strftime('%s', 'now', 'localtime') AS INTEGER))")
+        station_id = f"(SELECT s.station_id FROM stations s WHERE s.name = {row}.{self.station})"
+        distance = f"COALESCE({route_distance_sql(row, self.station, self.target)}, {row}.{self.distance})"
+        status = f"{row}.{self.status}" if self.status else "NULL"
+        return ts, station_id, distance, status, f"{row}.{self.detail}"
+
+    def event_select(self, row):
+        """
+        SELECT значений события из row.* (row - new в триггере или алиас таблицы).
+        Время без значения - текущее; seq - следующий номер в пределах той же секунды.
+        """
+        ts, station_id, distance, status, detail = self._values(row)
+        return (
+            f"SELECT {self.entity_type}, {row}.{self.pk}, {ts}, "
+            f"COALESCE((SELECT MAX(m.seq) + 1 FROM movement_events m WHERE m.entity_type = {self.entity_type} "
+            f"AND m.entity_id = {row}.{self.pk} AND m.ts = {ts}), 0), "
+            f"{station_id}, {distance}, {status}, {detail}"
+        )
+
+    def not_repeated(self, row):
+        """
+        SQL-условие: последнее событие объекта с тем же временем не совпадает с новым.
+        Так UPDATE расстояния от триггера сети станций (в любом порядке срабатывания
+        триггеров) не дублирует только что записанное перемещение.
+        """
+        ts, station_id, distance, status, detail = self._values(row)
+        return (
+            f"NOT EXISTS (SELECT 1 FROM movement_events m WHERE m.entity_type = {self.entity_type} "
+            f"AND m.entity_id = {row}.{self.pk} AND m.ts = {ts} "
+            f"AND m.seq = (SELECT MAX(l.seq) FROM movement_events l WHERE l.entity_type = {self.entity_type} "
+            f"AND l.entity_id = {row}.{self.pk} AND l.ts = {ts}) "
+            f"AND m.station_id IS {station_id} AND m.distance_to_arrival IS {distance} "
+            f"AND m.status IS {status} AND m.detail IS {detail})"
+        )
+
+    def trigger_names(self):
+        return [f"movement_{self.table}_ai", f"movement_{self.table}_au"]
+
+    def triggers(self):
+        body = (
+            f"BEGIN "
+            f"INSERT OR IGNORE INTO stations (name) SELECT new.{self.station} WHERE new.{self.station} IS NOT NULL; "
+            f"{_EVENT_INSERT} {self.event_select('new')} WHERE {self.not_repeated('new')}; "
+            f"END"
+        )
+        changed = " OR ".join(f"old.{c} IS NOT new.{c}" for c in self.watched)
+        ai, au = self.trigger_names()
+        return [
+            f"CREATE TRIGGER {ai} AFTER INSERT ON {self.table} {body}",
+            f"CREATE TRIGGER {au} AFTER UPDATE OF {', '.join(self.watched)} ON {self.table} "
+            f"WHEN {changed} {body}",
+        ]
+
+
+_EVENT_INSERT = ("INSERT INTO movement_events (entity_type, entity_id, ts, seq, station_id, "
+                 "distance_to_arrival, status, detail)")
+
+SOURCES = {
+    "train": HistorySource(
+        Train, MovementEvent.ENTITY_TRAIN, "train_id", station="last_operation_station", target="arrival_station",
+        time="last_operation_time", distance="distance_to_arrival", status=None, detail="operation_desc",
+    ),
+    "cargo": HistorySource(
+        Cargo, MovementEvent.ENTITY_CARGO, "cargo_id", station="current_station", target="next_station",
+        time="last_stop_time", distance="distance_to_arrival", status="status", detail="last_operation",
+    ),
+}
+
+
+def drop_triggers(conn):
+    for source in SOURCES.values():
+        for name in source.trigger_names():
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+
+def install(conn):
+    """
+    (Пере)создаёт триггеры журнала. Объектам, у которых в журнале ещё нет
+    ни одного события (новая таблица, массовая загрузка без триггеров),
+    текущее состояние записывается начальным событием.
+    :return: число записанных начальных событий
+    """
+    drop_triggers(conn)
+    created = 0
+    for source in SOURCES.values():
+        conn.execute(text(
+            f"INSERT OR IGNORE INTO stations (name) SELECT DISTINCT {source.station} "
+            f"FROM {source.table} WHERE {source.station} IS NOT NULL"
+        ))
+        created += conn.execute(text(
+            f"{_EVENT_INSERT} {source.event_select('t')} FROM {source.table} AS t "
+            f"WHERE NOT EXISTS (SELECT 1 FROM movement_events m "
+            f"WHERE m.entity_type = {source.entity_type} AND m.entity_id = t.{source.pk})"
+        )).rowcount
+        for statement in source.triggers():
+            conn.execute(text(statement))
+    return created
+
+
+def timeline(kind, entity_id, before=None, limit=20):
+    """
+    Хронология объекта от новых событий к старым, страница из limit записей.
+    before - курсор "ts:seq" (next_cursor предыдущей страницы).
+    :return: (список dict, next_cursor или None)
+    """
+    source = SOURCES[kind]
+    events = MovementEvent.__table__
+    query = (
+        select(events.c.ts, events.c.seq, Station.name.label("station"), events.c.distance_to_arrival,
+               events.c.status, events.c.detail, events.c.merged)
+        .select_from(events.outerjoin(Station.__table__, Station.station_id == events.c.station_id))
+        .where(events.c.entity_type == source.entity_type, events.c.entity_id == entity_id)
+        .order_by(events.c.ts.desc(), events.c.seq.desc())
+        .limit(limit + 1)
+    )
+    if before:
+        try:
+            ts, seq = (int(part) for part in before.split(":"))
+        except ValueError:
+            ts, seq = None, None
+        if ts is not None:
+            query = query.where(tuple_(events.c.ts, events.c.seq) < tuple_(ts, seq))
+
+    with ReadSessionLocal() as db:
+        rows = db.execute(query).all()
+    items = [{
+        "time": from_epoch(row.ts),
+        "station": row.station,
+        "distance_to_arrival": row.distance_to_arrival,
+        "status": row.status,
+        "detail": row.detail,
+        "merged": row.merged,
+    } for row in rows[:limit]]
+    next_cursor = f"{rows[limit - 1].ts}:{rows[limit - 1].seq}" if len(rows) > limit else None
+    return items, next_cursor
+
+
+def compact(engine, raw_days=90, retention_days=1825, batch_size=1000, now=None):
+    """
+    Сжимает и чистит старую историю. Объекты обрабатываются пакетами по
+    batch_size (одна короткая транзакция на пакет), поэтому задача не держит
+    блокировку записи надолго и её можно запускать по расписанию на живой базе.
+    :return: dict с числом схлопнутых и удалённых событий
+    """
+    now = now or datetime.datetime.now()
+    raw_cutoff = to_epoch(now - datetime.timedelta(days=raw_days))
+    retention_cutoff = to_epoch(now - datetime.timedelta(days=retention_days)) if retention_days else None
+    events = MovementEvent.__table__
+    stats = {"merged": 0, "expired": 0}
+
+    delete_event = delete(events).where(
+        events.c.entity_type == bindparam("_type"), events.c.entity_id == bindparam("_id"),
+        events.c.ts == bindparam("_ts"), events.c.seq == bindparam("_seq"),
+    )
+    add_merged = update(events).where(
+        events.c.entity_type == bindparam("_type"), events.c.entity_id == bindparam("_id"),
+        events.c.ts == bindparam("_ts"), events.c.seq == bindparam("_seq"),
+    ).values(merged=events.c.merged + bindparam("_count"))
+
+    for source in SOURCES.values():
+        last_id = None
+        while True:
+            with engine.begin() as conn:
+                # Следующий пакет объектов, у которых есть события старше raw_cutoff
+                id_query = (select(events.c.entity_id).distinct()
+                            .where(events.c.entity_type == source.entity_type, events.c.ts < raw_cutoff)
+                            .order_by(events.c.entity_id).limit(batch_size))
+                if last_id is not None:
+                    id_query = id_query.where(events.c.entity_id > last_id)
+                entity_ids = conn.execute(id_query).scalars().all()
+                if not entity_ids:
+                    break
+                last_id = entity_ids[-1]
+                in_batch = (events.c.entity_type == source.entity_type,
+                            events.c.entity_id.between(entity_ids[0], entity_ids[-1]))
+
+                if retention_cutoff is not None:
+                    stats["expired"] += conn.execute(
+                        delete(events).where(*in_batch, events.c.ts < retention_cutoff)).rowcount
+
+                rows = conn.execute(
+                    select(events.c.entity_id, events.c.ts, events.c.seq, events.c.station_id, events.c.status)
+                    .where(*in_batch, events.c.ts < raw_cutoff)
+                    .order_by(events.c.entity_id, events.c.ts, events.c.seq)
+                ).all()
+                deletions, merges = _plan_compaction(source.entity_type, rows)
+                if deletions:
+                    conn.execute(delete_event, deletions)
+                    conn.execute(add_merged, merges)
+                    stats["merged"] += len(deletions)
+    return stats
+
+
+def _plan_compaction(entity_type, rows):
+    """
+    По отсортированным событиям решает, что удалить: в каждой серии с одинаковыми
+    (объект, станция, статус) остаются первое и последнее событие.
+    :return: (параметры DELETE, параметры UPDATE merged для первых событий серий)
+    """
+    deletions, merges = [], []
+
+    def flush(run):
+        if len(run) > 2:
+            middle = run[1:-1]
+            deletions.extend({"_type": entity_type, "_id": r.entity_id, "_ts": r.ts, "_seq": r.seq} for r in middle)
+            first = run[0]
+            merges.append({"_type": entity_type, "_id": first.entity_id, "_ts": first.ts, "_seq": first.seq,
+                           "_count": len(middle)})
+
+    run = []
+    for row in rows:
+        if run and (row.entity_id, row.station_id, row.status) != (run[0].entity_id, run[0].station_id, run[0].status):
+            flush(run)
+            run = []
+        run.append(row)
+    flush(run)
+    return deletions, merges
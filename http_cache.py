@@ -0,0 +1,260 @@
+"""
+http_cache.py
+
+HTTP-кэширование и сжатие ответов.
+
+- Статика: url_for('static', ...) добавляет к адресу ?v=<хэш содержимого>.
+  Запрос с актуальным хэшем отдаётся с Cache-Control: immutable на год -
+  браузер не перезапрашивает файл, пока он не изменится (а тогда изменится и URL).
+  Без хэша (или со старым) - обычная перепроверка по ETag / Last-Modified.
+  Если рядом с файлом лежат заранее сжатые style.css.br / style.css.gz
+  (flask --app app compress-static), они отдаются клиентам, которые их принимают.
+- Страницы: page_etag() строит ETag из данных страницы, версии шаблонов и
+  статики и состояния сессии; при совпадении с If-None-Match view отвечает 304,
+  не выполняя рендер.
+- Сжатие «на лету»: HTML, JSON и прочие текстовые ответы от COMPRESS_MIN_SIZE байт
+  сжимаются brotli (если установлен пакет brotli и клиент его принимает) или gzip.
+  Потоковые ответы (SSE, выгрузки) не трогаются.
+"""
+
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import Response, request, session, send_from_directory
+from werkzeug.http import parse_etags, quote_etag
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError: # необязательная зависимость: без неё - только gzip
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "text/html", "text/css", "text/plain", "text/csv", "text/javascript",
+    "application/javascript", "application/json", "application/xml", "image/svg+xml",
+}
+# Какие статические файлы имеет смысл сжимать заранее (картинки в jpg/png уже сжаты)
+PRECOMPRESS_EXTENSIONS = {".css", ".js", ".svg", ".json", ".txt", ".html", ".map"}
+# Расширение варианта -> Content-Encoding, в порядке предпочтения
+ENCODINGS = ((".br", "br"), (".gz", "gzip"))
+
+
+class Fingerprints:
+    """Хэши содержимого файлов каталога; пересчитываются при изменении mtime/размера."""
+
+    def __init__(self, folder):
+        self.folder = folder
+        self._cache = {}  # относительный путь -> (mtime, size, хэш)
+
+    def version(self, filename):
+        path = safe_join(self.folder, filename)
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        if stat is None:
+            return None
+        cached = self._cache.get(filename)
+        if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+            return cached[2]
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        version = digest.hexdigest()[:12]
+        self._cache[filename] = (stat.st_mtime_ns, stat.st_size, version)
+        return version
+
+
+def _tree_version(*folders):
+    """Общий хэш содержимого каталогов (шаблоны + статика): меняется при каждом выкладывании."""
+    digest = hashlib.sha256()
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                digest.update(os.path.relpath(path, folder).encode())
+                with open(path, "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+
+def etag_matches(if_none_match, etag):
+    """Есть ли etag в заголовке If-None-Match (слабое сравнение, «*» - любой)."""
+    return etag is not None and parse_etags(if_none_match).contains_weak(etag)
+
+
+def _client_has(etag):
+    return request.method in ("GET", "HEAD") and etag_matches(request.headers.get("If-None-Match"), etag)
+
+
+class HttpCache:
+    def __init__(self):
+        self.app = None
+        self.fingerprints = None
+        self._site_version = None
+
+    def init_app(self, app):
+        self.app = app
+        self.fingerprints = Fingerprints(app.static_folder)
+        app.url_defaults(self._static_url_defaults)
+        app.view_functions["static"] = self._serve_static
+        app.after_request(self._compress)
+
+    @property
+    def site_version(self):
+        # Считается один раз на процесс: шаблоны и статика меняются при выкладывании
+        # (после правки на живом сервере - reset_site_version)
+        if self._site_version is None:
+            self._site_version = _tree_version(
+                os.path.join(self.app.root_path, self.app.template_folder), self.app.static_folder)
+        return self._site_version
+
+    def reset_site_version(self):
+        self._site_version = None
+
+    # --- Статика ---
+
+    def _static_url_defaults(self, endpoint, values):
+        if endpoint == "static" and "v" not in values and "filename" in values:
+            version = self.fingerprints.version(values["filename"])
+            if version:
+                values["v"] = version
+
+    def _serve_static(self, filename):
+        folder = self.app.static_folder
+        mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+        response = None
+        original = safe_join(folder, filename)
+        if original and os.path.splitext(filename)[1] in PRECOMPRESS_EXTENSIONS:
+            for suffix, encoding in ENCODINGS:
+                variant = original + suffix
+                # Устаревший вариант (файл поменяли, а compress-static не запустили) не отдаём
+                if (request.accept_encodings[encoding] and os.path.isfile(variant) and os.path.isfile(original)
+                        and os.path.getmtime(variant) >= os.path.getmtime(original)):
+                    response = send_from_directory(folder, filename + suffix, mimetype=mimetype)
+                    response.headers["Content-Encoding"] = encoding
+                    break
+        if response is None:
+            response = send_from_directory(folder, filename, mimetype=mimetype)
+        response.vary.add("Accept-Encoding")
+
+        version = request.args.get("v")
+        if version and version == self.fingerprints.version(filename):
+            response.cache_control.public = True
+            response.cache_control.max_age = self.app.config["STATIC_MAX_AGE"]
+            response.cache_control.immutable = True
+            response.cache_control.no_cache = None
+        return response
+
+    # --- Страницы ---
+
+    def page_etag(self, *parts):
+        """
+        ETag страницы из её данных (parts), версии шаблонов/статики и пользователя сессии.
+        None - страницу кэшировать нельзя (ждут показа flash-сообщения).
+        """
+        if session.get("_flashes"):
+            return None
+        return self.etag_for(session.get("user_id"), parts)
+
+    def etag_for(self, user_id, parts):
+        """То же без контекста запроса Flask (ASGI-часть передаёт user_id из своей сессии)."""
+        return hashlib.sha1(repr((self.site_version, user_id, parts)).encode()).hexdigest()
+
+    @staticmethod
+    def conditional_headers(etag):
+        """
+        Заголовки ответа с ETag - одни и те же у Flask и у ASGI-части (asgi.py).
+        Слабый ETag: тело в gzip и brotli отличается побайтно, но это одна и та же страница.
+        Страница зависит от входа в админку - общие кэши её не хранят, браузер перепроверяет.
+        """
+        return {"ETag": quote_etag(etag, weak=True), "Cache-Control": "private, no-cache", "Vary": "Cookie"}
+
+    def not_modified_response(self, etag):
+        """Пустой ответ 304, если у клиента уже есть эта версия страницы, иначе None."""
+        if _client_has(etag):
+            return self.make_conditional(Response(), etag)
+        return None
+
+    def make_conditional(self, response, etag):
+        """Проставляет ETag; 304 вместо тела, если клиент прислал тот же ETag."""
+        if etag is None:
+            return response
+        headers = self.conditional_headers(etag)
+        response.headers["ETag"] = headers["ETag"]
+        response.headers["Cache-Control"] = headers["Cache-Control"]
+        response.vary.add(headers["Vary"])
+        if _client_has(etag):
+            response.status_code = 304
+            response.set_data(b"")
+        return response
+
+    # --- Сжатие ---
+
+    def negotiate_encoding(self, size):
+        """Кодировка для тела размером size байт под Accept-Encoding клиента (None - без сжатия)."""
+        if size < self.app.config["COMPRESS_MIN_SIZE"]:
+            return None
+        if brotli is not None and request.accept_encodings["br"]:
+            return "br"
+        if request.accept_encodings["gzip"]:
+            return "gzip"
+        return None
+
+    def encode(self, data, encoding):
+        if encoding == "br":
+            return brotli.compress(data, quality=self.app.config["COMPRESS_BROTLI_QUALITY"])
+        if encoding == "gzip":
+            return gzip.compress(data, compresslevel=self.app.config["COMPRESS_GZIP_LEVEL"])
+        return data
+
+    def _compress(self, response):
+        if (response.direct_passthrough or response.is_streamed
+                or response.status_code < 200 or response.status_code in (204, 304)
+                or "Content-Encoding" in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+        response.vary.add("Accept-Encoding")
+        data = response.get_data()
+        encoding = self.negotiate_encoding(len(data))
+        if encoding:
+            response.set_data(self.encode(data, encoding))
+            response.headers["Content-Encoding"] = encoding
+        return response
+
+
+http_cache = HttpCache()
+
+
+def precompress_static(folder, min_size=256):
+    """
+    Создаёт рядом со статическими файлами .gz (и .br при наличии brotli) с максимальным
+    сжатием. Вариант сохраняется, только если он меньше оригинала.
+    :return: список (путь, исходный размер, {кодировка: размер})
+    """
+    report = []
+    for root, _, files in os.walk(folder):
+        for name in sorted(files):
+            if os.path.splitext(name)[1] not in PRECOMPRESS_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                data = f.read()
+            if len(data) < min_size:
+                continue
+            variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0)}
+            if brotli is not None:
+                variants[".br"] = brotli.compress(data, quality=11)
+            sizes = {}
+            for suffix, compressed in variants.items():
+                if len(compressed) >= len(data):
+                    continue
+                with open(path + suffix, "wb") as f:
+                    f.write(compressed)
+                sizes[suffix] = len(compressed)
+            report.append((os.path.relpath(path, folder), len(data), sizes))
+    return report
@@ -0,0 +1,320 @@
+"""
+live.py
+
+Живые обновления отслеживания через Server-Sent Events.
+
+Публикация идёт внутри процесса: после commit изменения груза/поезда
+вызывается notify_cargos / notify_trains. Свежее состояние загружается из БД
+один раз (и только для тех ID, на которые кто-то подписан), после чего
+рассылается по очередям всех подписанных потоков. Каждый поток сам считает
+разницу с тем, что уже отправил клиенту, и шлёт только изменившиеся поля.
+
+Ограничения:
+- брокер живёт в памяти процесса: при нескольких воркерах gunicorn клиент
+  получает изменения, сделанные в его воркере (для остальных - после
+  переподключения, когда придёт свежий снимок);
+- каждый открытый поток занимает поток/гринлет сервера, поэтому нужен
+  воркер с поддержкой долгих соединений (gthread/gevent), а число
+  одновременных потоков ограничено SSE_MAX_CONNECTIONS.
+"""
+
+import asyncio
+import json
+import queue
+import threading
+import time
+
+import tracking
+from config import Config
+
+
+class TooManyConnections(Exception):
+    """Достигнут лимит одновременных SSE-потоков."""
+
+
+class Subscription:
+    """Подписка одного потока: набор ключей (тип, id) и очередь событий."""
+
+    def __init__(self, keys, queue_size):
+        self.keys = frozenset(keys)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.closed = False
+        # Поток не успевает разбирать очередь - закрываем его, клиент переподключится и получит снимок
+        self.overflowed = False
+
+    def put(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            self.overflowed = True
+
+    def get(self, timeout):
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class AsyncSubscription(Subscription):
+    """
+    Подписка потока в ASGI-режиме (asgi.py): очередь asyncio. Публикуют в неё
+    из потоков WSGI-части (админка, телеметрия), поэтому put передаёт событие
+    в цикл событий через call_soon_threadsafe. Создавать - внутри цикла.
+    """
+
+    def __init__(self, keys, queue_size):
+        self.keys = frozenset(keys)
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.closed = False
+        self.overflowed = False
+        self._loop = asyncio.get_running_loop()
+
+    def put(self, event):
+        try:
+            self._loop.call_soon_threadsafe(self._put_nowait, event)
+        except RuntimeError: # цикл уже остановлен - поток всё равно закрывается
+            pass
+
+    def _put_nowait(self, event):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+    async def get(self, timeout):
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class Broker:
+    """
+    Рассылка событий по подпискам. Для каждого ключа хранится множество
+    подписок и последнее опубликованное состояние (пока на ключ кто-то подписан) -
+    по нему находятся грузы, встраивающие изменённый поезд.
+    """
+
+    def __init__(self, max_connections=1000, queue_size=100):
+        self.max_connections = max_connections
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}  # key -> set(Subscription)
+        self._last = {}         # key -> последнее известное состояние
+        self._connections = 0
+        self.published = 0
+
+    @property
+    def connections(self):
+        return self._connections
+
+    def subscribe(self, keys, factory=Subscription):
+        subscription = factory(keys, self.queue_size)
+        with self._lock:
+            if self._connections >= self.max_connections:
+                raise TooManyConnections()
+            self._connections += 1
+            for key in subscription.keys:
+                self._subscribers.setdefault(key, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            if subscription.closed:
+                return
+            subscription.closed = True
+            self._connections -= 1
+            for key in subscription.keys:
+                subscribers = self._subscribers.get(key)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[key]
+                    self._last.pop(key, None)
+
+    def subscribed(self, keys):
+        """Те из ключей, на которые есть подписчики."""
+        with self._lock:
+            return [key for key in keys if key in self._subscribers]
+
+    def remember(self, key, record):
+        with self._lock:
+            if key in self._subscribers:
+                self._last[key] = record
+
+    def cargo_keys_of_trains(self, train_ids):
+        """Подписанные грузы, последнее известное состояние которых - на одном из этих поездов."""
+        train_ids = set(train_ids)
+        with self._lock:
+            return [key for key, record in self._last.items()
+                    if key[0] == "cargo" and record is not None and record.get("train_id") in train_ids]
+
+    def publish(self, key, record):
+        with self._lock:
+            subscribers = list(self._subscribers.get(key, ()))
+            if subscribers:
+                self._last[key] = record
+            self.published += 1
+        for subscription in subscribers:
+            subscription.put((key, record))
+
+
+broker = Broker(max_connections=Config.SSE_MAX_CONNECTIONS, queue_size=Config.SSE_QUEUE_SIZE)
+
+
+def _notify(search_type, identifiers):
+    keys = broker.subscribed([(search_type, i) for i in identifiers])
+    if not keys:
+        return
+    # Кэш отслеживания к этому моменту уже сброшен - читаем свежее состояние, один запрос на всех
+    records = tracking.lookup_many(search_type, [identifier for _, identifier in keys])
+    for key in keys:
+        broker.publish(key, records.get(key[1]))
+
+
+def notify_cargos(cargo_ids):
+    """Сообщает подписчикам об изменении/удалении грузов. Вызывать после commit и инвалидации кэша."""
+    _notify("cargo", cargo_ids)
+
+
+def notify_trains(train_ids):
+    """
+    То же для поездов. Грузы встраивают имя поезда, поэтому заодно
+    обновляются подписанные грузы этих поездов (в т.ч. удалённые каскадом).
+    """
+    _notify("train", train_ids)
+    cargo_keys = broker.cargo_keys_of_trains(train_ids)
+    if cargo_keys:
+        _notify("cargo", [identifier for _, identifier in cargo_keys])
+
+
+def _event(name, data):
+    return f"event: {name}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+
+def _snapshot(records):
+    """Первое событие потока. records - {тип: {id: состояние}}; запоминает отправленное."""
+    sent = {}
+    snapshot = {"cargo": {}, "train": {}}
+    for search_type, by_id in records.items():
+        for identifier, record in by_id.items():
+            key = (search_type, identifier)
+            sent[key] = record
+            broker.remember(key, record)
+            snapshot[search_type][str(identifier)] = tracking.to_json(record)
+    return sent, _event("snapshot", snapshot)
+
+
+def _change_event(sent, key, record):
+    """Событие об изменении ключа относительно уже отправленного (None - сообщать нечего)."""
+    previous = sent.get(key)
+    sent[key] = record
+    search_type, identifier = key
+    if record is None:
+        return _event("deleted", {"type": search_type, "id": identifier}) if previous is not None else None
+    changes = {k: v for k, v in record.items() if previous is None or previous.get(k) != v}
+    if not changes:
+        return None
+    return _event("update", {"type": search_type, "id": identifier, "changes": tracking.to_json(changes)})
+
+
+def _ids_by_type(subscription):
+    ids = {}
+    for search_type, identifier in subscription.keys:
+        ids.setdefault(search_type, []).append(identifier)
+    return ids
+
+
+def stream(keys, keepalive=15, max_duration=3600, retry_ms=5000):
+    """
+    SSE-поток (итерируемый ответ) для набора ключей (тип, id).
+    Подписка создаётся сразу (TooManyConnections - до начала ответа),
+    первым событием уходит снимок текущего состояния, дальше - только изменения.
+    Каждые keepalive секунд без событий отправляется комментарий, чтобы прокси
+    не закрыли соединение; через max_duration поток завершается, и браузер
+    переподключается (EventSource делает это сам).
+    """
+    subscription = broker.subscribe(keys)
+
+    def generate():
+        try:
+            records = {t: tracking.lookup_many(t, ids) for t, ids in _ids_by_type(subscription).items()}
+            sent, snapshot = _snapshot(records)
+            yield f"retry: {retry_ms}\n\n" + snapshot
+
+            deadline = time.monotonic() + max_duration
+            while time.monotonic() < deadline and not subscription.overflowed:
+                item = subscription.get(timeout=keepalive)
+                if item is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = _change_event(sent, *item)
+                if event:
+                    yield event
+        finally:
+            broker.unsubscribe(subscription)
+
+    return _Stream(generate(), subscription)
+
+
+def stream_async(keys, lookup_many, keepalive=15, max_duration=3600, retry_ms=5000):
+    """
+    То же для asyncio: асинхронный генератор, ожидание событий не занимает поток.
+    lookup_many(search_type, ids) - корутина загрузки снимка (tracking.lookup_many_async).
+    Подписка создаётся сразу; закрывать - aclose() (отписывает, даже если генератор не запускался).
+    """
+    subscription = broker.subscribe(keys, factory=AsyncSubscription)
+
+    async def generate():
+        try:
+            records = {t: await lookup_many(t, ids) for t, ids in _ids_by_type(subscription).items()}
+            sent, snapshot = _snapshot(records)
+            yield f"retry: {retry_ms}\n\n" + snapshot
+
+            deadline = time.monotonic() + max_duration
+            while time.monotonic() < deadline and not subscription.overflowed:
+                item = await subscription.get(timeout=min(keepalive, max(deadline - time.monotonic(), 0)))
+                if item is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                event = _change_event(sent, *item)
+                if event:
+                    yield event
+        finally:
+            broker.unsubscribe(subscription)
+
+    return _AsyncStream(generate(), subscription)
+
+
+class _Stream:
+    """
+    Итерируемый ответ с close(): сервер вызывает его при отключении клиента -
+    в том числе если генератор так и не начал выполняться (тогда его finally не сработал бы).
+    """
+
+    def __init__(self, generator, subscription):
+        self._generator = generator
+        self._subscription = subscription
+
+    def __iter__(self):
+        return self._generator
+
+    def close(self):
+        self._generator.close()
+        broker.unsubscribe(self._subscription)
+
+
+class _AsyncStream:
+    """Асинхронный аналог _Stream."""
+
+    def __init__(self, generator, subscription):
+        self._generator = generator
+        self._subscription = subscription
+
+    def __aiter__(self):
+        return self._generator
+
+    async def aclose(self):
+        await self._generator.aclose()
+        broker.unsubscribe(self._subscription)
@@ -0,0 +1,272 @@
+"""
+log_pipeline.py
+
+Неблокирующее структурированное логирование.
+
+- Поток запроса только кладёт запись в очередь (QueueHandler); форматирование
+  и запись на диск делает один фоновый поток-слушатель (QueueListener).
+  Если очередь переполнена, запись отбрасывается и считается в метрике -
+  запрос не ждёт диск ни при каких условиях.
+- Формат - JSON lines: время, уровень, логгер, сообщение, request_id,
+  маршрут, метод, путь; у строки доступа (одна на запрос) - статус и latency_ms.
+  request_id берётся из заголовка X-Request-ID (от nginx / балансировщика) или
+  генерируется и возвращается клиенту в том же заголовке.
+- Выборка по уровням (LOG_SAMPLING="INFO=0.1"): решение принимается по
+  request_id, поэтому для попавшего в выборку запроса видны все его записи,
+  а для остальных - ни одной. WARNING и выше пишутся всегда.
+- Ротация по размеру безопасна для нескольких процессов: файл открыт на
+  дозапись (O_APPEND), переименование делает один процесс под файловой
+  блокировкой, остальные замечают новый файл по смене inode и переоткрывают его.
+"""
+
+import atexit
+import copy
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import re
+import time
+import uuid
+import zlib
+
+from flask import g, has_request_context, request
+
+import metrics
+
+DROPPED_TOTAL = metrics.registry.register(metrics.Counter(
+    "log_records_dropped_total", "Записи лога, отброшенные из-за переполненной очереди"))
+
+# Допустимый X-Request-ID от клиента/прокси: иначе генерируем свой
+_REQUEST_ID_RE = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+# Атрибуты LogRecord, которые не надо дублировать в JSON как extra-поля
+_RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+def parse_sampling(value):
+    """"INFO=0.1,DEBUG=0" -> {logging.INFO: 0.1, logging.DEBUG: 0.0}."""
+    rates = {}
+    for part in (value or "").split(","):
+        if "=" not in part:
+            continue
+        level, rate = part.split("=", 1)
+        level_no = logging.getLevelName(level.strip().upper())
+        if isinstance(level_no, int):
+            rates[level_no] = min(max(float(rate), 0.0), 1.0)
+    return rates
+
+
+class RequestContextFilter(logging.Filter):
+    """
+    Дописывает в запись данные текущего запроса. Работает в потоке запроса
+    (на QueueHandler): у слушателя контекста запроса уже нет.
+    """
+
+    def filter(self, record):
+        if has_request_context():
+            record.request_id = g.get("request_id")
+            record.route = request.endpoint
+            record.method = request.method
+            record.path = request.path
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю rates[level] записей уровня; уровни без правила - все."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        rate = self.rates.get(record.levelno)
+        if rate is None or rate >= 1.0 or getattr(record, "sample", True) is False:
+            return True
+        request_id = getattr(record, "request_id", None)
+        if request_id:
+            # Одно решение на весь запрос: стабильный хэш request_id
+            return (zlib.crc32(request_id.encode()) % 10000) < rate * 10000
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and key != "sample" and value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text: # traceback, подготовленный в потоке запроса (DroppingQueueHandler)
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который при переполненной очереди отбрасывает запись, а не блокирует/падает."""
+
+    _exc_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        """
+        Стандартный prepare() вклеивает traceback в msg. Здесь сообщение
+        подставляется в msg, а traceback уходит в exc_text - в JSON это
+        разные поля (message и exc). exc_info очищается: объект traceback
+        не переживает передачу в другой процесс и держит кадры стека.
+        """
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self._exc_formatter.formatException(record.exc_info)
+        record.msg = record.message
+        record.args = None
+        record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_TOTAL.inc()
+
+
+class MultiProcessRotatingFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    Ротация по размеру для нескольких процессов, пишущих в один файл.
+    Переименовывает тот процесс, который взял блокировку <файл>.lock
+    (создание файла с O_EXCL атомарно на любой ОС); после ротации все
+    процессы переоткрывают файл - WatchedFileHandler видит смену inode.
+    """
+
+    LOCK_STALE_SECONDS = 30
+
+    def __init__(self, filename, max_bytes, backup_count):
+        super().__init__(filename, encoding="utf-8", delay=False)
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.lock_path = self.baseFilename + ".lock"
+
+    def emit(self, record):
+        try:
+            if self.max_bytes and self.stream and self.stream.tell() >= self.max_bytes:
+                self._rotate()
+        except OSError:
+            pass # не получилось повернуть - пишем дальше в текущий файл
+        super().emit(record)
+
+    def _rotate(self):
+        if not self._acquire_lock():
+            return
+        try:
+            # Пока ждали блокировку, файл мог повернуть другой процесс
+            if os.path.exists(self.baseFilename) and os.path.getsize(self.baseFilename) >= self.max_bytes:
+                for i in range(self.backup_count - 1, 0, -1):
+                    source = f"{self.baseFilename}.{i}"
+                    if os.path.exists(source):
+                        os.replace(source, f"{self.baseFilename}.{i + 1}")
+                if self.backup_count:
+                    os.replace(self.baseFilename, f"{self.baseFilename}.1")
+                else:
+                    os.remove(self.baseFilename)
+        finally:
+            os.remove(self.lock_path)
+        self.reopenIfNeeded()
+
+    def _acquire_lock(self):
+        try:
+            os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return True
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(self.lock_path) > self.LOCK_STALE_SECONDS:
+                    os.remove(self.lock_path) # процесс умер, не сняв блокировку
+            except OSError:
+                pass
+            return False
+
+
+class LogPipeline:
+    def __init__(self):
+        self.queue = None
+        self.listener = None
+        self.handlers = []
+
+    def init_app(self, app):
+        config = app.config
+        formatter = JsonFormatter()
+        handlers = []
+        if config.get("LOG_FILE"):
+            directory = os.path.dirname(os.path.abspath(config["LOG_FILE"]))
+            os.makedirs(directory, exist_ok=True)
+            file_handler = MultiProcessRotatingFileHandler(
+                config["LOG_FILE"], config["LOG_MAX_BYTES"], config["LOG_BACKUP_COUNT"])
+            handlers.append(file_handler)
+        if app.debug or not handlers:
+            handlers.append(logging.StreamHandler())
+        for handler in handlers:
+            handler.setFormatter(formatter)
+        self.handlers = handlers
+
+        self.queue = queue.Queue(maxsize=config["LOG_QUEUE_SIZE"])
+        queue_handler = DroppingQueueHandler(self.queue)
+        queue_handler.addFilter(RequestContextFilter())
+        queue_handler.addFilter(SamplingFilter(parse_sampling(config.get("LOG_SAMPLING"))))
+
+        app.logger.handlers.clear()
+        app.logger.addHandler(queue_handler)
+        app.logger.setLevel(config["LOG_LEVEL"])
+        app.logger.propagate = False
+        # Логгеры модулей (contact_queue и др.) - тем же путём
+        for name in config.get("LOG_EXTRA_LOGGERS", ()):
+            logger = logging.getLogger(name)
+            logger.handlers.clear()
+            logger.addHandler(queue_handler)
+            logger.setLevel(config["LOG_LEVEL"])
+            logger.propagate = False
+
+        self._start()
+        atexit.register(self.stop)
+        if hasattr(os, "register_at_fork"):
+            # gunicorn --preload: поток слушателя не переживает fork - запускаем заново в воркере
+            os.register_at_fork(after_in_child=self._start)
+
+        @app.before_request
+        def _assign_request_id():
+            incoming = request.headers.get("X-Request-ID", "")
+            g.request_id = incoming if _REQUEST_ID_RE.match(incoming) else uuid.uuid4().hex
+            g._log_started = time.perf_counter()
+
+        @app.after_request
+        def _access_log(response):
+            request_id = g.get("request_id")
+            if request_id:
+                response.headers["X-Request-ID"] = request_id
+            started = g.get("_log_started")
+            if started is not None and not metrics.is_internal_request():
+                app.logger.info("request", extra={
+                    "status": response.status_code,
+                    "latency_ms": round((time.perf_counter() - started) * 1000, 2),
+                })
+            return response
+
+    def _start(self):
+        self.listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+        self.listener.start()
+
+    def stop(self):
+        """Дописывает очередь и останавливает слушатель (atexit)."""
+        if self.listener is not None and self.listener._thread is not None:
+            self.listener.stop()
+
+
+log_pipeline = LogPipeline()
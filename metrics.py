@@ -0,0 +1,225 @@
+"""
+metrics.py
+
+Лёгкая инструментация без внешних зависимостей:
+- время обработки каждого запроса по endpoint'ам (гистограммы);
+- число SQL-запросов и суммарное время в БД на запрос (события SQLAlchemy engine);
+- лог медленных SQL-запросов с параметрами;
+- выдача всего этого в текстовом формате Prometheus (/metrics).
+
+Метрики хранятся в памяти процесса: при нескольких воркерах gunicorn каждый
+воркер отдаёт свои значения (Prometheus различает их по instance/pod).
+На запрос накладные расходы - несколько вызовов perf_counter() и короткие
+захваты блокировок, так что инструментацию можно держать включённой в продакшене.
+"""
+
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+
+# Границы бакетов по умолчанию (секунды) - как у prometheus_client
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик с метками."""
+
+    type_name = "counter"
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            yield self.name, _format_labels(self.label_names, label_values), value
+
+
+class Histogram:
+    """Гистограмма с фиксированными бакетами (кумулятивными при выдаче, как требует Prometheus)."""
+
+    type_name = "histogram"
+
+    def __init__(self, name, documentation, label_names=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label_values -> [counts по бакетам..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        index = len(self.buckets)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                state = self._values[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(state)) for labels, state in self._values.items()]
+        for label_values, state in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), state[:-1]):
+                cumulative += count
+                le = bound if bound == "+Inf" else _format_value(float(bound))
+                yield (f"{self.name}_bucket",
+                       _format_labels(self.label_names, label_values, ("le", le)), cumulative)
+            yield f"{self.name}_sum", _format_labels(self.label_names, label_values), state[-1]
+            yield f"{self.name}_count", _format_labels(self.label_names, label_values), cumulative
+
+
+class CallbackMetric:
+    """
+    Метрика без меток, значение которой берётся вызовом callback() в момент выдачи
+    (например, счётчики попаданий кэша, которые и так ведёт сам кэш).
+    """
+
+    def __init__(self, name, documentation, type_name, callback):
+        self.name = name
+        self.documentation = documentation
+        self.type_name = type_name
+        self._callback = callback
+
+    def samples(self):
+        yield self.name, "", self._callback()
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Текстовый формат экспозиции Prometheus (version 0.0.4)."""
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+REQUEST_LATENCY = registry.register(Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("endpoint", "method")))
+REQUESTS_TOTAL = registry.register(Counter(
+    "http_requests_total", "Число HTTP-запросов", ("endpoint", "method", "status")))
+REQUEST_DB_QUERIES = registry.register(Histogram(
+    "http_request_db_queries", "Число SQL-запросов на один HTTP-запрос", ("endpoint",),
+    buckets=QUERY_COUNT_BUCKETS))
+REQUEST_DB_TIME = registry.register(Histogram(
+    "http_request_db_seconds", "Суммарное время в БД на один HTTP-запрос", ("endpoint",)))
+DB_QUERIES_TOTAL = registry.register(Counter(
+    "db_queries_total", "Число выполненных SQL-запросов", ("engine",)))
+DB_SLOW_QUERIES_TOTAL = registry.register(Counter(
+    "db_slow_queries_total", "Число SQL-запросов дольше порога SLOW_QUERY_MS", ("engine",)))
+
+
+def _endpoint_label():
+    return request.endpoint or "unknown"
+
+
+def instrument_engine(engine, name, logger, slow_query_ms):
+    """Подписывается на события engine: считает запросы и время, логирует медленные."""
+    slow_threshold = slow_query_ms / 1000.0
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._metrics_started
+        DB_QUERIES_TOTAL.inc(name)
+        if has_request_context() and "_metrics_started" in g:
+            g._metrics_db_queries += 1
+            g._metrics_db_time += elapsed
+        if slow_threshold and elapsed >= slow_threshold:
+            DB_SLOW_QUERIES_TOTAL.inc(name)
+            params = repr(parameters)
+            if len(params) > 500:
+                params = params[:500] + "..."
+            where = f" [{_endpoint_label()}]" if has_request_context() else ""
+            logger.warning(
+                f"Медленный SQL-запрос{where} ({elapsed * 1000:.1f} мс, engine={name}): "
+                f"{' '.join(statement.split())} | параметры: {params}"
+            )
+
+
+# Ключ WSGI environ для служебных запросов приложения к самому себе (прогрев
+# кэша страниц): в метрики трафика и в строку доступа лога они не попадают
+INTERNAL_REQUEST_KEY = "app.internal_request"
+
+
+def is_internal_request():
+    return has_request_context() and bool(request.environ.get(INTERNAL_REQUEST_KEY))
+
+
+def init_app(app, engines):
+    """
+    Включает сбор метрик для приложения.
+    :param engines: dict {имя: engine} - какие engine инструментировать
+    """
+    slow_query_ms = app.config.get("SLOW_QUERY_MS", 200)
+    seen = set()
+    for name, engine in engines.items():
+        if id(engine) in seen: # read_engine может совпадать с основным
+            continue
+        seen.add(id(engine))
+        instrument_engine(engine, name, app.logger, slow_query_ms)
+
+    @app.before_request
+    def _metrics_before_request():
+        g._metrics_started = time.perf_counter()
+        g._metrics_db_queries = 0
+        g._metrics_db_time = 0.0
+
+    @app.after_request
+    def _metrics_after_request(response):
+        started = g.pop("_metrics_started", None)
+        if started is None or is_internal_request():
+            return response
+        endpoint = _endpoint_label()
+        REQUEST_LATENCY.observe(time.perf_counter() - started, endpoint, request.method)
+        REQUESTS_TOTAL.inc(endpoint, request.method, str(response.status_code))
+        REQUEST_DB_QUERIES.observe(g._metrics_db_queries, endpoint)
+        REQUEST_DB_TIME.observe(g._metrics_db_time, endpoint)
+        return response
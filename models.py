@@ -6,11 +6,12 @@ models.py
 """
 
 import datetime
+import os
 from sqlalchemy import (
-    Column, Integer, String, Text, DateTime, ForeignKey
+    Column, Integer, SmallInteger, String, Text, DateTime, ForeignKey, Index
 )
 from sqlalchemy.orm import relationship, declarative_base, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from werkzeug.security import generate_password_hash # <-- Добавлен импорт для хеширования
 
 from config import Config
@@ -18,14 +19,97 @@ from config import Config
 # Создаём базовый класс для наших моделей
 Base = declarative_base()
 
-# Создаём engine на основе настроек из config
-# Для простоты берем Config.DB_PATH (SQLAlchemy для SQLite: sqlite:///<путь>)
-# echo=False - отключает логирование SQL-запросов в консоль (лучше для продакшена)
-engine = create_engine(f"sqlite:///{Config.DB_PATH}", echo=False)
+# ------------------------
+# ENGINE И СЕССИИ
+# ------------------------
+
+def _apply_pragmas(dbapi_conn, read_only=False):
+    """Выставляет PRAGMA из Config на новом соединении SQLite."""
+    cursor = dbapi_conn.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(Config.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA cache_size = {int(Config.SQLITE_CACHE_SIZE)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(Config.SQLITE_MMAP_SIZE)}")
+        if read_only:
+            cursor.execute("PRAGMA query_only = ON")
+        else:
+            # journal_mode сохраняется в самом файле БД, менять его может только пишущее соединение
+            cursor.execute(f"PRAGMA journal_mode = {Config.SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA synchronous = {Config.SQLITE_SYNCHRONOUS}")
+    finally:
+        cursor.close()
+
+
+def make_engine(read_only=False):
+    """
+    Создаёт engine для Config.DB_PATH.
+    read_only=True открывает файл через URI с mode=ro: такое соединение
+    физически не может писать и не берёт write-блокировок.
+    """
+    if read_only:
+        db_path = os.path.abspath(Config.DB_PATH)
+        url = f"sqlite:///file:{db_path}?mode=ro&uri=true"
+    else:
+        url = f"sqlite:///{Config.DB_PATH}"
+
+    new_engine = create_engine(
+        url,
+        echo=False, # echo=False - отключает логирование SQL-запросов в консоль (лучше для продакшена)
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        connect_args={
+            "timeout": Config.SQLITE_BUSY_TIMEOUT_MS / 1000,
+            "check_same_thread": False, # соединения из пула переходят между потоками воркера
+        },
+    )
+
+    @event.listens_for(new_engine, "connect")
+    def _on_connect(dbapi_conn, connection_record):
+        _apply_pragmas(dbapi_conn, read_only=read_only)
+
+    return new_engine
+
+
+def make_async_engine(read_only=True):
+    """
+    Async-engine (драйвер aiosqlite) для ASGI-режима (asgi.py): тот же файл БД
+    и те же PRAGMA. Запрос выполняется в потоке aiosqlite, цикл событий не блокируется.
+    Импорт SQLAlchemy asyncio - здесь, чтобы WSGI-режиму не нужны были aiosqlite/greenlet.
+    """
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    db_path = os.path.abspath(Config.DB_PATH)
+    if read_only:
+        url = f"sqlite+aiosqlite:///file:{db_path}?mode=ro&uri=true"
+    else:
+        url = f"sqlite+aiosqlite:///{db_path}"
+
+    new_engine = create_async_engine(
+        url,
+        echo=False,
+        pool_size=Config.DB_POOL_SIZE,
+        max_overflow=Config.DB_MAX_OVERFLOW,
+        connect_args={"timeout": Config.SQLITE_BUSY_TIMEOUT_MS / 1000},
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def _on_connect(dbapi_conn, connection_record):
+        _apply_pragmas(dbapi_conn, read_only=read_only)
+
+    return new_engine
+
 
-# Создаём фабрику сессий
+# Основной engine - для всех записей (админка, импорт, setup)
+engine = make_engine()
+
+# Engine только для чтения - для публичных путей (/track). Соединения
+# открываются лениво, поэтому отсутствие файла БД при импорте модуля не страшно.
+read_engine = make_engine(read_only=True) if Config.DB_READ_ONLY_ENGINE else engine
+
+# Создаём фабрики сессий
 # expire_on_commit=False - позволяет объектам оставаться доступными после коммита сессии
 SessionLocal = sessionmaker(bind=engine, expire_on_commit=False)
+ReadSessionLocal = sessionmaker(bind=read_engine, expire_on_commit=False)
 
 # ------------------------
 # МОДЕЛИ
@@ -38,14 +122,15 @@ class Train(Base):
     __tablename__ = "trains"
 
     train_id = Column(Integer, primary_key=True, autoincrement=True)
-    name = Column(String(100), nullable=False)             # Название/номер поезда (добавлена примерная длина)
+    name = Column(String(100), nullable=False, index=True) # Название/номер поезда (индекс - для order_by(Train.name) в формах)
     departure_station = Column(String(100), nullable=True) # Начальная станция
     arrival_station = Column(String(100), nullable=True)   # Конечная станция
-    # TODO: Рассмотреть использование DateTime вместо String для времени
-    departure_time = Column(String, nullable=True)         # Время отправления
-    arrival_time = Column(String, nullable=True)           # Время прибытия
+    # Время хранится как DateTime (в SQLite - ISO-строка единого формата),
+    # поэтому диапазонные фильтры идут по индексу, а не через разбор строк в Python
+    departure_time = Column(DateTime, nullable=True, index=True) # Время отправления
+    arrival_time = Column(DateTime, nullable=True, index=True)   # Время прибытия
     last_operation_station = Column(String(100), nullable=True)
-    last_operation_time = Column(String, nullable=True)    # TODO: Рассмотреть DateTime
+    last_operation_time = Column(DateTime, nullable=True, index=True)
     distance_to_arrival = Column(Integer, nullable=True)
     operation_desc = Column(String(255), nullable=True)    # Описание операции
 
@@ -64,18 +149,28 @@ class Cargo(Base):
 
     cargo_id = Column(Integer, primary_key=True, autoincrement=True)
     cargo_type = Column(String(100), nullable=True)
-    train_id = Column(Integer, ForeignKey("trains.train_id"), nullable=True) # Внешний ключ к таблице поездов
-    current_station = Column(String(100), nullable=True)
-    status = Column(String(50), nullable=True)
-    # TODO: Рассмотреть использование DateTime вместо String для времени
-    last_stop_time = Column(String, nullable=True)
+    train_id = Column(Integer, ForeignKey("trains.train_id"), nullable=True, index=True) # Внешний ключ к таблице поездов
+    current_station = Column(String(100), nullable=True, index=True)
+    status = Column(String(50), nullable=True, index=True)
+    last_stop_time = Column(DateTime, nullable=True, index=True)
     next_station = Column(String(100), nullable=True)
     distance_to_arrival = Column(Integer, nullable=True)
     last_operation = Column(String(255), nullable=True)
+    # Расчётное время прибытия (пакетный расчёт eta.py) - только у грузов в пути.
+    # Индекс - для выборки ближайших прибытий и очистки у доставленных
+    eta = Column(DateTime, nullable=True, index=True)
 
     # Связь обратно к Train
     train = relationship("Train", back_populates="cargos")
 
+    # Составные индексы для комбинированных фильтров.
+    # Одиночные индексы выше хранят записи в порядке (значение, cargo_id),
+    # поэтому keyset-пагинация по фильтру не требует сортировки.
+    __table_args__ = (
+        Index("ix_cargos_status_station", "status", "current_station"),
+        Index("ix_cargos_train_status", "train_id", "status"),
+    )
+
     def __repr__(self):
         return f"<Cargo(id={self.cargo_id}, type={self.cargo_type})>"
 
@@ -116,15 +211,164 @@ class Contact(Base):
     name = Column(String(100), nullable=True)
     email = Column(String(120), nullable=True) # Увеличена длина для email
     message = Column(Text, nullable=True)
-    created_at = Column(DateTime, default=datetime.datetime.utcnow) # Дата создания по умолчанию
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, index=True) # Дата создания по умолчанию
 
     def __repr__(self):
         return f"<Contact(id={self.contact_id}, email={self.email})>"
 
+class Station(Base):
+    """
+    Справочник станций: в журнале перемещений хранится целочисленный ID
+    вместо повторяющегося названия. Пополняется триггерами журнала (history.py).
+    """
+    __tablename__ = "stations"
+
+    station_id = Column(Integer, primary_key=True, autoincrement=True)
+    name = Column(String(100), nullable=False, unique=True)
+
+    def __repr__(self):
+        return f"<Station(id={self.station_id}, name={self.name})>"
+
+
+class TrackSegment(Base):
+    """
+    Участок пути между двумя соседними станциями (без направления: по участку
+    ездят в обе стороны). Из участков строится сеть для расчёта расстояний (routing.py).
+    """
+    __tablename__ = "track_segments"
+
+    segment_id = Column(Integer, primary_key=True, autoincrement=True)
+    from_station_id = Column(Integer, ForeignKey("stations.station_id"), nullable=False)
+    to_station_id = Column(Integer, ForeignKey("stations.station_id"), nullable=False)
+    length_km = Column(Integer, nullable=False)
+
+    from_station = relationship("Station", foreign_keys=[from_station_id])
+    to_station = relationship("Station", foreign_keys=[to_station_id])
+
+    __table_args__ = (
+        # Пара хранится упорядоченной (from < to), поэтому участок между станциями один
+        Index("ix_track_segments_stations", "from_station_id", "to_station_id", unique=True),
+    )
+
+    def __repr__(self):
+        return f"<TrackSegment({self.from_station_id}-{self.to_station_id}, {self.length_km} км)>"
+
+
+class RouteDistance(Base):
+    """
+    Кратчайшие расстояния по сети между всеми парами связанных станций
+    (from < to; расстояние симметрично). Таблицу ведёт routing.py, триггеры
+    заполняют по ней distance_to_arrival поездов и грузов.
+    """
+    __tablename__ = "route_distances"
+
+    from_station_id = Column(Integer, primary_key=True, autoincrement=False)
+    to_station_id = Column(Integer, primary_key=True, autoincrement=False)
+    distance = Column(Integer, nullable=False)
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    def __repr__(self):
+        return f"<RouteDistance({self.from_station_id}-{self.to_station_id} = {self.distance})>"
+
+
+class MovementEvent(Base):
+    """
+    Журнал перемещений (только добавление): одна запись на каждое изменение
+    местоположения/статуса поезда или груза. Пишется триггерами SQLite (history.py),
+    поэтому покрывает и формы, и импорт, и телеметрию.
+
+    Таблица WITHOUT ROWID с первичным ключом (entity_type, entity_id, ts, seq):
+    строки одного объекта лежат рядом в порядке времени, и хронология читается
+    одним range scan без отдельного индекса. Время - секунды Unix-эпохи
+    («наивное» время приложения, трактуемое как UTC), seq различает события
+    с одинаковой секундой.
+    """
+    __tablename__ = "movement_events"
+
+    ENTITY_TRAIN = 1
+    ENTITY_CARGO = 2
+
+    entity_type = Column(SmallInteger, primary_key=True, autoincrement=False)
+    entity_id = Column(Integer, primary_key=True, autoincrement=False)
+    ts = Column(Integer, primary_key=True, autoincrement=False)
+    seq = Column(SmallInteger, primary_key=True, autoincrement=False, default=0)
+    station_id = Column(Integer, nullable=True)
+    distance_to_arrival = Column(Integer, nullable=True)
+    status = Column(String(50), nullable=True)      # статус груза (у поездов пусто)
+    detail = Column(String(255), nullable=True)     # описание операции
+    # Сколько исходных событий схлопнуто в эту запись при сжатии старой истории
+    merged = Column(Integer, nullable=False, server_default="1")
+
+    __table_args__ = {"sqlite_with_rowid": False}
+
+    def __repr__(self):
+        return f"<MovementEvent({self.entity_type}:{self.entity_id} @ {self.ts})>"
+
+class SummaryCounter(Base):
+    """
+    Сводка для админ-панели (summary.py): счётчики и суммы по грузам и поездам
+    в разрезе метрики и ключа (статус, поезд, состояние). Поддерживается
+    триггерами SQLite при любой записи в cargos/trains, поэтому панель читает
+    несколько готовых строк вместо полного сканирования таблиц.
+    """
+    __tablename__ = "summary_counters"
+
+    metric = Column(String(32), primary_key=True)
+    key = Column(String(100), primary_key=True)
+    value = Column(Integer, nullable=False, server_default="0")  # число строк
+    total = Column(Integer, nullable=False, server_default="0")  # сумма (например, расстояний)
+
+    __table_args__ = (
+        # «Топ» ключей метрики (грузов на поезд) - по индексу, без сортировки всех строк
+        Index("ix_summary_counters_metric_value", "metric", "value"),
+        {"sqlite_with_rowid": False},
+    )
+
+    def __repr__(self):
+        return f"<SummaryCounter({self.metric}:{self.key} = {self.value})>"
+
 # ------------------------------------
 # УТИЛИТАРНЫЕ ФУНКЦИИ
 # ------------------------------------
 
+# Форматы, в которых принимаем время из форм, импорта и старых строковых значений.
+# Первый формат - основной (в нём же поля форм выводят значение).
+DATETIME_INPUT_FORMATS = [
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%d.%m.%Y %H:%M",
+    "%d.%m.%Y",
+    "%Y-%m-%d",
+]
+
+# Колонки со временем, которые раньше были строками (для миграции db_setup.py)
+DATETIME_COLUMNS = {
+    "trains": ("departure_time", "arrival_time", "last_operation_time"),
+    "cargos": ("last_stop_time",),
+}
+
+
+def parse_datetime(value):
+    """
+    Разбирает строку со временем в datetime (None для пустых значений).
+    Поддерживает DATETIME_INPUT_FORMATS и ISO 8601; при неудаче - ValueError.
+    """
+    if value is None or isinstance(value, datetime.datetime):
+        return value
+    value = str(value).strip()
+    if not value:
+        return None
+    for fmt in DATETIME_INPUT_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+    return datetime.datetime.fromisoformat(value)
+
+
 def create_all_tables():
     """Создает все таблицы, определенные через Base."""
     print("[models] Попытка создания таблиц...")
@@ -151,10 +395,10 @@ def create_default_data(session):
             name="KZ-001",
             departure_station="Алматы",
             arrival_station="Астана", # Убрал скобки, для консистентности
-            departure_time="2025-04-10 08:00", # Формат как строка YYYY-MM-DD HH:MM
-            arrival_time="2025-04-11 20:00",
+            departure_time=datetime.datetime(2025, 4, 10, 8, 0),
+            arrival_time=datetime.datetime(2025, 4, 11, 20, 0),
             last_operation_station="Кокшетау",
-            last_operation_time="2025-04-10 15:00",
+            last_operation_time=datetime.datetime(2025, 4, 10, 15, 0),
             distance_to_arrival=350,
             operation_desc="Отправление из Кокшетау"
         )
@@ -166,7 +410,7 @@ def create_default_data(session):
             train=train1,  # связываем через объект train1
             current_station="Кокшетау",
             status="В пути",
-            last_stop_time="2025-04-10 14:30",
+            last_stop_time=datetime.datetime(2025, 4, 10, 14, 30),
             next_station="Астана",
             distance_to_arrival=350,
             last_operation="Отправлен со станции Кокшетау"
@@ -0,0 +1,157 @@
+"""
+page_cache.py
+
+Кэш готовых страниц для анонимных посетителей.
+
+Главная, «О компании», страница «сообщение отправлено» и пустая форма /track
+одинаковы для всех, кто не вошёл в админку. Декоратор cached сохраняет
+отрендеренное тело (и его сжатые gzip/brotli-варианты, они досчитываются при
+первом запросе с такой кодировкой) по ключу (путь, язык). Повторный запрос
+обслуживается без Jinja и без повторного сжатия; совпавший If-None-Match -
+пустым 304.
+
+Кэш не используется, если:
+- запрос не GET/HEAD или в нём есть параметры (?search_type=... - уже не «пустая» форма);
+- посетитель вошёл в админку (меню другое);
+- в сессии ждут показа flash-сообщения (страница одноразовая).
+
+Как и кэш отслеживания, живёт в памяти процесса: при выкладывании новые
+воркеры стартуют с пустым кэшем и прогревают его сами (warm - в фоновом
+потоке по первому запросу воркера, не при импорте app.py: CLI-команды,
+db_setup и бенчмарк страниц не рендерят), а
+POST /admin/page-cache/purge сбрасывает и заново прогревает кэш воркера,
+принявшего запрос (у остальных записи уйдут по TTL).
+"""
+
+import functools
+import os
+import threading
+
+from flask import current_app, request, session, url_for
+
+import metrics
+from cache import TTLCache
+from config import Config
+from http_cache import http_cache
+
+
+class CachedPage:
+    """Тело страницы и его сжатые варианты: {None: исходное, "gzip": ..., "br": ...}."""
+
+    def __init__(self, body, mimetype, etag):
+        self.bodies = {None: body}
+        self.mimetype = mimetype
+        self.etag = etag
+
+    def body(self, encoding):
+        if encoding not in self.bodies:
+            # Гонка двух потоков безвредна: оба посчитают одно и то же
+            self.bodies[encoding] = http_cache.encode(self.bodies[None], encoding)
+        return self.bodies[encoding]
+
+
+class PageCache:
+    def __init__(self, maxsize=256, ttl=600, locales=("ru",)):
+        self.store = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.locales = list(locales)
+        self.endpoints = []  # что прогревать в warm()
+        self._warm_lock = threading.Lock()
+        self._warm_started = False
+
+    def init_app(self, app):
+        """Прогрев при первом запросе каждого процесса (PAGE_CACHE_WARM=1)."""
+        if not app.config["PAGE_CACHE_WARM"]:
+            return
+        if hasattr(os, "register_at_fork"):
+            # Воркер после fork прогревает свой кэш сам, даже если мастер уже успел
+            os.register_at_fork(after_in_child=self._reset_warm)
+
+        @app.before_request
+        def _page_cache_warm_once():
+            if self._warm_started:
+                return
+            with self._warm_lock:
+                if self._warm_started:
+                    return
+                self._warm_started = True
+            # В фоне: первый посетитель не ждёт рендера всех страниц
+            threading.Thread(target=self._warm_in_background, args=(app,), name="page-cache-warm", daemon=True).start()
+
+    def _reset_warm(self):
+        self._warm_lock = threading.Lock()
+        self._warm_started = False
+
+    def _warm_in_background(self, app):
+        try:
+            warmed = self.warm(app)
+            app.logger.info(f"Кэш страниц прогрет: {warmed} страниц")
+        except Exception as e:
+            app.logger.warning(f"Не удалось прогреть кэш страниц: {e}")
+
+    def cacheable(self):
+        return (request.method in ("GET", "HEAD") and not request.args
+                and not session.get("user_id") and not session.get("_flashes"))
+
+    def key(self):
+        locale = request.accept_languages.best_match(self.locales) or self.locales[0]
+        return request.path, locale
+
+    def cached(self, view):
+        """Декоратор view: кэширует ответ 200 для анонимных посетителей."""
+        self.endpoints.append(view.__name__)
+
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if not self.cacheable():
+                return view(*args, **kwargs)
+            key = self.key()
+            page = self.store.get(key)
+            if page is None:
+                response = current_app.make_response(view(*args, **kwargs))
+                if response.status_code != 200 or response.is_streamed:
+                    return response
+                etag = response.get_etag()[0]
+                if etag is None:
+                    etag = http_cache.page_etag(request.path)
+                    http_cache.make_conditional(response, etag)
+                page = CachedPage(response.get_data(), response.mimetype, etag)
+                self.store.set(key, page, tags=(("path", key[0]),))
+                return response
+            return self._respond(page)
+
+        return wrapper
+
+    @staticmethod
+    def _respond(page):
+        not_modified = http_cache.not_modified_response(page.etag)
+        if not_modified:
+            return not_modified
+        encoding = http_cache.negotiate_encoding(len(page.bodies[None]))
+        response = current_app.response_class(page.body(encoding), mimetype=page.mimetype)
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+        response.vary.add("Accept-Encoding")
+        return http_cache.make_conditional(response, page.etag)
+
+    def purge(self, path=None):
+        """Сбрасывает кэш целиком или одну страницу (все её языковые варианты). Возвращает число записей."""
+        if path is not None:
+            return self.store.invalidate_tag(("path", path))
+        count = len(self.store)
+        self.store.clear()
+        return count
+
+    def warm(self, app):
+        """Заполняет кэш всех страниц с декоратором cached (для языка по умолчанию)."""
+        with app.test_request_context():
+            paths = [url_for(endpoint) for endpoint in self.endpoints]
+        warmed = 0
+        with app.test_client() as client:
+            for path in paths:
+                # Служебный запрос: не считается трафиком в метриках и логе доступа
+                if client.get(path, environ_base={metrics.INTERNAL_REQUEST_KEY: True}).status_code == 200:
+                    warmed += 1
+        return warmed
+
+
+page_cache = PageCache(maxsize=Config.PAGE_CACHE_SIZE, ttl=Config.PAGE_CACHE_TTL, locales=Config.PAGE_CACHE_LOCALES)
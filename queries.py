@@ -0,0 +1,149 @@
+"""
+queries.py
+
+Переиспользуемые построители запросов для списков в админке:
+разбор фильтров из query string и keyset-пагинация по первичному ключу.
+"""
+
+import datetime
+
+from sqlalchemy import or_
+
+from models import Train, Cargo, parse_datetime
+
+# Какие фильтры принимает каждый список (имя параметра в query string)
+CARGO_FILTERS = ("status", "station", "train_id", "stop_after", "stop_before", "stalled_hours")
+TRAIN_FILTERS = ("name", "station", "departed_after", "departed_before", "departed_within_hours")
+
+# Типы фильтров (всё, что не указано, - строка)
+_INT_FILTERS = {"train_id", "stalled_hours", "departed_within_hours"}
+_DATETIME_FILTERS = {"stop_after", "stop_before", "departed_after", "departed_before"}
+
+
+class Page:
+    """
+    Страница результатов keyset-пагинации.
+    next_cursor / prev_cursor - значения ключа для параметров ?after= / ?before=
+    (None, если в этом направлении страниц больше нет).
+    """
+
+    def __init__(self, items, next_cursor=None, prev_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+
+def parse_filters(args, allowed):
+    """
+    Достаёт из request.args только разрешённые непустые фильтры.
+    Числовые фильтры приводятся к int, временные - к datetime;
+    некорректное значение просто отбрасывается.
+    """
+    filters = {}
+    for key in allowed:
+        value = (args.get(key) or "").strip()
+        if not value:
+            continue
+        try:
+            if key in _INT_FILTERS:
+                value = int(value)
+            elif key in _DATETIME_FILTERS:
+                value = parse_datetime(value)
+        except ValueError:
+            continue
+        filters[key] = value
+    return filters
+
+
+def parse_int_arg(args, key):
+    """Целочисленный параметр из query string или None."""
+    try:
+        return int(args[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def parse_per_page(args, default, maximum):
+    """Размер страницы из ?per_page=, ограниченный диапазоном [1, maximum]."""
+    per_page = parse_int_arg(args, "per_page") or default
+    return max(1, min(per_page, maximum))
+
+
+def apply_cargo_filters(query, filters):
+    """Накладывает фильтры списка грузов (точные совпадения - дружат с индексами)."""
+    if "status" in filters:
+        query = query.filter(Cargo.status == filters["status"])
+    if "station" in filters:
+        query = query.filter(Cargo.current_station == filters["station"])
+    if "train_id" in filters:
+        query = query.filter(Cargo.train_id == filters["train_id"])
+    # Диапазоны по времени - range scan по ix_cargos_last_stop_time
+    if "stop_after" in filters:
+        query = query.filter(Cargo.last_stop_time >= filters["stop_after"])
+    if "stop_before" in filters:
+        query = query.filter(Cargo.last_stop_time < filters["stop_before"])
+    if "stalled_hours" in filters:
+        # «Стоит дольше N часов»: последняя остановка раньше, чем now - N
+        since = datetime.datetime.now() - datetime.timedelta(hours=filters["stalled_hours"])
+        query = query.filter(Cargo.last_stop_time < since)
+    return query
+
+
+def apply_train_filters(query, filters):
+    """Накладывает фильтры списка поездов: префикс названия и любая из станций."""
+    if "name" in filters:
+        query = query.filter(Train.name.like(f"{filters['name']}%"))
+    if "station" in filters:
+        station = filters["station"]
+        query = query.filter(or_(
+            Train.departure_station == station,
+            Train.arrival_station == station,
+            Train.last_operation_station == station,
+        ))
+    # Диапазоны по времени отправления - range scan по ix_trains_departure_time
+    if "departed_after" in filters:
+        query = query.filter(Train.departure_time >= filters["departed_after"])
+    if "departed_before" in filters:
+        query = query.filter(Train.departure_time < filters["departed_before"])
+    if "departed_within_hours" in filters:
+        # «Отправились за последние N часов»
+        since = datetime.datetime.now() - datetime.timedelta(hours=filters["departed_within_hours"])
+        query = query.filter(Train.departure_time >= since, Train.departure_time <= datetime.datetime.now())
+    return query
+
+
+def keyset_page(query, key_column, per_page, after=None, before=None):
+    """
+    Возвращает одну страницу запроса, упорядоченного по key_column.
+
+    Вместо OFFSET используется условие по ключу (key > after / key < before),
+    поэтому стоимость запроса не растёт с номером страницы, а в память
+    попадает не больше per_page + 1 строк.
+    """
+    key_name = key_column.key
+
+    if before is not None:
+        rows = (query.filter(key_column < before)
+                .order_by(key_column.desc())
+                .limit(per_page + 1)
+                .all())
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = bool(items)
+    else:
+        if after is not None:
+            query = query.filter(key_column > after)
+        rows = query.order_by(key_column).limit(per_page + 1).all()
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after is not None and bool(items)
+
+    next_cursor = getattr(items[-1], key_name) if has_next and items else None
+    prev_cursor = getattr(items[0], key_name) if has_prev and items else None
+    return Page(items, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -0,0 +1,358 @@
+"""
+routing.py
+
+Сеть станций и расстояния по ней.
+
+Сеть - участки пути между соседними станциями (track_segments, без
+направления). По ней заранее считаются кратчайшие расстояния между всеми
+парами связанных станций (Дейкстра от каждой станции) и хранятся в таблице
+route_distances. Триггеры SQLite при записи поезда или груза подставляют
+distance_to_arrival из этой таблицы:
+- поезд: last_operation_station -> arrival_station;
+- груз: current_station -> next_station.
+Если маршрут неизвестен (станции нет в сети), остаётся введённое значение.
+Так расстояние уже лежит в строке и /track ничего не считает, а сводка,
+журнал перемещений и ETA видят то же число.
+
+Изменение участка пересчитывает только затронутые пары:
+- участок стал короче или появился - пара (s, t) может лишь уменьшиться,
+  через новый участок: min(d(s,u) + w + d(v,t), d(s,v) + w + d(u,t));
+- участок стал длиннее или удалён - меняются только пары, у которых участок
+  лежит на кратчайшем пути; это значит, что он «натянут» для источника s
+  (d(s,u) + w == d(s,v) или наоборот). Дейкстра перезапускается только от таких s.
+Изменившиеся пары записываются в route_distances, и у поездов и грузов на
+этих парах обновляется distance_to_arrival (один UPDATE ... FROM на таблицу).
+"""
+
+import heapq
+
+from sqlalchemy import text, select, insert, delete, func
+
+from models import ReadSessionLocal, Station, TrackSegment, RouteDistance
+
+# Какие колонки задают маршрут: (таблица, pk, откуда, куда)
+ROUTED_TABLES = (
+    ("trains", "train_id", "last_operation_station", "arrival_station"),
+    ("cargos", "cargo_id", "current_station", "next_station"),
+)
+
+
+def _pair(a, b):
+    return (a, b) if a < b else (b, a)
+
+
+class RouteGraph:
+    """Граф сети в памяти: смежность {станция: {соседняя станция: км}}."""
+
+    def __init__(self, segments=()):
+        self.adjacency = {}
+        for a, b, length in segments:
+            self.set(a, b, length)
+
+    def set(self, a, b, length):
+        self.adjacency.setdefault(a, {})[b] = length
+        self.adjacency.setdefault(b, {})[a] = length
+
+    def shortest_from(self, source):
+        """Дейкстра: {станция: расстояние} для всех станций, достижимых из source."""
+        found = {}
+        heap = [(0, source)]
+        while heap:
+            distance, node = heapq.heappop(heap)
+            if node in found:
+                continue
+            found[node] = distance
+            for neighbour, length in self.adjacency.get(node, {}).items():
+                if neighbour not in found:
+                    heapq.heappush(heap, (distance + length, neighbour))
+        return found
+
+    def all_pairs(self):
+        """{(a, b): км} для a < b - полная таблица (rebuild)."""
+        table = {}
+        for source in self.adjacency:
+            for target, distance in self.shortest_from(source).items():
+                if source < target:
+                    table[(source, target)] = distance
+        return table
+
+
+class DistanceTable:
+    """Таблица расстояний {(a, b): км}, a < b; d(x, x) = 0, None - нет пути."""
+
+    def __init__(self, table):
+        self.table = table
+
+    def get(self, a, b):
+        if a == b:
+            return 0
+        return self.table.get(_pair(a, b))
+
+    def after_decrease(self, nodes, u, v, length):
+        """Изменения после появления/укорочения участка u-v: {(a, b): км}."""
+        changes = {}
+        for s in nodes:
+            su, sv = self.get(s, u), self.get(s, v)
+            if su is None and sv is None:
+                continue # другая компонента связности
+            for t in nodes:
+                if t <= s:
+                    continue
+                candidates = []
+                tv, tu = self.get(v, t), self.get(u, t)
+                if su is not None and tv is not None:
+                    candidates.append(su + length + tv)
+                if sv is not None and tu is not None:
+                    candidates.append(sv + length + tu)
+                if not candidates:
+                    continue
+                best = min(candidates)
+                current = self.get(s, t)
+                if current is None or best < current:
+                    changes[(s, t)] = best
+        return changes
+
+    def after_increase(self, graph, nodes, u, v, old_length):
+        """
+        Изменения после удлинения/удаления участка u-v (graph - уже новая сеть):
+        {(a, b): км или None - путь пропал}.
+        """
+        sources = set()
+        for s in nodes:
+            su, sv = self.get(s, u), self.get(s, v)
+            if su is not None and sv is not None and (su + old_length == sv or sv + old_length == su):
+                sources.add(s)
+        changes = {}
+        for s in sources:
+            fresh = graph.shortest_from(s)
+            for t in nodes:
+                if t == s:
+                    continue
+                old, new = self.get(s, t), fresh.get(t)
+                if old != new:
+                    changes[_pair(s, t)] = new
+        return changes
+
+
+def _load_segments(conn):
+    return conn.execute(select(TrackSegment.from_station_id, TrackSegment.to_station_id,
+                               TrackSegment.length_km)).all()
+
+
+def _load_table(conn):
+    rows = conn.execute(select(RouteDistance.from_station_id, RouteDistance.to_station_id,
+                               RouteDistance.distance))
+    return DistanceTable({(a, b): distance for a, b, distance in rows})
+
+
+def _station_id(conn, name):
+    """ID станции по названию; новая станция добавляется в справочник."""
+    conn.execute(text("INSERT OR IGNORE INTO stations (name) VALUES (:name)"), {"name": name})
+    return conn.execute(select(Station.station_id).where(Station.name == name)).scalar_one()
+
+
+def set_segment(conn, station_a, station_b, length_km):
+    """
+    Добавляет участок или меняет его длину и пересчитывает затронутые расстояния.
+    Выполнять в транзакции conn (engine.begin()).
+    :return: (изменено пар расстояний, обновлено поездов и грузов)
+    """
+    station_a, station_b = station_a.strip(), station_b.strip()
+    if not station_a or not station_b or station_a == station_b:
+        raise ValueError("Участок соединяет две разные станции.")
+    if length_km <= 0:
+        raise ValueError("Длина участка должна быть положительной.")
+    a, b = _pair(_station_id(conn, station_a), _station_id(conn, station_b))
+    old = conn.execute(select(TrackSegment.length_km).where(
+        TrackSegment.from_station_id == a, TrackSegment.to_station_id == b)).scalar()
+    if old == length_km:
+        return 0, 0
+    if old is None:
+        conn.execute(insert(TrackSegment.__table__), {"from_station_id": a, "to_station_id": b, "length_km": length_km})
+    else:
+        conn.execute(TrackSegment.__table__.update()
+                     .where(TrackSegment.from_station_id == a, TrackSegment.to_station_id == b)
+                     .values(length_km=length_km))
+    # Читаем после записи: блокировка записи уже взята, таблица расстояний не поменяется под нами
+    graph = RouteGraph(_load_segments(conn))
+    table = _load_table(conn)
+    nodes = sorted(graph.adjacency)
+    if old is None or length_km < old:
+        changes = table.after_decrease(nodes, a, b, length_km)
+    else:
+        changes = table.after_increase(graph, nodes, a, b, old)
+    return _apply(conn, changes)
+
+
+def delete_segment(conn, segment_id):
+    """Удаляет участок и пересчитывает затронутые расстояния. :return: как у set_segment"""
+    segment = conn.execute(select(TrackSegment.from_station_id, TrackSegment.to_station_id,
+                                  TrackSegment.length_km).where(TrackSegment.segment_id == segment_id)).first()
+    if segment is None:
+        return 0, 0
+    a, b, old = segment
+    table = _load_table(conn)
+    nodes = sorted(RouteGraph(_load_segments(conn)).adjacency) # станции до удаления
+    conn.execute(delete(TrackSegment.__table__).where(TrackSegment.segment_id == segment_id))
+    graph = RouteGraph(_load_segments(conn))
+    return _apply(conn, table.after_increase(graph, nodes, a, b, old))
+
+
+def rebuild(conn):
+    """
+    Полный пересчёт таблицы расстояний по сети (сверка после ручной правки
+    участков, первое заполнение). :return: как у set_segment
+    """
+    fresh = RouteGraph(_load_segments(conn)).all_pairs()
+    stored = _load_table(conn).table
+    changes = {pair: distance for pair, distance in fresh.items() if stored.get(pair) != distance}
+    changes.update({pair: None for pair in stored.keys() - fresh.keys()})
+    return _apply(conn, changes)
+
+
+def _apply(conn, changes):
+    """Записывает изменения таблицы расстояний и обновляет distance_to_arrival на этих парах."""
+    if not changes:
+        return 0, 0
+    removed = [{"a": a, "b": b} for (a, b), distance in changes.items() if distance is None]
+    updated = [{"from_station_id": a, "to_station_id": b, "distance": distance}
+               for (a, b), distance in changes.items() if distance is not None]
+    if removed:
+        conn.execute(text("DELETE FROM route_distances WHERE from_station_id = :a AND to_station_id = :b"), removed)
+    if updated:
+        conn.execute(text(
+            "INSERT INTO route_distances (from_station_id, to_station_id, distance) "
+            "VALUES (:from_station_id, :to_station_id, :distance) "
+            "ON CONFLICT (from_station_id, to_station_id) DO UPDATE SET distance = excluded.distance"
+        ), updated)
+
+    # Поезда и грузы на изменившихся парах. Где путь пропал, остаётся
+    # последнее значение - как и для станций вне сети.
+    rows = 0
+    if updated:
+        rows = _update_rows(conn, "SELECT sa.name, sb.name, :distance FROM stations sa, stations sb "
+                                  "WHERE sa.station_id = :{x} AND sb.station_id = :{y}", updated)
+    return len(changes), rows
+
+
+def refresh(conn):
+    """
+    Проставляет distance_to_arrival по таблице расстояний всем поездам и грузам
+    (после записи с выключенными триггерами - seed). :return: число обновлённых строк
+    """
+    return _update_rows(conn, "SELECT sa.name, sb.name, r.distance FROM route_distances r "
+                              "JOIN stations sa ON sa.station_id = r.{x} JOIN stations sb ON sb.station_id = r.{y}")
+
+
+def _update_rows(conn, pairs_select, params=None):
+    """
+    Обновляет distance_to_arrival на парах станций: pairs_select выбирает
+    (станция, станция, км), {x}/{y} - колонки ID станций в порядке направления;
+    пары в обе стороны собираются во временной таблице, затем один UPDATE ... FROM на таблицу.
+    """
+    conn.execute(text("CREATE TEMP TABLE IF NOT EXISTS route_changes "
+                      "(a TEXT, b TEXT, distance INTEGER, PRIMARY KEY (a, b))"))
+    conn.execute(text("DELETE FROM route_changes"))
+    for x, y in (("from_station_id", "to_station_id"), ("to_station_id", "from_station_id")):
+        conn.execute(text("INSERT OR REPLACE INTO route_changes (a, b, distance) " + pairs_select.format(x=x, y=y)),
+                     params)
+    rows = 0
+    for table, _, source, target in ROUTED_TABLES:
+        rows += conn.execute(text(
+            f"UPDATE {table} SET distance_to_arrival = c.distance FROM route_changes c "
+            f"WHERE {table}.{source} = c.a AND {table}.{target} = c.b "
+            f"AND {table}.distance_to_arrival IS NOT c.distance"
+        )).rowcount
+    conn.execute(text("DELETE FROM route_changes"))
+    return rows
+
+
+def route_distance_sql(row, source, target):
+    """
+    SQL-выражение: расстояние по сети между станциями {row}.source и {row}.target
+    (NULL - маршрут неизвестен). Его же использует журнал перемещений (history.py).
+    """
+    return (
+        f"CASE WHEN {row}.{source} = {row}.{target} THEN 0 ELSE ("
+        f"SELECT r.distance FROM stations sa, stations sb, route_distances r "
+        f"WHERE sa.name = {row}.{source} AND sb.name = {row}.{target} "
+        f"AND r.from_station_id = MIN(sa.station_id, sb.station_id) "
+        f"AND r.to_station_id = MAX(sa.station_id, sb.station_id)) END"
+    )
+
+
+def _trigger_names(table):
+    return [f"route_{table}_ai", f"route_{table}_au"]
+
+
+def triggers():
+    statements = []
+    for table, pk, source, target in ROUTED_TABLES:
+        body = (
+            f"BEGIN UPDATE {table} SET distance_to_arrival = q.distance "
+            f"FROM (SELECT {route_distance_sql('new', source, target)} AS distance) AS q "
+            f"WHERE {table}.{pk} = new.{pk} AND q.distance IS NOT NULL "
+            f"AND {table}.distance_to_arrival IS NOT q.distance; END"
+        )
+        ai, au = _trigger_names(table)
+        statements.append(f"CREATE TRIGGER {ai} AFTER INSERT ON {table} {body}")
+        statements.append(
+            f"CREATE TRIGGER {au} AFTER UPDATE OF {source}, {target} ON {table} "
+            f"WHEN old.{source} IS NOT new.{source} OR old.{target} IS NOT new.{target} {body}"
+        )
+    return statements
+
+
+def drop_triggers(conn):
+    for table, *_ in ROUTED_TABLES:
+        for name in _trigger_names(table):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+
+def install(conn):
+    """
+    Пересоздаёт триггеры (безопасно запускать повторно). Если участки есть,
+    а таблица расстояний пуста - заполняет её. :return: число рассчитанных пар
+    """
+    drop_triggers(conn)
+    for statement in triggers():
+        conn.execute(text(statement))
+    has_segments = conn.execute(select(TrackSegment.segment_id).limit(1)).first() is not None
+    has_routes = conn.execute(select(RouteDistance.from_station_id).limit(1)).first() is not None
+    if has_segments and not has_routes:
+        return rebuild(conn)[0]
+    return 0
+
+
+def distance(station_a, station_b):
+    """Расстояние по сети между станциями (по названиям) или None."""
+    if station_a == station_b:
+        return 0
+    with ReadSessionLocal() as db:
+        ids = dict(db.execute(select(Station.name, Station.station_id)
+                              .where(Station.name.in_((station_a, station_b)))).all())
+        if len(ids) < 2:
+            return None
+        a, b = _pair(ids[station_a], ids[station_b])
+        return db.execute(select(RouteDistance.distance).where(
+            RouteDistance.from_station_id == a, RouteDistance.to_station_id == b)).scalar()
+
+
+def segments():
+    """Участки сети для админки: [(segment_id, станция, станция, км)] по названиям станций."""
+    with ReadSessionLocal() as db:
+        return db.execute(text(
+            "SELECT s.segment_id, a.name, b.name, s.length_km FROM track_segments s "
+            "JOIN stations a ON a.station_id = s.from_station_id "
+            "JOIN stations b ON b.station_id = s.to_station_id ORDER BY a.name, b.name"
+        )).all()
+
+
+def network_size():
+    """(станций в сети, рассчитанных пар)."""
+    with ReadSessionLocal() as db:
+        pairs = db.execute(select(func.count()).select_from(RouteDistance)).scalar()
+        stations = db.execute(text(
+            "SELECT COUNT(*) FROM (SELECT from_station_id FROM track_segments "
+            "UNION SELECT to_station_id FROM track_segments)")).scalar()
+    return stations, pairs
@@ -0,0 +1,201 @@
+"""
+search.py
+
+Полнотекстовый поиск по грузам и поездам на SQLite FTS5.
+
+Для каждой таблицы заводится FTS5-таблица с внешним содержимым
+(content=..., текст не дублируется - хранится только индекс), а триггеры
+AFTER INSERT/UPDATE/DELETE держат индекс в синхронизации при любом способе
+записи: ORM, массовый импорт, ручной SQL. Токенизатор unicode61 приводит
+кириллицу и латиницу к нижнему регистру и убирает латинскую диакритику;
+«ё» он не трогает, поэтому и в индекс, и в запрос текст попадает уже с
+заменой ё -> е («Ёлки» находится по «елки»). Prefix-индексы ускоряют поиск
+по началу слова.
+
+Ранжирование - bm25 с весами колонок (тип груза и название поезда важнее
+описания операции); веса сохранены в конфигурации FTS-таблицы, поэтому
+ORDER BY rank выполняется внутри FTS5 без вычисления выражения на каждую строку.
+Для слов, которые встречаются в сотнях тысяч строк, ранжируются только
+rank_candidates самых новых совпадений - иначе время запроса росло бы
+вместе с таблицей.
+"""
+
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import joinedload
+
+from models import ReadSessionLocal, Train, Cargo
+from queries import Page
+
+
+def _fold_yo(expression):
+    """SQL-выражение: ё -> е (в индексе и в запросе буквы должны совпадать)."""
+    return f"replace(replace({expression}, 'ё', 'е'), 'Ё', 'Е')"
+
+
+class SearchIndex:
+    """Описание FTS-индекса одной таблицы."""
+
+    def __init__(self, model, pk, columns, weights):
+        self.model = model
+        self.table = model.__tablename__
+        self.fts_table = f"{self.table}_fts"
+        self.pk = pk
+        self.columns = columns
+        self.weights = weights
+
+    def indexed_values(self, prefix):
+        """Значения колонок для записи в индекс (prefix - new/old в триггере или пусто в SELECT)."""
+        return ", ".join(_fold_yo(f"{prefix}{c}") for c in self.columns)
+
+    def create_statement(self):
+        return (f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+                f"{', '.join(self.columns)}, content='{self.table}', content_rowid='{self.pk}', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')")
+
+    def triggers(self):
+        columns = ", ".join(self.columns)
+        new_values = self.indexed_values("new.")
+        old_values = self.indexed_values("old.")
+        changed = " OR ".join(f"old.{c} IS NOT new.{c}" for c in (self.pk,) + tuple(self.columns))
+        insert_new = (f"INSERT INTO {self.fts_table}(rowid, {columns}) "
+                      f"VALUES (new.{self.pk}, {new_values});")
+        delete_old = (f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {columns}) "
+                      f"VALUES ('delete', old.{self.pk}, {old_values});")
+        return [
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ai AFTER INSERT ON {self.table} "
+            f"BEGIN {insert_new} END",
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ad AFTER DELETE ON {self.table} "
+            f"BEGIN {delete_old} END",
+            # Только при фактическом изменении индексируемых колонок: массовые UPDATE,
+            # переписывающие те же значения (или только время/расстояние), индекс не трогают
+            f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_au AFTER UPDATE OF {columns}, {self.pk} "
+            f"ON {self.table} WHEN {changed} BEGIN {delete_old} {insert_new} END",
+        ]
+
+
+INDEXES = {
+    "cargos": SearchIndex(
+        Cargo, "cargo_id",
+        ("cargo_type", "current_station", "next_station", "status", "last_operation"),
+        weights=(4.0, 3.0, 1.0, 2.0, 1.0),
+    ),
+    "trains": SearchIndex(
+        Train, "train_id",
+        ("name", "departure_station", "arrival_station", "last_operation_station", "operation_desc"),
+        weights=(5.0, 2.0, 2.0, 2.0, 1.0),
+    ),
+}
+
+# Не больше стольких слов из запроса - длинная «простыня» не должна превращаться в тяжёлый MATCH
+MAX_QUERY_TERMS = 10
+
+
+def install(conn):
+    """
+    Создаёт FTS-таблицы, если их нет, и пересоздаёт триггеры (безопасно запускать повторно).
+    Только что созданный индекс заполняется из основной таблицы.
+    :return: число созданных индексов
+    """
+    created = 0
+    for index in INDEXES.values():
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": index.fts_table},
+        ).first()
+        conn.execute(text(index.create_statement()))
+        # Триггеры пересоздаются всегда - так migrate подхватывает изменения их определения
+        _drop_triggers(conn, index)
+        for statement in index.triggers():
+            conn.execute(text(statement))
+        if not exists:
+            weights = ", ".join(str(w) for w in index.weights)
+            conn.execute(text(f"INSERT INTO {index.fts_table}({index.fts_table}, rank) "
+                              f"VALUES ('rank', 'bm25({weights})')"))
+            _fill(conn, index)
+            created += 1
+    return created
+
+
+def _fill(conn, index):
+    # Встроенная команда 'rebuild' читала бы исходный текст без замены ё,
+    # поэтому индекс заполняется тем же выражением, что и в триггерах
+    conn.execute(text(f"INSERT INTO {index.fts_table}({index.fts_table}) VALUES ('delete-all')"))
+    conn.execute(text(
+        f"INSERT INTO {index.fts_table}(rowid, {', '.join(index.columns)}) "
+        f"SELECT {index.pk}, {index.indexed_values('')} FROM {index.table}"
+    ))
+
+
+def _drop_triggers(conn, index):
+    for suffix in ("ai", "ad", "au"):
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {index.fts_table}_{suffix}"))
+
+
+def drop(conn):
+    """Удаляет FTS-таблицы и триггеры (перед пересозданием схемы)."""
+    for index in INDEXES.values():
+        _drop_triggers(conn, index)
+        conn.execute(text(f"DROP TABLE IF EXISTS {index.fts_table}"))
+
+
+def rebuild(conn):
+    """Полностью перестраивает индексы из основных таблиц и оптимизирует их."""
+    for index in INDEXES.values():
+        _fill(conn, index)
+        conn.execute(text(f"INSERT INTO {index.fts_table}({index.fts_table}) VALUES ('optimize')"))
+
+
+def build_match_query(query):
+    """
+    Пользовательский ввод -> выражение FTS5 MATCH.
+    Каждое слово берётся в кавычки (синтаксис FTS5 из ввода не интерпретируется)
+    и ищется по префиксу; слова объединяются через AND. Однобуквенные слова
+    («в пути») ищутся точно: префикс из одной буквы совпал бы с огромной частью словаря.
+    "KZ-001 алм" -> '"KZ"* "001"* "алм"*'. Пустой ввод -> None.
+    """
+    query = (query or "").replace("ё", "е").replace("Ё", "Е")
+    terms = re.findall(r"\w+", query)[:MAX_QUERY_TERMS]
+    if not terms:
+        return None
+    return " ".join(f'"{term}"*' if len(term) > 1 else f'"{term}"' for term in terms)
+
+
+def search(kind, query, page=1, per_page=20, max_results=1000, rank_candidates=10000):
+    """
+    Ранжированный поиск. kind - "cargos" или "trains".
+    Возвращает Page, где next_cursor / prev_cursor - номера соседних страниц.
+    Глубина выдачи ограничена max_results: дальше релевантность уже ничего не значит,
+    а OFFSET растёт линейно.
+    """
+    index = INDEXES[kind]
+    match = build_match_query(query)
+    page = max(1, page)
+    offset = (page - 1) * per_page
+    if match is None or offset >= max_results:
+        return Page([])
+    limit = min(per_page + 1, max_results - offset)
+
+    with ReadSessionLocal() as db:
+        ids = db.execute(
+            # Внутренний запрос идёт по rowid от новых к старым (без сортировки),
+            # внешний ранжирует не больше rank_candidates найденных строк
+            text(f"SELECT rowid FROM ("
+                 f"SELECT rowid, rank FROM {index.fts_table} WHERE {index.fts_table} MATCH :match "
+                 f"ORDER BY rowid DESC LIMIT :candidates"
+                 f") ORDER BY rank LIMIT :limit OFFSET :offset"),
+            {"match": match, "candidates": rank_candidates, "limit": limit, "offset": offset},
+        ).scalars().all()
+        has_next = len(ids) > per_page and offset + per_page < max_results
+        ids = ids[:per_page]
+
+        rows = db.query(index.model)
+        if index.model is Cargo:
+            rows = rows.options(joinedload(Cargo.train))
+        pk = getattr(index.model, index.pk)
+        by_id = {getattr(obj, index.pk): obj for obj in rows.filter(pk.in_(ids))} if ids else {}
+
+    # Порядок - по релевантности из FTS (IN-запрос его не сохраняет)
+    items = [by_id[i] for i in ids if i in by_id]
+    return Page(items, next_cursor=page + 1 if has_next else None, prev_cursor=page - 1 if page > 1 else None)
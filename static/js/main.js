@@ -1,2 +1,94 @@
 // Здесь можно разместить дополнительную логику на JavaScript
 console.log("Hello from main.js");
+
+// Автодополнение поезда в форме груза: <input data-suggest-url list="..."> + <datalist>.
+// Подсказки запрашиваются с задержкой, чтобы не слать запрос на каждое нажатие.
+document.addEventListener("DOMContentLoaded", function () {
+  var input = document.querySelector("input[data-suggest-url]");
+  if (!input) return;
+  var datalist = document.getElementById(input.getAttribute("list"));
+  var timer = null;
+
+  input.addEventListener("input", function () {
+    clearTimeout(timer);
+    var query = input.value.trim();
+    if (!query) return;
+    timer = setTimeout(function () {
+      fetch(input.dataset.suggestUrl + "?q=" + encodeURIComponent(query))
+        .then(function (response) { return response.ok ? response.json() : []; })
+        .then(function (items) {
+          datalist.innerHTML = "";
+          items.forEach(function (item) {
+            var option = document.createElement("option");
+            option.value = item.id;
+            option.label = item.name;
+            datalist.appendChild(option);
+          });
+        })
+        .catch(function () { /* подсказки необязательны */ });
+    }, 200);
+  });
+});
+
+// Живые обновления на странице отслеживания (Server-Sent Events).
+// Сервер шлёт только изменившиеся поля; они подставляются в элементы [data-field].
+document.addEventListener("DOMContentLoaded", function () {
+  var card = document.querySelector("[data-stream-url]");
+  if (!card || !window.EventSource) return;
+  var status = card.querySelector("[data-stream-status]");
+
+  function format(value) {
+    if (value === null || value === undefined || value === "") return "Нет данных";
+    // Время приходит в ISO 8601 - показываем как фильтр dt: "ГГГГ-ММ-ДД ЧЧ:ММ"
+    if (typeof value === "string" && /^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}/.test(value)) {
+      return value.slice(0, 16).replace("T", " ");
+    }
+    return String(value);
+  }
+
+  var source = new EventSource(card.dataset.streamUrl);
+  source.addEventListener("snapshot", function () {
+    if (status) status.hidden = false;
+  });
+  source.addEventListener("update", function (event) {
+    var changes = JSON.parse(event.data).changes;
+    Object.keys(changes).forEach(function (field) {
+      var element = card.querySelector('[data-field="' + field + '"]');
+      if (!element) return;
+      element.textContent = format(changes[field]);
+      element.classList.add("text-warning");
+      setTimeout(function () { element.classList.remove("text-warning"); }, 2000);
+    });
+  });
+  source.addEventListener("deleted", function () {
+    source.close();
+    if (status) {
+      status.hidden = false;
+      status.textContent = "Объект удалён.";
+    }
+  });
+});
+
+// Массовые операции в списках админки: чекбокс [data-select-all="<id формы>"] выбирает
+// все строки страницы, а форма спрашивает подтверждение перед удалением.
+document.addEventListener("DOMContentLoaded", function () {
+  document.querySelectorAll("[data-select-all]").forEach(function (toggle) {
+    var formId = toggle.dataset.selectAll;
+    toggle.addEventListener("change", function () {
+      document.querySelectorAll('input[name="ids"][form="' + formId + '"]').forEach(function (box) {
+        box.checked = toggle.checked;
+      });
+    });
+  });
+  document.querySelectorAll("form[data-bulk-form]").forEach(function (form) {
+    form.addEventListener("submit", function (event) {
+      var selected = document.querySelectorAll('input[name="ids"][form="' + form.id + '"]:checked').length;
+      if (!selected) {
+        event.preventDefault();
+        alert("Выберите хотя бы одну запись.");
+      } else if (form.elements.action.value === "delete" && !confirm("Удалить выбранные записи (" + selected + ")?")) {
+        event.preventDefault();
+      }
+    });
+  });
+});
@@ -0,0 +1,205 @@
+"""
+summary.py
+
+Сводка для админ-панели: сколько грузов в каждом статусе, сколько грузов
+на каждом поезде, сколько поездов в пути, среднее расстояние до прибытия.
+
+Считать это запросами по cargos/trains - полное сканирование таблиц на
+каждое открытие панели. Вместо этого агрегаты хранятся готовыми в таблице
+summary_counters (см. models.py) и поддерживаются триггерами SQLite
+AFTER INSERT / UPDATE / DELETE: вклад старой строки вычитается, новой -
+прибавляется (UPSERT, нужен SQLite 3.24+). Триггер UPDATE у каждого
+агрегата свой и срабатывает только при изменении его колонок, поэтому
+телеметрия, меняющая лишь расстояние, не трогает счётчики статусов.
+
+Панель читает несколько строк по первичному ключу и «топ» поездов по индексу
+(metric, value) - время не зависит от размера таблиц. Если счётчики разошлись
+с данными (ручная правка с выключенными триггерами, восстановление из копии),
+их пересчитывает rebuild(): python db_setup.py rebuild-summary.
+"""
+
+from sqlalchemy import text, select
+
+from models import ReadSessionLocal, SummaryCounter, Train
+
+
+class Aggregate:
+    """
+    Один агрегат: для каждой строки таблицы - ключ и вклад (value, total).
+    Выражения записаны через {row} - new/old в триггере или имя таблицы в SELECT.
+    """
+
+    def __init__(self, metric, table, columns, key, value="1", total="0"):
+        self.metric = metric
+        self.table = table
+        self.columns = columns
+        self.key = key
+        self.value = value
+        self.total = total
+
+    def values(self, row):
+        return [expression.format(row=row) for expression in (self.key, self.value, self.total)]
+
+    def add(self, row, sign):
+        """Прибавить (sign="") или вычесть (sign="-") вклад строки row."""
+        key, value, total = self.values(row)
+        return (f"INSERT INTO summary_counters (metric, key, value, total) "
+                f"VALUES ('{self.metric}', {key}, {sign}({value}), {sign}({total})) "
+                f"ON CONFLICT (metric, key) DO UPDATE SET "
+                f"value = value + excluded.value, total = total + excluded.total;")
+
+    def prune(self, row):
+        """Обнулившийся ключ удаляется (удалённый поезд, статус, которого больше нет)."""
+        key = self.values(row)[0]
+        return (f"DELETE FROM summary_counters WHERE metric = '{self.metric}' AND key = {key} "
+                f"AND value = 0 AND total = 0;")
+
+    def trigger_names(self):
+        return [f"summary_{self.metric}_{suffix}" for suffix in ("ai", "ad", "au")]
+
+    def triggers(self):
+        ai, ad, au = self.trigger_names()
+        changed = " OR ".join(f"old.{c} IS NOT new.{c}" for c in self.columns)
+        return [
+            f"CREATE TRIGGER {ai} AFTER INSERT ON {self.table} BEGIN {self.add('new', '')} END",
+            f"CREATE TRIGGER {ad} AFTER DELETE ON {self.table} "
+            f"BEGIN {self.add('old', '-')} {self.prune('old')} END",
+            f"CREATE TRIGGER {au} AFTER UPDATE OF {', '.join(self.columns)} ON {self.table} WHEN {changed} "
+            f"BEGIN {self.add('old', '-')} {self.add('new', '')} {self.prune('old')} END",
+        ]
+
+    def select(self):
+        key, value, total = self.values(self.table)
+        return (f"SELECT '{self.metric}', {key}, SUM({value}), SUM({total}) "
+                f"FROM {self.table} GROUP BY {key}")
+
+
+# Состояние поезда по расстоянию до прибытия
+TRAIN_STATE_NAMES = {"en_route": "В пути", "arrived": "Прибыл", "unknown": "Нет данных"}
+
+AGGREGATES = {
+    # Грузы по статусам ('' - без статуса)
+    "cargo_status": Aggregate(
+        "cargo_status", "cargos", ("status",),
+        key="COALESCE({row}.status, '')",
+    ),
+    # Грузы по поездам ('' - без поезда)
+    "cargo_train": Aggregate(
+        "cargo_train", "cargos", ("train_id",),
+        key="COALESCE(CAST({row}.train_id AS TEXT), '')",
+    ),
+    # Грузы с известным расстоянием и сумма расстояний - для среднего
+    "cargo_distance": Aggregate(
+        "cargo_distance", "cargos", ("distance_to_arrival",),
+        key="''",
+        value="{row}.distance_to_arrival IS NOT NULL",
+        total="COALESCE({row}.distance_to_arrival, 0)",
+    ),
+    # Поезда по состоянию и сумма расстояний (у «Нет данных» она всегда 0)
+    "train_state": Aggregate(
+        "train_state", "trains", ("distance_to_arrival",),
+        key="CASE WHEN {row}.distance_to_arrival IS NULL THEN 'unknown' "
+            "WHEN {row}.distance_to_arrival > 0 THEN 'en_route' ELSE 'arrived' END",
+        total="COALESCE({row}.distance_to_arrival, 0)",
+    ),
+}
+
+
+def drop_triggers(conn):
+    for aggregate in AGGREGATES.values():
+        for name in aggregate.trigger_names():
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+
+def install(conn):
+    """
+    Пересоздаёт триггеры (безопасно запускать повторно); пустую сводку
+    заполняет из таблиц. :return: True, если сводка была заполнена
+    """
+    drop_triggers(conn)
+    for aggregate in AGGREGATES.values():
+        for statement in aggregate.triggers():
+            conn.execute(text(statement))
+    if conn.execute(text("SELECT 1 FROM summary_counters LIMIT 1")).first() is None:
+        rebuild(conn)
+        return True
+    return False
+
+
+def rebuild(conn):
+    """
+    Пересчитывает сводку по таблицам (в транзакции conn - триггеры других
+    соединений в это время ждут блокировки записи).
+    :return: число исправленных строк сводки (0 - расхождений не было)
+    """
+    stored = {(row.metric, row.key): (row.value, row.total)
+              for row in conn.execute(select(SummaryCounter.__table__))}
+    actual = {}
+    for aggregate in AGGREGATES.values():
+        for metric, key, value, total in conn.execute(text(aggregate.select())):
+            if value or total:
+                actual[(metric, key)] = (value, total)
+    drift = sum(1 for k in stored.keys() | actual.keys() if stored.get(k) != actual.get(k))
+    conn.execute(text("DELETE FROM summary_counters"))
+    if actual:
+        conn.execute(SummaryCounter.__table__.insert(), [
+            {"metric": metric, "key": key, "value": value, "total": total}
+            for (metric, key), (value, total) in actual.items()
+        ])
+    return drift
+
+
+def _average(value, total):
+    return round(total / value, 1) if value else None
+
+
+def dashboard(top_trains=10):
+    """
+    Данные для админ-панели. Читаются только строки малых метрик по первичному
+    ключу и top_trains поездов с наибольшим числом грузов по индексу.
+    """
+    counters = SummaryCounter.__table__.c
+    with ReadSessionLocal() as db:
+        rows = db.execute(
+            select(counters.metric, counters.key, counters.value, counters.total)
+            .where(counters.metric.in_(("cargo_status", "cargo_distance", "train_state")))
+        ).all()
+        unassigned = db.execute(
+            select(counters.value).where(counters.metric == "cargo_train", counters.key == "")
+        ).scalar() or 0
+        top = db.execute(
+            select(counters.key, counters.value)
+            .where(counters.metric == "cargo_train", counters.key != "")
+            .order_by(counters.value.desc()).limit(top_trains)
+        ).all()
+        names = dict(db.execute(
+            select(Train.train_id, Train.name).where(Train.train_id.in_([int(row.key) for row in top]))
+        ).all()) if top else {}
+
+    by_metric = {}
+    for row in rows:
+        by_metric.setdefault(row.metric, {})[row.key] = (row.value, row.total)
+
+    # None - грузы без статуса
+    statuses = sorted(((key or None, value) for key, (value, _) in by_metric.get("cargo_status", {}).items()),
+                      key=lambda item: -item[1])
+    cargo_count = sum(value for _, value in statuses)
+    distance_count, distance_total = by_metric.get("cargo_distance", {}).get("", (0, 0))
+
+    train_states = by_metric.get("train_state", {})
+    train_count = sum(value for value, _ in train_states.values())
+    known_trains = sum(value for key, (value, _) in train_states.items() if key != "unknown")
+    train_distance = sum(total for _, total in train_states.values())
+
+    return {
+        "cargo_count": cargo_count,
+        "cargo_statuses": statuses,
+        "cargo_avg_distance": _average(distance_count, distance_total),
+        "cargos_unassigned": unassigned,
+        "cargos_per_train": round((cargo_count - unassigned) / train_count, 1) if train_count else None,
+        "top_trains": [(int(row.key), names.get(int(row.key), "?"), row.value) for row in top],
+        "train_count": train_count,
+        "train_states": [(TRAIN_STATE_NAMES[key], train_states.get(key, (0, 0))[0]) for key in TRAIN_STATE_NAMES],
+        "trains_en_route": train_states.get("en_route", (0, 0))[0],
+        "train_avg_distance": _average(known_trains, train_distance),
+    }
@@ -0,0 +1,203 @@
+"""
+telemetry.py
+
+Пакетный приём событий местоположения поездов.
+
+Событие: {"train_id": 5, "station": "Астана", "time": "2026-10-18T10:00:00",
+          "distance_to_arrival": 120, "operation_desc": "Прибытие"}
+(вместо station / time можно писать имена колонок last_operation_station /
+last_operation_time).
+
+Пакет обрабатывается так:
+1. события проверяются и схлопываются по поезду - остаётся самое позднее;
+2. одним SELECT читается текущее время последней операции этих поездов:
+   неизвестные поезда и события старее уже записанного отбрасываются;
+3. в одной транзакции - UPDATE поездов (один подготовленный запрос, executemany;
+   поля, которых нет в событии, не затираются) и один UPDATE ... FROM, переносящий
+   новое местоположение на все грузы обновлённых поездов (кроме грузов в «конечных»
+   статусах); расстояние грузов пересчитывают триггеры сети станций;
+4. после commit сбрасывается кэш отслеживания и уходят живые обновления.
+"""
+
+import datetime
+
+from sqlalchemy import select, update, bindparam, func
+
+import live
+import metrics
+import tracking
+from models import engine, Train, Cargo, parse_datetime
+
+EVENTS_TOTAL = metrics.registry.register(metrics.Counter(
+    "telemetry_events_total", "События телеметрии по результату обработки", ("result",)))
+
+_FIELD_ALIASES = {
+    "station": "last_operation_station",
+    "time": "last_operation_time",
+}
+
+
+class TelemetryResult:
+    def __init__(self):
+        self.received = 0
+        self.rejected = []        # [{"index": i, "error": "..."}]
+        self.coalesced = 0        # событий, перекрытых более поздним событием того же поезда
+        self.stale = 0            # событий старее уже записанного
+        self.unknown_trains = []
+        self.trains_updated = 0
+        self.cargos_updated = 0
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "trains_updated": self.trains_updated,
+            "cargos_updated": self.cargos_updated,
+            "coalesced": self.coalesced,
+            "stale": self.stale,
+            "unknown_trains": self.unknown_trains,
+            "rejected": self.rejected,
+        }
+
+
+def _to_naive_local(value):
+    # Время в БД хранится «наивным» локальным; время с часовым поясом приводим к нему
+    if value.tzinfo is not None:
+        value = value.astimezone().replace(tzinfo=None)
+    return value
+
+
+def parse_event(raw):
+    """dict события -> нормализованный dict с колонками Train; ValueError при ошибке."""
+    if not isinstance(raw, dict):
+        raise ValueError("ожидался JSON-объект")
+    raw = {_FIELD_ALIASES.get(key, key): value for key, value in raw.items()}
+
+    train_id = raw.get("train_id")
+    if isinstance(train_id, bool) or not isinstance(train_id, (int, str)):
+        raise ValueError("train_id обязателен")
+    try:
+        event = {"train_id": int(train_id)}
+    except ValueError:
+        raise ValueError("train_id должен быть числом")
+
+    station = raw.get("last_operation_station")
+    if not isinstance(station, str) or not station.strip():
+        raise ValueError("station обязательна")
+    event["last_operation_station"] = station.strip()[:100]
+
+    when = raw.get("last_operation_time")
+    event["last_operation_time"] = (
+        _to_naive_local(parse_datetime(when)) if when else datetime.datetime.now().replace(microsecond=0)
+    )
+
+    distance = raw.get("distance_to_arrival")
+    if distance is not None:
+        try:
+            if isinstance(distance, bool):
+                raise ValueError()
+            distance = int(distance)
+        except (TypeError, ValueError):
+            raise ValueError("distance_to_arrival должно быть числом")
+        if distance < 0:
+            raise ValueError("distance_to_arrival не может быть отрицательным")
+    event["distance_to_arrival"] = distance
+
+    desc = raw.get("operation_desc")
+    event["operation_desc"] = str(desc)[:255] if desc is not None else None
+    return event
+
+
+def coalesce(events):
+    """Оставляет по одному событию на поезд - с наибольшим временем (при равенстве - последнее в пакете)."""
+    latest = {}
+    for event in events:
+        current = latest.get(event["train_id"])
+        if current is None or event["last_operation_time"] >= current["last_operation_time"]:
+            latest[event["train_id"]] = event
+    return latest
+
+
+_update_train = (
+    update(Train.__table__)
+    .where(Train.__table__.c.train_id == bindparam("_train_id"))
+    .values(
+        last_operation_station=bindparam("last_operation_station"),
+        last_operation_time=bindparam("last_operation_time"),
+        # Поля, которых нет в событии (None), сохраняют записанное значение
+        distance_to_arrival=func.coalesce(bindparam("distance_to_arrival"), Train.__table__.c.distance_to_arrival),
+        operation_desc=func.coalesce(bindparam("operation_desc"), Train.__table__.c.operation_desc),
+    )
+)
+
+
+def _cascade_to_cargos(train_ids, frozen_statuses):
+    """
+    Один UPDATE ... FROM trains: грузы получают станцию, время и операцию своего поезда.
+    Расстояние не копируется: у груза оно считается до его next_station, а не до конечной
+    станции поезда, - его пересчитывают триггеры сети станций (routing.py) по новой станции.
+    """
+    trains = Train.__table__
+    cargos = Cargo.__table__
+    stmt = (
+        update(cargos)
+        .where(cargos.c.train_id == trains.c.train_id, trains.c.train_id.in_(train_ids))
+        .values(
+            current_station=trains.c.last_operation_station,
+            last_stop_time=trains.c.last_operation_time,
+            last_operation=trains.c.operation_desc,
+        )
+    )
+    if frozen_statuses:
+        stmt = stmt.where(cargos.c.status.is_(None) | cargos.c.status.not_in(frozen_statuses))
+    return stmt
+
+
+def ingest(raw_events, frozen_statuses=()):
+    """Обрабатывает пакет событий (список dict). Возвращает TelemetryResult."""
+    result = TelemetryResult()
+    result.received = len(raw_events)
+    events = []
+    for index, raw in enumerate(raw_events):
+        try:
+            events.append(parse_event(raw))
+        except (TypeError, ValueError) as e:
+            result.rejected.append({"index": index, "error": str(e)})
+    EVENTS_TOTAL.inc("rejected", amount=len(result.rejected))
+
+    latest = coalesce(events)
+    result.coalesced = len(events) - len(latest)
+    EVENTS_TOTAL.inc("coalesced", amount=result.coalesced)
+    if not latest:
+        return result
+
+    with engine.begin() as conn:
+        current = dict(conn.execute(
+            select(Train.train_id, Train.last_operation_time).where(Train.train_id.in_(list(latest)))
+        ).all())
+        fresh = []
+        for train_id, event in latest.items():
+            if train_id not in current:
+                result.unknown_trains.append(train_id)
+            elif current[train_id] is not None and event["last_operation_time"] < current[train_id]:
+                result.stale += 1
+            else:
+                fresh.append(event)
+
+        if fresh:
+            conn.execute(_update_train, [
+                {**{k: v for k, v in e.items() if k != "train_id"}, "_train_id": e["train_id"]} for e in fresh
+            ])
+            result.trains_updated = len(fresh)
+            result.cargos_updated = conn.execute(
+                _cascade_to_cargos([e["train_id"] for e in fresh], frozen_statuses)
+            ).rowcount
+
+    EVENTS_TOTAL.inc("unknown_train", amount=len(result.unknown_trains))
+    EVENTS_TOTAL.inc("stale", amount=result.stale)
+    EVENTS_TOTAL.inc("applied", amount=result.trains_updated)
+
+    updated_ids = [e["train_id"] for e in fresh]
+    for train_id in updated_ids:
+        tracking.invalidate_train(train_id) # вместе с поездом - записи его грузов
+    live.notify_trains(updated_ids)
+    return result
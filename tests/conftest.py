@@ -0,0 +1,36 @@
+"""
+Общие фикстуры тестов.
+
+Окружение задаётся до импорта модулей приложения: Config читает его при
+импорте, а engine создаётся вместе с models. Каждый тест получает свежую
+временную БД со всеми триггерами (поиск, сводка, сеть станций, журнал
+перемещений) - так же, как после python db_setup.py.
+"""
+
+import os
+import sys
+import tempfile
+
+_TMP_DIR = tempfile.mkdtemp(prefix="cargo-tracking-tests-")
+os.environ["DB_PATH"] = os.path.join(_TMP_DIR, "test.db")
+os.environ["LOG_FILE"] = ""
+os.environ["CONTACT_JOURNAL_DIR"] = os.path.join(_TMP_DIR, "contact_journal")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import db_setup
+import models
+
+
+@pytest.fixture
+def engine():
+    """Пересозданная БД (с дефолтными поездом, грузом и админом); возвращает основной engine."""
+    db_setup.init_db(drop_all=True)
+    return models.engine
+
+
+@pytest.fixture
+def session(engine):
+    with models.SessionLocal() as db:
+        yield db
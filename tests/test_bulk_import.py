@@ -0,0 +1,56 @@
+import io
+
+import pytest
+
+import bulk_import
+from models import Cargo, Train
+
+
+@pytest.fixture
+def app_context(engine):
+    # Формы проверки строк - FlaskForm: нужен контекст приложения
+    from app import app
+    with app.test_request_context():
+        yield
+
+
+def test_csv_insert_and_upsert_in_batches(session, app_context):
+    stream = io.StringIO(
+        "train_id,name,last_operation_station,departure_time\n"
+        ",KZ-100,Павлодар,2026-10-18 08:00\n"
+        ",KZ-101,Семей,\n"
+        "1,KZ-001-обновлён,Астана,\n"
+    )
+    result = bulk_import.import_stream(stream, "trains", "csv", batch_size=2)
+
+    assert (result.total, result.imported, result.failed) == (3, 3, 0)
+    names = dict(session.query(Train.train_id, Train.name))
+    assert names[1] == "KZ-001-обновлён"
+    assert {"KZ-100", "KZ-101"} <= set(names.values())
+
+
+def test_jsonl_reports_bad_lines_and_unknown_trains(session, app_context):
+    stream = io.StringIO(
+        '{"cargo_type": "уголь", "train_id": 1}\n'
+        "не json\n"
+        '["список"]\n'
+        '{"train_id": 1}\n'
+        '{"cargo_type": "руда", "train_id": 404}\n'
+        "\n"
+        '{"cargo_type": "лес"}\n'
+    )
+    reported = []
+    result = bulk_import.import_stream(stream, "cargos", "jsonl",
+                                       on_error=lambda line, errors: reported.append(line))
+
+    assert (result.total, result.imported, result.failed) == (6, 2, 4)
+    assert reported == [2, 3, 4, 5]
+    assert "train_id" in dict(result.errors)[5]
+    types = {c.cargo_type for c in session.query(Cargo)}
+    assert {"уголь", "лес"} <= types and "руда" not in types
+
+
+def test_detect_format():
+    assert bulk_import.detect_format("trains.CSV") == "csv"
+    assert bulk_import.detect_format("cargos.ndjson") == "jsonl"
+    assert bulk_import.detect_format("cargos.xlsx") is None
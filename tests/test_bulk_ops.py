@@ -0,0 +1,58 @@
+import pytest
+
+import bulk_ops
+import tracking
+from models import Cargo, Train
+
+
+def _cargos(session, count, **fields):
+    cargos = [Cargo(cargo_type=f"b{i}", **fields) for i in range(count)]
+    session.add_all(cargos)
+    session.commit()
+    return [c.cargo_id for c in cargos]
+
+
+def test_cargo_actions_apply_to_every_batch(session):
+    ids = _cargos(session, 7, status="Погрузка", train_id=1)
+    train = Train(name="B-2")
+    session.add(train)
+    session.commit()
+
+    assert bulk_ops.run("cargos", "set_status", ids, value=" В пути ", batch_size=3) == 7
+    assert bulk_ops.run("cargos", "reassign_train", ids[:4], value=str(train.train_id), batch_size=3) == 4
+    assert bulk_ops.run("cargos", "move_station", ids, value="Семей", batch_size=3) == 7
+    rows = session.query(Cargo.status, Cargo.train_id, Cargo.current_station).filter(Cargo.cargo_id.in_(ids)).all()
+    assert sorted(rows) == sorted([("В пути", train.train_id, "Семей")] * 4 + [("В пути", 1, "Семей")] * 3)
+
+    assert bulk_ops.run("cargos", "delete", ids, batch_size=3) == 7
+    assert session.query(Cargo).filter(Cargo.cargo_id.in_(ids)).count() == 0
+
+
+def test_train_delete_removes_its_cargos(session):
+    train = Train(name="B-3")
+    session.add(train)
+    session.commit()
+    ids = _cargos(session, 3, train_id=train.train_id)
+    assert bulk_ops.run("trains", "delete", [train.train_id]) == 1
+    assert session.query(Cargo).filter(Cargo.cargo_id.in_(ids)).count() == 0
+
+
+def test_invalid_operations_change_nothing(session):
+    ids = _cargos(session, 2, status="Погрузка")
+    with pytest.raises(bulk_ops.BulkError):
+        bulk_ops.run("cargos", "set_status", ids, value="  ")
+    with pytest.raises(bulk_ops.BulkError):
+        bulk_ops.run("cargos", "reassign_train", ids, value="404")
+    with pytest.raises(bulk_ops.BulkError):
+        bulk_ops.run("cargos", "explode", ids)
+    with pytest.raises(bulk_ops.BulkError):
+        bulk_ops.run("trains", "delete", [])
+    assert {c.status for c in session.query(Cargo).filter(Cargo.cargo_id.in_(ids))} == {"Погрузка"}
+
+
+def test_tracking_cache_is_invalidated(session):
+    tracking.tracking_cache.clear()
+    ids = _cargos(session, 1, status="Погрузка")
+    assert tracking.lookup("cargo", ids[0])["status"] == "Погрузка"
+    bulk_ops.run("cargos", "set_status", ids, value="В пути")
+    assert tracking.lookup("cargo", ids[0])["status"] == "В пути"
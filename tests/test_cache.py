@@ -0,0 +1,61 @@
+import tracking
+from cache import TTLCache
+from models import Cargo, Train
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_ttl_expiry_and_lru_eviction():
+    clock = FakeClock()
+    cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1   # "a" становится самой свежей
+    cache.set("c", 3)            # вытесняется "b"
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+    clock.now = 10
+    assert cache.get("a") is None
+    assert cache.stats() == {"size": 1, "maxsize": 2, "hits": 3, "misses": 2, "evictions": 1}
+
+
+def test_invalidate_tag_removes_only_tagged_entries():
+    cache = TTLCache()
+    cache.set("train", "t", tags=[("train", 1)])
+    cache.set("cargo", "c", tags=[("train", 1)])
+    cache.set("other", "o", tags=[("train", 2)])
+    assert cache.invalidate_tag(("train", 1)) == 2
+    assert cache.get("train") is None and cache.get("cargo") is None
+    assert cache.get("other") == "o"
+    assert cache.invalidate_tag(("train", 1)) == 0
+
+
+def test_tracking_read_through_and_train_invalidation(session):
+    tracking.tracking_cache.clear()
+    train = Train(name="C-1")
+    cargo = Cargo(cargo_type="уголь", train=train)
+    session.add(cargo)
+    session.commit()
+
+    assert tracking.lookup("cargo", cargo.cargo_id)["train"]["name"] == "C-1"
+    train.name = "C-2"
+    session.commit()
+    # Без инвалидации - значение из кэша
+    assert tracking.lookup("cargo", cargo.cargo_id)["train"]["name"] == "C-1"
+    tracking.invalidate_train(train.train_id)
+    assert tracking.lookup("cargo", cargo.cargo_id)["train"]["name"] == "C-2"
+
+
+def test_tracking_does_not_cache_missing_objects(session):
+    tracking.tracking_cache.clear()
+    assert tracking.lookup_many("cargo", [999]) == {999: None}
+    session.add(Cargo(cargo_id=999, cargo_type="новый"))
+    session.commit()
+    assert tracking.lookup("cargo", 999)["cargo_type"] == "новый"
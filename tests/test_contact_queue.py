@@ -0,0 +1,85 @@
+import json
+import os
+import subprocess
+import sys
+
+from sqlalchemy import select, func
+
+from contact_queue import ContactWriter
+from models import Contact
+
+
+def _row(i):
+    return {"name": f"Имя {i}", "email": f"u{i}@example.com", "message": f"сообщение {i}",
+            "created_at": "2026-10-18T10:00:00"}
+
+
+def _write_journal(directory, pid, rows, suffix=""):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"contacts-{pid}.jsonl{suffix}")
+    with open(path, "a", encoding="utf-8") as f:
+        f.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+    return path
+
+
+def _dead_pid():
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+def _messages(session):
+    return sorted(session.execute(select(Contact.message)).scalars())
+
+
+def test_replay_moves_own_journal_once(session, tmp_path):
+    writer = ContactWriter(journal_dir=str(tmp_path))
+    writer._journal([_row(1), _row(2)])
+
+    assert writer.replay_journals() == 2
+    assert os.listdir(tmp_path) == []
+    # Повторная переигровка не дублирует сообщения
+    assert writer.replay_journals() == 0
+    assert _messages(session) == ["сообщение 1", "сообщение 2"]
+
+
+def test_replay_skips_torn_line(session, tmp_path):
+    path = _write_journal(str(tmp_path), os.getpid(), [_row(1)])
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"name": "оборван')
+    writer = ContactWriter(journal_dir=str(tmp_path))
+
+    assert writer.replay_journals() == 1
+    assert _messages(session) == ["сообщение 1"]
+
+
+def test_replay_claims_only_journals_of_dead_processes(session, tmp_path):
+    dead, alive = _dead_pid(), os.getppid()
+    _write_journal(str(tmp_path), dead, [_row(1)])
+    _write_journal(str(tmp_path), alive, [_row(2)])
+    # Файл, который умерший процесс забрал, но не успел переиграть
+    _write_journal(str(tmp_path), alive, [_row(3)], suffix=f".{dead}.replay")
+    writer = ContactWriter(journal_dir=str(tmp_path))
+
+    assert writer.replay_journals() == 2
+    assert os.listdir(tmp_path) == [f"contacts-{alive}.jsonl"]
+    assert _messages(session) == ["сообщение 1", "сообщение 3"]
+
+
+def test_failed_replay_keeps_claimed_file_for_retry(session, tmp_path, monkeypatch):
+    writer = ContactWriter(journal_dir=str(tmp_path))
+    writer._journal([_row(1), _row(2)])
+
+    def unavailable(rows):
+        raise RuntimeError("database is locked")
+    monkeypatch.setattr(writer, "_insert", unavailable)
+    assert writer.replay_journals() == 0
+    assert os.listdir(tmp_path) == [f"contacts-{os.getpid()}.jsonl.{os.getpid()}.replay"]
+
+    # Новые сообщения пишутся в свежий журнал; он ждёт, пока переиграется уже забранный файл
+    writer._journal([_row(3)])
+    monkeypatch.undo()
+    assert writer.replay_journals() == 2
+    assert writer.replay_journals() == 1
+    assert os.listdir(tmp_path) == []
+    assert session.execute(select(func.count()).select_from(Contact)).scalar() == 3
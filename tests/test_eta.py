@@ -0,0 +1,86 @@
+import datetime
+
+from sqlalchemy import insert
+
+import eta
+import history
+import routing
+from models import Cargo, Train, MovementEvent
+
+LINE = ["S0", "S1", "S2", "S3"]
+START = datetime.datetime(2026, 10, 1, 8, 0)
+NOW = datetime.datetime(2026, 10, 2, 8, 0)
+
+
+def _line_network(engine):
+    with engine.begin() as conn:
+        for a, b in zip(LINE, LINE[1:]):
+            routing.set_segment(conn, a, b, 100)
+
+
+def _run_trains(session, count=5):
+    """Поезда S0 -> S3: перегон 100 км каждые 2 часа (50 км/ч)."""
+    trains = [Train(name=f"E-{i}", last_operation_station="S0", arrival_station="S3",
+                    last_operation_time=START + datetime.timedelta(minutes=i)) for i in range(count)]
+    session.add_all(trains)
+    session.commit()
+    for hop, station in enumerate(LINE[1:], 1):
+        for i, train in enumerate(trains):
+            train.last_operation_station = station
+            train.last_operation_time = START + datetime.timedelta(hours=2 * hop, minutes=i)
+        session.commit()
+    return trains
+
+
+def _model(engine):
+    with engine.connect() as conn:
+        return eta.SpeedModel.load(conn, since=history.to_epoch(NOW) - 30 * 86400, min_samples=3,
+                                   min_speed=5, max_speed=120, default_speed=42)
+
+
+def test_speed_model_from_routed_history(session, engine):
+    _line_network(engine)
+    _run_trains(session)
+    model = _model(engine)
+    assert len(model.segment_keys) == 3
+    assert model.segment_speeds.tolist() == [50.0, 50.0, 50.0]
+    assert model.fleet_speed == 50.0
+
+
+def test_speed_model_ignores_same_station_distance_rewrites(engine):
+    # Журнал до исправления триггеров: на каждой станции сначала старое расстояние,
+    # затем пересчитанное по сети - с тем же временем
+    rows = []
+    for train_id in range(100, 105):
+        for hop in range(4):
+            ts = history.to_epoch(START) + hop * 7200
+            stale = 300 - (hop - 1) * 100 if hop else 300
+            for seq, distance in enumerate((stale, 300 - hop * 100)):
+                rows.append({"entity_type": MovementEvent.ENTITY_TRAIN, "entity_id": train_id, "ts": ts,
+                             "seq": seq, "station_id": hop + 1, "distance_to_arrival": distance})
+    with engine.begin() as conn:
+        conn.execute(insert(MovementEvent.__table__), rows)
+    model = _model(engine)
+    assert model.segment_speeds.tolist() == [50.0, 50.0, 50.0]
+
+
+def test_run_writes_eta_from_segment_speeds(session, engine):
+    _line_network(engine)
+    _run_trains(session)
+    moving = Cargo(cargo_type="руда", status="В пути", current_station="S1", next_station="S3",
+                   last_stop_time=datetime.datetime(2026, 10, 2, 6, 0, 30))
+    delivered = Cargo(cargo_type="лес", status="Доставлен", current_station="S3", next_station="S3",
+                      eta=datetime.datetime(2026, 10, 1, 0, 0))
+    session.add_all([moving, delivered])
+    session.commit()
+
+    result = eta.run(now=NOW)
+    session.expire_all()
+    # 200 км по сети со скоростью отправления с S1 (50 км/ч), с округлением вверх до минуты
+    assert moving.distance_to_arrival == 200
+    assert moving.eta == datetime.datetime(2026, 10, 2, 10, 1)
+    assert delivered.eta is None
+    assert result.cleared == 1
+
+    # Повторный запуск ничего не переписывает
+    assert eta.run(now=NOW).updated == 0
@@ -0,0 +1,49 @@
+import csv
+import datetime
+import io
+import json
+
+import pytest
+
+import export
+from models import Cargo
+
+
+def _add(session):
+    session.add_all(Cargo(cargo_type=f"e{i}", status="В пути" if i % 2 else "Доставлен",
+                          last_stop_time=datetime.datetime(2026, 10, 18, 8, i)) for i in range(5))
+    session.commit()
+
+
+def test_csv_streams_in_chunks(session):
+    _add(session)
+    chunks = list(export.generate("cargos", "csv", {}, chunk_size=2))
+    assert len(chunks) == 3 # 6 строк (с дефолтным грузом) по 2
+    rows = list(csv.DictReader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert [r["cargo_type"] for r in rows[1:]] == ["e0", "e1", "e2", "e3", "e4"]
+    assert rows[1]["last_stop_time"] == "2026-10-18 08:00:00"
+
+
+def test_jsonl_applies_filters(session):
+    _add(session)
+    data = b"".join(export.generate("cargos", "jsonl", {"status": "В пути"}, chunk_size=2)).decode("utf-8")
+    rows = [json.loads(line) for line in data.splitlines()]
+    assert [r["cargo_type"] for r in rows] == ["Продовольственные товары", "e1", "e3"]
+
+
+def test_empty_csv_has_header_only(session):
+    data = b"".join(export.generate("trains", "csv", {"name": "нет такого"})).decode("utf-8")
+    assert data.splitlines() == [",".join(c.name for c in export.columns("trains"))]
+
+
+def test_parquet_round_trip(session):
+    pq = pytest.importorskip("pyarrow.parquet")
+    _add(session)
+    table = pq.read_table(io.BytesIO(b"".join(export.generate("cargos", "parquet", {}, chunk_size=2))))
+    assert table.num_rows == 6
+    assert table.column("cargo_type").to_pylist()[1:] == ["e0", "e1", "e2", "e3", "e4"]
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        export.generate("cargos", "xml", {})
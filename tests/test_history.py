@@ -0,0 +1,82 @@
+import datetime
+
+from sqlalchemy import select, insert, text
+
+import db_setup
+import history
+from models import Cargo, MovementEvent
+
+NOW = datetime.datetime(2026, 6, 1, 12, 0)
+EVENTS = MovementEvent.__table__
+
+
+def _ts(days_ago, minutes=0):
+    return history.to_epoch(NOW - datetime.timedelta(days=days_ago) + datetime.timedelta(minutes=minutes))
+
+
+def _add(engine, entity_id, rows):
+    """rows: (ts, station_id, status)"""
+    with engine.begin() as conn:
+        conn.execute(insert(EVENTS), [
+            {"entity_type": MovementEvent.ENTITY_CARGO, "entity_id": entity_id, "ts": ts, "seq": 0,
+             "station_id": station_id, "status": status}
+            for ts, station_id, status in rows
+        ])
+
+
+def _stored(engine, entity_id):
+    with engine.connect() as conn:
+        return conn.execute(
+            select(EVENTS.c.ts, EVENTS.c.station_id, EVENTS.c.status, EVENTS.c.merged)
+            .where(EVENTS.c.entity_type == MovementEvent.ENTITY_CARGO, EVENTS.c.entity_id == entity_id)
+            .order_by(EVENTS.c.ts, EVENTS.c.seq)
+        ).all()
+
+
+def test_compact_keeps_run_edges_and_counts_merged(engine):
+    old = [(_ts(200, m), 1, "В пути") for m in range(5)]          # серия из 5 -> первое и последнее
+    old += [(_ts(200, 10 + m), 2, "В пути") for m in range(3)]    # серия из 3 -> первое и последнее
+    old += [(_ts(200, 20), 1, "В пути")]                          # снова станция 1 - новая серия
+    old += [(_ts(200, 30 + m), 1, "Доставлен") for m in range(2)] # другой статус, серия из 2
+    recent = [(_ts(10, m), 3, "В пути") for m in range(4)]         # моложе raw_days - не трогаем
+    _add(engine, 900, old + recent)
+
+    stats = history.compact(engine, raw_days=90, retention_days=1825, now=NOW)
+
+    assert stats == {"merged": 4, "expired": 0}
+    assert _stored(engine, 900) == [
+        (_ts(200, 0), 1, "В пути", 4), (_ts(200, 4), 1, "В пути", 1),
+        (_ts(200, 10), 2, "В пути", 2), (_ts(200, 12), 2, "В пути", 1),
+        (_ts(200, 20), 1, "В пути", 1),
+        (_ts(200, 30), 1, "Доставлен", 1), (_ts(200, 31), 1, "Доставлен", 1),
+    ] + [(ts, 3, "В пути", 1) for ts, _, _ in recent]
+
+    # Повторный запуск ничего не меняет
+    assert history.compact(engine, raw_days=90, retention_days=1825, now=NOW) == {"merged": 0, "expired": 0}
+
+
+def test_compact_expires_beyond_retention_across_batches(engine):
+    for entity_id in range(1000, 1005):
+        _add(engine, entity_id, [(_ts(2000, m), 1, "В пути") for m in range(3)]
+             + [(_ts(100, m), 1, "В пути") for m in range(4)])
+
+    stats = history.compact(engine, raw_days=90, retention_days=1825, batch_size=2, now=NOW)
+
+    assert stats == {"expired": 15, "merged": 10}
+    for entity_id in range(1000, 1005):
+        assert [row.merged for row in _stored(engine, entity_id)] == [3, 1]
+
+
+def test_datetime_backfill_is_not_a_movement(session, engine):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cargos SET last_stop_time = '11.04.2025 09:00' WHERE cargo_id = 1"))
+    events = len(_stored(engine, 1))
+
+    assert db_setup.backfill_datetimes() == 1
+    assert len(_stored(engine, 1)) == events
+    assert session.get(Cargo, 1).last_stop_time == datetime.datetime(2025, 4, 11, 9, 0)
+
+    # Журнал снова включён
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE cargos SET current_station = 'Астана' WHERE cargo_id = 1"))
+    assert len(_stored(engine, 1)) == events + 1
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+import live
+
+
+@pytest.fixture
+def admin(engine):
+    from app import app
+    csrf = app.config.get("WTF_CSRF_ENABLED", True)
+    app.config["WTF_CSRF_ENABLED"] = False
+    try:
+        with app.test_client() as client:
+            response = client.post("/login", data={"username": "admin", "password": "ChangeMeImmediately123!"})
+            assert response.status_code == 302
+            yield client
+    finally:
+        app.config["WTF_CSRF_ENABLED"] = csrf
+
+
+@pytest.mark.parametrize("kind, url, data", [
+    ("cargo", "/admin/cargos/add", {"cargo_type": "новый груз", "train_id": "1"}),
+    ("train", "/admin/trains/add", {"name": "KZ-NEW"}),
+])
+def test_added_object_reaches_waiting_subscriber(admin, kind, url, data):
+    # Подписка на ID, которого ещё нет: поток показывает «не найдено» до появления объекта
+    subscription = live.broker.subscribe([(kind, 2)])
+    try:
+        assert admin.post(url, data=data).status_code == 302
+        key, record = subscription.get(timeout=1)
+    finally:
+        live.broker.unsubscribe(subscription)
+    assert key == (kind, 2)
+    assert record is not None and record[f"{kind}_id"] == 2
+
+
+def test_published_counter_is_exact_under_threads():
+    broker = live.Broker()
+
+    def publish():
+        for i in range(2000):
+            broker.publish(("cargo", i), None)
+    threads = [threading.Thread(target=publish) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert broker.published == 16000
@@ -0,0 +1,47 @@
+import json
+import logging
+import queue
+
+from log_pipeline import DroppingQueueHandler, JsonFormatter, parse_sampling
+
+
+def _logged(log):
+    records = queue.Queue()
+    logger = logging.getLogger("test_log_pipeline")
+    logger.propagate = False
+    handler = DroppingQueueHandler(records)
+    logger.addHandler(handler)
+    try:
+        log(logger)
+    finally:
+        logger.removeHandler(handler)
+    return json.loads(JsonFormatter().format(records.get_nowait()))
+
+
+def test_exception_is_separate_from_message():
+    def log(logger):
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.error("boom %s", 42, exc_info=True)
+    entry = _logged(log)
+    assert entry["message"] == "boom 42"
+    assert entry["exc"].startswith("Traceback") and "ZeroDivisionError" in entry["exc"]
+
+
+def test_plain_record_has_no_exc_and_keeps_extra():
+    entry = _logged(lambda logger: logger.warning("ok", extra={"status": 200}))
+    assert entry["message"] == "ok" and entry["status"] == 200
+    assert "exc" not in entry
+
+
+def test_full_queue_drops_instead_of_blocking():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+    record = logging.LogRecord("x", logging.INFO, __file__, 1, "m", None, None)
+    handler.handle(record)
+    handler.handle(record) # не блокирует и не бросает
+    assert handler.queue.qsize() == 1
+
+
+def test_parse_sampling():
+    assert parse_sampling("INFO=0.1, debug=0, bogus=1, WARNING") == {logging.INFO: 0.1, logging.DEBUG: 0.0}
@@ -0,0 +1,40 @@
+import logging
+
+import metrics
+from page_cache import page_cache
+
+
+class _Records(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+def _requests_total():
+    return sum(value for _, _, value in metrics.REQUESTS_TOTAL.samples())
+
+
+def test_warm_fills_cache_without_counting_traffic(engine):
+    from app import app
+    page_cache.purge()
+    records = _Records()
+    app.logger.addHandler(records)
+    try:
+        before = _requests_total()
+        warmed = page_cache.warm(app)
+        assert _requests_total() == before
+    finally:
+        app.logger.removeHandler(records)
+
+    assert warmed == len(page_cache.endpoints) > 0
+    assert len(page_cache.store) == warmed
+    assert [r for r in records.records if r.getMessage() == "request"] == []
+
+    # Обычный запрос по-прежнему считается и отдаётся из кэша
+    with app.test_client() as client:
+        response = client.get("/")
+    assert response.status_code == 200
+    assert _requests_total() == before + 1
@@ -0,0 +1,67 @@
+from models import Cargo
+from queries import keyset_page, apply_cargo_filters
+
+
+def _add_cargos(session, count):
+    session.add_all(Cargo(cargo_type=f"груз {i}", status="В пути" if i % 3 else "Доставлен")
+                    for i in range(count))
+    session.commit()
+
+
+def _ids(page):
+    return [cargo.cargo_id for cargo in page]
+
+
+def test_keyset_forward_covers_all_rows_once(session):
+    _add_cargos(session, 25)
+    all_ids = [row.cargo_id for row in session.query(Cargo).order_by(Cargo.cargo_id)]
+
+    seen, after, pages = [], None, []
+    while True:
+        page = keyset_page(session.query(Cargo), Cargo.cargo_id, 10, after=after)
+        pages.append(page)
+        seen.extend(_ids(page))
+        if page.next_cursor is None:
+            break
+        after = page.next_cursor
+
+    assert seen == all_ids
+    assert [len(page) for page in pages] == [10, 10, 6]
+    assert pages[0].prev_cursor is None
+    assert all(page.prev_cursor == _ids(page)[0] for page in pages[1:])
+
+
+def test_keyset_before_returns_previous_page(session):
+    _add_cargos(session, 25)
+    query = session.query(Cargo)
+    first = keyset_page(query, Cargo.cargo_id, 10)
+    second = keyset_page(query, Cargo.cargo_id, 10, after=first.next_cursor)
+
+    back = keyset_page(query, Cargo.cargo_id, 10, before=second.prev_cursor)
+    assert _ids(back) == _ids(first)
+    assert back.prev_cursor is None # это первая страница
+    assert back.next_cursor == first.next_cursor
+
+
+def test_keyset_exact_multiple_has_no_empty_last_page(session):
+    session.query(Cargo).delete()
+    _add_cargos(session, 20)
+    first = keyset_page(session.query(Cargo), Cargo.cargo_id, 10)
+    second = keyset_page(session.query(Cargo), Cargo.cargo_id, 10, after=first.next_cursor)
+    assert len(second) == 10
+    assert second.next_cursor is None
+
+
+def test_keyset_respects_filters(session):
+    _add_cargos(session, 30)
+    query = apply_cargo_filters(session.query(Cargo), {"status": "Доставлен"})
+    expected = [row.cargo_id for row in query.order_by(Cargo.cargo_id)]
+
+    seen, after = [], None
+    while True:
+        page = keyset_page(query, Cargo.cargo_id, 4, after=after)
+        seen.extend(_ids(page))
+        if page.next_cursor is None:
+            break
+        after = page.next_cursor
+    assert seen == expected
@@ -0,0 +1,96 @@
+import random
+
+import history
+import routing
+from models import Cargo, Train
+
+STATIONS = ["Алматы", "Балхаш", "Караганда", "Астана", "Кокшетау", "Петропавловск"]
+
+
+def _set(engine, a, b, km):
+    with engine.begin() as conn:
+        return routing.set_segment(conn, a, b, km)
+
+
+def _delete(engine, a, b):
+    segment_id = next(s.segment_id for s in routing.segments() if {s[1], s[2]} == {a, b})
+    with engine.begin() as conn:
+        return routing.delete_segment(conn, segment_id)
+
+
+def _rebuild(engine):
+    with engine.begin() as conn:
+        return routing.rebuild(conn)
+
+
+def test_incremental_updates_match_full_rebuild(engine):
+    rng = random.Random(21)
+    present = set()
+    for _ in range(60):
+        a, b = sorted(rng.sample(STATIONS, 2))
+        if (a, b) in present and rng.random() < 0.3:
+            _delete(engine, a, b)
+            present.discard((a, b))
+        else:
+            _set(engine, a, b, rng.randint(50, 900))
+            present.add((a, b))
+        # Полный пересчёт не находит, что исправить
+        assert _rebuild(engine) == (0, 0)
+
+
+def test_shorter_and_removed_segments(engine):
+    _set(engine, "Алматы", "Балхаш", 100)
+    _set(engine, "Балхаш", "Астана", 50)
+    _set(engine, "Алматы", "Астана", 200)
+    assert routing.distance("Алматы", "Астана") == 150
+
+    _set(engine, "Алматы", "Астана", 120)
+    assert routing.distance("Алматы", "Астана") == 120
+    assert routing.distance("Астана", "Алматы") == 120
+
+    _set(engine, "Алматы", "Астана", 400)
+    assert routing.distance("Алматы", "Астана") == 150
+
+    _delete(engine, "Балхаш", "Астана")
+    assert routing.distance("Балхаш", "Астана") == 500 # через Алматы
+    _delete(engine, "Алматы", "Астана")
+    assert routing.distance("Балхаш", "Астана") is None
+
+
+def test_rows_follow_network_and_own_stations(session, engine):
+    _set(engine, "Алматы", "Балхаш", 100)
+    _set(engine, "Балхаш", "Астана", 50)
+    train = Train(name="R-1", last_operation_station="Алматы", arrival_station="Астана", distance_to_arrival=999)
+    cargo = Cargo(cargo_type="лес", current_station="Балхаш", next_station="Астана", distance_to_arrival=999)
+    offnet = Cargo(cargo_type="соль", current_station="Шымкент", next_station="Астана", distance_to_arrival=77)
+    session.add_all([train, cargo, offnet])
+    session.commit()
+
+    def distances():
+        session.expire_all()
+        return train.distance_to_arrival, cargo.distance_to_arrival, offnet.distance_to_arrival
+
+    # Триггеры INSERT подставляют расстояние по сети; вне сети остаётся введённое
+    assert distances() == (150, 50, 77)
+
+    # Изменение участка пересчитывает строки на затронутых парах
+    _set(engine, "Балхаш", "Астана", 80)
+    assert distances() == (180, 80, 77)
+
+    # Груз переехал - триггер UPDATE берёт расстояние от новой станции
+    cargo.current_station = "Алматы"
+    session.commit()
+    assert distances() == (180, 180, 77)
+    cargo.current_station = "Астана"
+    session.commit()
+    assert distances() == (180, 0, 77)
+
+    # Каждое изменение - одно событие журнала, сразу с расстоянием по сети
+    events, _ = history.timeline("cargo", cargo.cargo_id)
+    assert [(e["station"], e["distance_to_arrival"]) for e in reversed(events)] == [
+        ("Балхаш", 50), ("Балхаш", 80), ("Алматы", 180), ("Астана", 0),
+    ]
+    events, _ = history.timeline("train", train.train_id)
+    assert [(e["station"], e["distance_to_arrival"]) for e in reversed(events)] == [
+        ("Алматы", 150), ("Алматы", 180),
+    ]
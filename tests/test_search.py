@@ -0,0 +1,56 @@
+from sqlalchemy import text
+
+import search
+from models import Cargo, Train
+
+
+def _found(kind, query):
+    pk = "cargo_id" if kind == "cargos" else "train_id"
+    return [getattr(item, pk) for item in search.search(kind, query)]
+
+
+def test_insert_update_delete_keep_index_in_sync(session):
+    cargo = Cargo(cargo_type="Ёлочные игрушки", current_station="Павлодар")
+    session.add(cargo)
+    session.commit()
+    # ё в индексе и в запросе сводится к е
+    assert _found("cargos", "елочные") == [cargo.cargo_id]
+    assert _found("cargos", "Ёлоч") == [cargo.cargo_id]
+
+    cargo.cargo_type = "Цемент"
+    session.commit()
+    assert _found("cargos", "елочные") == []
+    assert _found("cargos", "цемент") == [cargo.cargo_id]
+
+    session.delete(cargo)
+    session.commit()
+    assert _found("cargos", "цемент") == []
+
+
+def test_raw_sql_writes_are_indexed(engine):
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO trains (name, last_operation_station) VALUES ('KZ-777', 'Семей')"))
+        train_id = conn.execute(text("SELECT train_id FROM trains WHERE name = 'KZ-777'")).scalar()
+    assert _found("trains", "семей") == [train_id]
+
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE trains SET last_operation_station = 'Атырау' WHERE train_id = :id"),
+                     {"id": train_id})
+    assert _found("trains", "семей") == []
+    assert _found("trains", "атырау") == [train_id]
+
+
+def test_rebuild_matches_trigger_maintained_index(session, engine):
+    session.add_all(Train(name=f"ЁЖ-{i}", last_operation_station="Актобе") for i in range(5))
+    session.commit()
+    before = sorted(_found("trains", "еж"))
+    with engine.begin() as conn:
+        search.rebuild(conn)
+    assert sorted(_found("trains", "еж")) == before
+    assert len(before) == 5
+
+
+def test_match_query_escapes_user_syntax():
+    assert search.build_match_query('KZ-001 "алм') == '"KZ"* "001"* "алм"*'
+    assert search.build_match_query("в пути") == '"в" "пути"*'
+    assert search.build_match_query("  -- ") is None
@@ -0,0 +1,73 @@
+import random
+
+from sqlalchemy import text
+
+import bulk_ops
+import summary
+from models import Cargo, Train
+
+
+def _drift(engine):
+    with engine.begin() as conn:
+        return summary.rebuild(conn)
+
+
+def test_counters_follow_orm_and_bulk_writes(session, engine):
+    rng = random.Random(7)
+    statuses = ["Погрузка", "В пути", "Доставлен", None]
+    trains = [Train(name=f"T-{i}", distance_to_arrival=rng.choice([None, 0, 120])) for i in range(4)]
+    session.add_all(trains)
+    session.commit()
+    cargos = [Cargo(cargo_type=f"c{i}", train_id=rng.choice([None] + [t.train_id for t in trains]),
+                    status=rng.choice(statuses), distance_to_arrival=rng.choice([None, 10, 250]))
+              for i in range(60)]
+    session.add_all(cargos)
+    session.commit()
+    assert _drift(engine) == 0
+
+    for cargo in rng.sample(cargos, 20):
+        cargo.status = rng.choice(statuses)
+        cargo.train_id = rng.choice([None] + [t.train_id for t in trains])
+        cargo.distance_to_arrival = rng.choice([None, 5, 300])
+    trains[0].distance_to_arrival = None
+    trains[1].distance_to_arrival = 0
+    session.commit()
+    assert _drift(engine) == 0
+
+    ids = [c.cargo_id for c in cargos[:15]]
+    bulk_ops.run("cargos", "set_status", ids, value="Доставлен")
+    bulk_ops.run("cargos", "delete", [c.cargo_id for c in cargos[15:25]])
+    bulk_ops.run("trains", "delete", [trains[2].train_id])
+    assert _drift(engine) == 0
+
+
+def test_update_of_unrelated_column_leaves_counters(session, engine):
+    cargo = Cargo(cargo_type="уголь", status="В пути")
+    session.add(cargo)
+    session.commit()
+    with engine.connect() as conn:
+        before = conn.execute(text("SELECT * FROM summary_counters ORDER BY metric, key")).all()
+    cargo.cargo_type = "руда"
+    session.commit()
+    with engine.connect() as conn:
+        after = conn.execute(text("SELECT * FROM summary_counters ORDER BY metric, key")).all()
+    assert after == before
+
+
+def test_rebuild_reports_and_fixes_drift(engine):
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE summary_counters SET value = value + 5 WHERE metric = 'cargo_status'"))
+    assert _drift(engine) > 0
+    assert _drift(engine) == 0
+
+
+def test_zeroed_keys_are_pruned(session, engine):
+    cargo = Cargo(cargo_type="зерно", status="Редкий статус")
+    session.add(cargo)
+    session.commit()
+    session.delete(cargo)
+    session.commit()
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT 1 FROM summary_counters WHERE key = 'Редкий статус'")).all()
+    assert rows == []
+    assert _drift(engine) == 0
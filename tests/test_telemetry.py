@@ -0,0 +1,68 @@
+import datetime
+
+import routing
+import telemetry
+from models import Cargo, Train
+
+
+def _train(session, **fields):
+    train = Train(name="TL-1", arrival_station="Астана", last_operation_station="Кокшетау",
+                  last_operation_time=datetime.datetime(2026, 10, 18, 8, 0),
+                  distance_to_arrival=300, operation_desc="Отправление", **fields)
+    session.add(train)
+    session.commit()
+    return train
+
+
+def test_batch_is_validated_and_coalesced_per_train(session):
+    train = _train(session)
+    result = telemetry.ingest([
+        {"train_id": train.train_id, "station": "Щучинск", "time": "2026-10-18T10:00:00"},
+        {"train_id": train.train_id, "station": "Бурабай", "time": "2026-10-18T09:00:00"},
+        {"train_id": train.train_id, "station": "Старое", "time": "2026-10-18T07:00:00"},
+        {"train_id": 404, "station": "Где-то", "time": "2026-10-18T10:00:00"},
+        {"train_id": True, "station": "X"},
+        {"train_id": train.train_id, "station": "  "},
+        "не объект",
+    ])
+    assert result.as_dict() == {
+        "received": 7, "trains_updated": 1, "cargos_updated": 0, "coalesced": 2, "stale": 0,
+        "unknown_trains": [404],
+        "rejected": [{"index": 4, "error": "train_id обязателен"},
+                     {"index": 5, "error": "station обязательна"},
+                     {"index": 6, "error": "ожидался JSON-объект"}],
+    }
+    session.expire_all()
+    assert train.last_operation_station == "Щучинск"
+    # Полей, которых нет в событии, телеметрия не затирает
+    assert (train.distance_to_arrival, train.operation_desc) == (300, "Отправление")
+
+    # Событие старее записанного отбрасывается
+    stale = telemetry.ingest([{"train_id": train.train_id, "station": "Бурабай",
+                               "time": "2026-10-18T09:30:00"}])
+    assert (stale.stale, stale.trains_updated) == (1, 0)
+
+
+def test_position_cascades_to_cargos_except_frozen(session, engine):
+    with engine.begin() as conn:
+        routing.set_segment(conn, "Кокшетау", "Щучинск", 70)
+        routing.set_segment(conn, "Щучинск", "Астана", 230)
+    train = _train(session)
+    moving = Cargo(cargo_type="зерно", train=train, status="В пути",
+                   current_station="Кокшетау", next_station="Астана")
+    done = Cargo(cargo_type="лес", train=train, status="Доставлен",
+                 current_station="Астана", next_station="Астана")
+    session.add_all([moving, done])
+    session.commit()
+
+    when = datetime.datetime(2026, 10, 18, 11, 0)
+    result = telemetry.ingest([{"train_id": train.train_id, "station": "Щучинск", "time": when.isoformat(),
+                                "operation_desc": "Прибытие"}], frozen_statuses=("Доставлен",))
+    assert (result.trains_updated, result.cargos_updated) == (1, 1)
+
+    session.expire_all()
+    assert (moving.current_station, moving.last_stop_time, moving.last_operation) == ("Щучинск", when, "Прибытие")
+    # Расстояние груза - до его next_station по сети, а не копия расстояния поезда
+    assert moving.distance_to_arrival == 230
+    assert train.distance_to_arrival == 230
+    assert (done.current_station, done.last_operation) == ("Астана", None)
@@ -0,0 +1,176 @@
+"""
+tracking.py
+
+Read-through кэш результатов отслеживания (/track).
+
+В кэше лежат не ORM-объекты, а сериализованные словари: их можно безопасно
+отдавать в шаблон после закрытия сессии и между запросами.
+Ключ записи - (search_type, id). Все записи, зависящие от поезда
+(сам поезд и его грузы - в карточке груза выводится имя поезда),
+помечены тегом ("train", train_id).
+"""
+
+import datetime
+
+from sqlalchemy import select
+from sqlalchemy.orm import joinedload
+
+from cache import TTLCache
+from config import Config
+from models import ReadSessionLocal, Train, Cargo
+
+tracking_cache = TTLCache(maxsize=Config.TRACK_CACHE_SIZE, ttl=Config.TRACK_CACHE_TTL)
+
+
+def serialize_train(train):
+    """Train -> dict с полями, которые показывает track.html."""
+    return {
+        "train_id": train.train_id,
+        "name": train.name,
+        "departure_station": train.departure_station,
+        "arrival_station": train.arrival_station,
+        "departure_time": train.departure_time,
+        "arrival_time": train.arrival_time,
+        "last_operation_station": train.last_operation_station,
+        "last_operation_time": train.last_operation_time,
+        "distance_to_arrival": train.distance_to_arrival,
+        "operation_desc": train.operation_desc,
+    }
+
+
+def serialize_cargo(cargo):
+    """Cargo -> dict; поезд встраивается кратко (id и имя)."""
+    return {
+        "cargo_id": cargo.cargo_id,
+        "cargo_type": cargo.cargo_type,
+        "train_id": cargo.train_id,
+        "current_station": cargo.current_station,
+        "status": cargo.status,
+        "last_stop_time": cargo.last_stop_time,
+        "next_station": cargo.next_station,
+        "distance_to_arrival": cargo.distance_to_arrival,
+        "last_operation": cargo.last_operation,
+        "eta": cargo.eta,
+        "train": {"train_id": cargo.train.train_id, "name": cargo.train.name} if cargo.train else None,
+    }
+
+
+def to_json(record):
+    """Сериализованный результат -> dict, пригодный для JSON (datetime -> ISO 8601)."""
+    if record is None:
+        return None
+    return {k: v.isoformat() if isinstance(v, datetime.datetime) else v for k, v in record.items()}
+
+
+def _load(search_type, identifier):
+    # Публичное чтение - через read-only engine, не конкурирует с записями админки
+    with ReadSessionLocal() as db:
+        if search_type == "cargo":
+            cargo = (db.query(Cargo).options(joinedload(Cargo.train))
+                     .filter(Cargo.cargo_id == identifier).first())
+            return serialize_cargo(cargo) if cargo else None
+        if search_type == "train":
+            train = db.query(Train).filter(Train.train_id == identifier).first()
+            return serialize_train(train) if train else None
+    raise ValueError(f"Неизвестный тип поиска: {search_type}")
+
+
+def lookup(search_type, identifier):
+    """
+    Возвращает сериализованный результат отслеживания или None, если объект не найден.
+    Отсутствующие объекты не кэшируются, поэтому только что добавленный груз
+    виден сразу.
+    """
+    result = tracking_cache.get((search_type, identifier))
+    if result is not None:
+        return result
+
+    result = _load(search_type, identifier)
+    if result is not None:
+        _store(search_type, identifier, result)
+    return result
+
+
+def _many_query(search_type, identifiers):
+    """SELECT нескольких объектов одним WHERE id IN (...) - общий для синхронного и async-чтения."""
+    if search_type == "cargo":
+        return select(Cargo).options(joinedload(Cargo.train)).where(Cargo.cargo_id.in_(identifiers))
+    if search_type == "train":
+        return select(Train).where(Train.train_id.in_(identifiers))
+    raise ValueError(f"Неизвестный тип поиска: {search_type}")
+
+
+def _serialize_many(search_type, rows):
+    if search_type == "cargo":
+        return {c.cargo_id: serialize_cargo(c) for c in rows}
+    return {t.train_id: serialize_train(t) for t in rows}
+
+
+def _load_many(search_type, identifiers):
+    """Загружает несколько объектов одним запросом WHERE id IN (...)."""
+    query = _many_query(search_type, identifiers)
+    with ReadSessionLocal() as db:
+        return _serialize_many(search_type, db.execute(query).scalars().all())
+
+
+def _from_cache(search_type, identifiers):
+    """Разбирает ID на найденные в кэше ({id: результат}) и промахи (список)."""
+    results = {}
+    missing = []
+    for identifier in identifiers:
+        cached = tracking_cache.get((search_type, identifier))
+        if cached is not None:
+            results[identifier] = cached
+        else:
+            missing.append(identifier)
+    return results, missing
+
+
+def _merge_loaded(search_type, results, missing, loaded):
+    for identifier in missing:
+        result = loaded.get(identifier)
+        results[identifier] = result
+        if result is not None:
+            _store(search_type, identifier, result)
+    return results
+
+
+def lookup_many(search_type, identifiers):
+    """
+    Пакетная версия lookup: {id: результат или None}.
+    Сначала смотрим в кэш, все промахи добираем одним IN-запросом.
+    """
+    results, missing = _from_cache(search_type, identifiers)
+    if missing:
+        _merge_loaded(search_type, results, missing, _load_many(search_type, missing))
+    return results
+
+
+async def lookup_many_async(search_type, identifiers, session_factory):
+    """
+    То же для asyncio (asgi.py): кэш общий с синхронной версией,
+    промахи читаются через async-сессию session_factory без блокировки цикла событий.
+    """
+    results, missing = _from_cache(search_type, identifiers)
+    if missing:
+        async with session_factory() as db:
+            rows = (await db.execute(_many_query(search_type, missing))).scalars().all()
+        _merge_loaded(search_type, results, missing, _serialize_many(search_type, rows))
+    return results
+
+
+def _store(search_type, identifier, result):
+    train_id = result["train_id"]
+    tags = (("train", train_id),) if train_id is not None else ()
+    tracking_cache.set((search_type, identifier), result, tags=tags)
+
+
+def invalidate_cargo(cargo_id):
+    """Сбрасывает запись груза. Вызывать после commit изменения/удаления груза."""
+    tracking_cache.delete(("cargo", cargo_id))
+
+
+def invalidate_train(train_id):
+    """Сбрасывает запись поезда и всех его грузов (они встраивают имя поезда)."""
+    tracking_cache.delete(("train", train_id))
+    tracking_cache.invalidate_tag(("train", train_id))
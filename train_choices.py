@@ -0,0 +1,95 @@
+"""
+train_choices.py
+
+Общий кэш пар (train_id, name) для форм грузов.
+
+Раньше cargo_add / cargo_edit на каждый GET и POST заново выбирали все поезда
+(а при ошибке - ещё раз, во второй сессии) и отдельным count() проверяли,
+что выбранный поезд существует. Теперь список грузится один раз и
+переиспользуется до инвалидации (вставка/изменение/удаление поезда) или
+истечения TTL - он ограничивает устаревание между воркерами.
+"""
+
+import bisect
+import threading
+import time
+
+from config import Config
+from models import ReadSessionLocal, Train
+
+
+class TrainChoices:
+    """
+    Версионированный снимок списка поездов.
+    invalidate() увеличивает версию; снимок со старой версией
+    при следующем обращении перезагружается.
+    """
+
+    def __init__(self, ttl=60, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.version = 0
+        self._snapshot = None  # (version, loaded_at, names_by_id, search_index)
+
+    def invalidate(self):
+        with self._lock:
+            self.version += 1
+
+    def _load(self):
+        with ReadSessionLocal() as db:
+            rows = db.query(Train.train_id, Train.name).order_by(Train.name).all()
+        names_by_id = dict(rows)
+        # Для подсказок: отсортированные (имя в нижнем регистре, id, имя) - поиск по префиксу через bisect
+        search_index = sorted(((name or "").casefold(), train_id, name) for train_id, name in rows)
+        return names_by_id, search_index
+
+    def _get(self):
+        snapshot = self._snapshot
+        now = self._clock()
+        if snapshot and snapshot[0] == self.version and now - snapshot[1] < self.ttl:
+            return snapshot
+        version = self.version
+        names_by_id, search_index = self._load()
+        snapshot = (version, now, names_by_id, search_index)
+        with self._lock:
+            # Если пока грузили, кто-то инвалидировал - снимок всё равно вернём,
+            # но сохранять не будем: следующий вызов перезагрузит
+            if version == self.version:
+                self._snapshot = snapshot
+        return snapshot
+
+    def exists(self, train_id):
+        """
+        Проверка существования поезда. Попадание в снимок - без запроса к БД;
+        при промахе проверяем по первичному ключу (поезд мог появиться в другом воркере).
+        """
+        if train_id is None:
+            return False
+        if train_id in self._get()[2]:
+            return True
+        with ReadSessionLocal() as db:
+            found = db.query(Train.train_id).filter(Train.train_id == train_id).first() is not None
+        if found:
+            self.invalidate()
+        return found
+
+    def search(self, query, limit=20):
+        """Подсказки для автодополнения: поезда, чьё имя начинается с query (без учёта регистра), или с таким ID."""
+        _, _, names_by_id, search_index = self._get()
+        query = (query or "").strip()
+        results = []
+        if query.isdigit() and int(query) in names_by_id:
+            results.append((int(query), names_by_id[int(query)]))
+        prefix = query.casefold()
+        start = bisect.bisect_left(search_index, (prefix,))
+        for folded, train_id, name in search_index[start:]:
+            if len(results) >= limit or not folded.startswith(prefix):
+                break
+            if results and results[0][0] == train_id:
+                continue
+            results.append((train_id, name))
+        return results
+
+
+train_choices = TrainChoices(ttl=Config.TRAIN_CHOICES_TTL)